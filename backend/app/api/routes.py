@@ -1,16 +1,51 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse, JSONResponse
-from typing import List, Optional
+from fastapi import APIRouter, File, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, Response
+from typing import Dict, List, Optional
+from email.utils import formatdate, parsedate_to_datetime
 import os
+import stat as stat_lib
+import time
 import uuid
 from pathlib import Path
 import json
+import asyncio
 
+from app.core.admission import AdmissionRejected, try_on_admission
 from app.core.config import settings
-from app.services.virtual_tryon import process_virtual_tryon, virtual_tryon_service
+from app.core.memory_budget import memory_governor
+from app.core.metrics import try_on_latency
+from app.core.process_stats import rss_bytes, worker_memory
+from app.services.catalogue import garment_catalogue
+from app.services.file_io import is_readable, path_exists, remove_files, stat
+from app.services.garment_warp import garment_warper
+from app.services.pipeline import pool_stats
+from app.services.shm_transport import get_frame_executor
+from app.services.task_queue import get_broker
+from app.services.trace_artifacts import trace_recorder
+from app.services.virtual_tryon import process_progressive_tryon, process_virtual_tryon, virtual_tryon_service
+from app.services.ws_hub import ws_hub
 
 router = APIRouter()
 
+def result_url_for(result_path: str) -> str:
+    """URL under which a generated result is served by get_result."""
+    return f"/api/results/{os.path.basename(result_path)}"
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing header value for per-stage timings in milliseconds."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+def admission_client_id(request: Request, client_id: Optional[str]) -> str:
+    """
+    Fairness key for admission control: explicit client_id, else the peer
+    address. Only an explicit client_id is held to ADMISSION_PER_CLIENT_LIMIT,
+    since clients behind one proxy or NAT share an address.
+    """
+    if client_id:
+        return client_id
+    return request.client.host if request.client else "anonymous"
+
+
 @router.post("/upload/image")
 async def upload_image(file: UploadFile = File(...)):
     """
@@ -28,21 +63,58 @@ logger = logging.getLogger(__name__)
 
 @router.post("/try-on")
 async def virtual_try_on(
+    request: Request,
+    response: Response,
     user_image: str = "",
     garment_image: str = "",
     user_image_file: UploadFile = None,
-    garment_image_file: UploadFile = None
+    garment_image_file: UploadFile = None,
+    pose_backend: Optional[str] = None,
+    client_id: Optional[str] = None,
+    garment_id: Optional[str] = None,
+    trace: bool = False
 ):
     """
     Process virtual try-on with the provided images.
     Accepts either file paths or file uploads.
+    A catalogue garment_id (see /api/garments) can be given instead of a
+    garment image; its preprocessing was done at ingestion.
+    Optionally overrides the pose backend (see /api/pose-backends).
+    With trace=true (and TRACE_ON_REQUEST enabled) the pose overlay and
+    garment masks are written under TRACE_DIR for debugging.
+    
+    Requests are admission controlled per client_id (default: the client
+    address, which is queued fairly but not limited); when saturated the
+    endpoint answers 429/503 with Retry-After.
+    
+    The response carries the per-stage timings in milliseconds, also as a
+    Server-Timing header; they are empty for a request that joined an
+    identical one already running.
     """
     logger.info("=== Starting virtual try-on request ===")
     request_id = str(uuid.uuid4())
     logger.info(f"Request ID: {request_id}")
     
-    # Track if we need to clean up uploaded files
+    if pose_backend and pose_backend not in virtual_tryon_service.pose_estimator.backends:
+        raise HTTPException(status_code=400, detail=f"Pose backend not available: {pose_backend}")
+    
+    if garment_id and await asyncio.to_thread(garment_catalogue.entry, garment_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown garment_id: {garment_id}")
+    
+    client_key = admission_client_id(request, client_id)
+    try:
+        await try_on_admission.acquire(client_key, limited=bool(client_id))
+    except AdmissionRejected as e:
+        logger.info(f"Request {request_id} rejected with {e.status_code}: {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
+    admitted_at = time.monotonic()
+    # Only 5xx count toward the error rate; 4xx are the client's mistakes
+    server_error = False
+    
+    # Track if we need to clean up uploaded files; once handed to the try-on
+    # they are deleted when the (possibly shared) computation is done with them
     uploaded_files = []
+    handed_over = False
     
     try:
         # Handle file uploads if provided
@@ -61,7 +133,10 @@ async def virtual_try_on(
             user_image_path = user_image
             logger.info(f"Using provided user image path: {user_image_path}")
         
-        if garment_image_file:
+        if garment_id:
+            garment_image_path = None
+            logger.info(f"Using catalogue garment: {garment_id}")
+        elif garment_image_file:
             logger.info("Processing garment image file upload")
             try:
                 garment_image = await virtual_tryon_service.process_image_upload(garment_image_file)
@@ -78,22 +153,22 @@ async def virtual_try_on(
         
         # Verify files exist and are accessible
         try:
-            if not os.path.exists(user_image_path):
+            if not await path_exists(user_image_path):
                 error_msg = f"User image not found at path: {user_image_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=400, detail=error_msg)
                 
-            if not os.access(user_image_path, os.R_OK):
+            if not await is_readable(user_image_path):
                 error_msg = f"Cannot read user image at path: {user_image_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=400, detail=error_msg)
                 
-            if not os.path.exists(garment_image_path):
+            if garment_image_path is not None and not await path_exists(garment_image_path):
                 error_msg = f"Garment image not found at path: {garment_image_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=400, detail=error_msg)
                 
-            if not os.access(garment_image_path, os.R_OK):
+            if garment_image_path is not None and not await is_readable(garment_image_path):
                 error_msg = f"Cannot read garment image at path: {garment_image_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=400, detail=error_msg)
@@ -106,33 +181,31 @@ async def virtual_try_on(
         try:
             logger.info("Starting virtual try-on processing...")
             # Process the virtual try-on
-            result_path = await process_virtual_tryon(user_image_path, garment_image_path)
+            timings: Dict[str, float] = {}
+            handed_over = True
+            result_path = await process_virtual_tryon(
+                user_image_path, garment_image_path, pose_backend, garment_id=garment_id, trace=trace,
+                timings=timings, cleanup=uploaded_files
+            )
             
-            if not result_path or not os.path.exists(result_path):
+            if not result_path or not await path_exists(result_path):
                 error_msg = f"Failed to generate result image. Result path: {result_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=500, detail=error_msg)
             
             # Verify the result file is accessible
-            if not os.access(result_path, os.R_OK):
+            if not await is_readable(result_path):
                 error_msg = f"Cannot read generated result image at path: {result_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=500, detail=error_msg)
             
-            # Return relative URL to the result
-            result_url = result_path.replace('\\', '/').split('static/')[-1]
-            logger.info(f"Virtual try-on completed successfully. Result URL: /static/{result_url}")
-            
-            # Clean up uploaded files if they're not needed anymore
-            for file_path in uploaded_files:
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        logger.info(f"Cleaned up temporary file: {file_path}")
-                except Exception as e:
-                    logger.warning(f"Failed to clean up temporary file {file_path}: {str(e)}")
+            # Return URL of the result; the try-on deleted the uploaded files when done with them
+            result_url = result_url_for(result_path)
+            logger.info(f"Virtual try-on completed successfully. Result URL: {result_url}")
             
-            return {"result_url": f"/static/{result_url}"}
+            if timings:
+                response.headers["Server-Timing"] = server_timing(timings)
+            return {"result_url": result_url, "timings": timings}
             
         except HTTPException:
             raise  # Re-raise HTTP exceptions as-is
@@ -145,22 +218,22 @@ async def virtual_try_on(
     except HTTPException as http_err:
         # Log the HTTP error details
         logger.error(f"HTTP error {http_err.status_code}: {http_err.detail}")
+        server_error = http_err.status_code >= 500
         raise
         
     except Exception as e:
+        server_error = True
         error_msg = f"Unexpected error in virtual try-on endpoint: {str(e)}"
         logger.error(error_msg, exc_info=True)
         raise HTTPException(status_code=500, detail=error_msg)
         
     finally:
-        # Ensure any temporary files are cleaned up
-        for file_path in uploaded_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Cleaned up temporary file in finally block: {file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to clean up temporary file {file_path} in finally block: {str(e)}")
+        try_on_admission.release(client_key, time.monotonic() - admitted_at)
+        try_on_latency.record(time.monotonic() - admitted_at, ok=not server_error)
+        
+        # Ensure temporary files are cleaned up if the try-on never took them over
+        if not handed_over:
+            await remove_files(uploaded_files)
         
         logger.info(f"=== Completed virtual try-on request {request_id} ===")
 
@@ -168,33 +241,273 @@ async def virtual_try_on(
 async def websocket_try_on(websocket: WebSocket, client_id: str):
     """
     WebSocket endpoint for real-time virtual try-on.
+    
+    Besides try_on requests, clients may send subscribe/unsubscribe messages
+    with a topic. While a try-on runs the client receives progress messages
+    (one per finished stage, coalesced if the client falls behind).
+    
+    With "progressive": true in a try_on message, a low-resolution "preview"
+    message is sent first and the full-quality "result" follows. Progressive
+    try-ons need a garment_image and run in the API process only
+    (COMPUTE_MODE=local); otherwise an "error" message is sent.
+    
+    Malformed messages (not a JSON object, missing or non-string fields,
+    unknown type) are answered with an "error" message; the connection stays
+    open.
     """
-    await websocket.accept()
+    connection = await ws_hub.connect(websocket, client_id)
+    
+    def progress(stage: str, ms: float) -> None:
+        ws_hub.send_threadsafe(client_id, {"type": "progress", "stage": stage, "ms": round(ms, 1)},
+                               coalesce_key="progress")
+    
+    def reject(detail: str) -> None:
+        ws_hub.push(connection, {"type": "error", "status": 400, "detail": detail})
+    
     try:
         while True:
-            # Receive message from client
-            data = await websocket.receive_json()
+            # Receive message from client; malformed messages get an error reply
+            # and the connection stays open
+            text = await websocket.receive_text()
+            try:
+                data = json.loads(text)
+            except ValueError:
+                reject("Messages must be JSON objects")
+                continue
+            if not isinstance(data, dict):
+                reject("Messages must be JSON objects")
+                continue
             
             # Process message
-            if data["type"] == "try_on":
-                # Process the try-on request
-                result_path = await process_virtual_tryon(
-                    data["user_image"], 
-                    data["garment_image"]
-                )
+            message_type = data.get("type")
+            if message_type in ("subscribe", "unsubscribe"):
+                if not isinstance(data.get("topic"), str):
+                    reject(f"{message_type} needs a string topic")
+                elif message_type == "subscribe":
+                    ws_hub.subscribe(connection, data["topic"])
+                else:
+                    ws_hub.unsubscribe(connection, data["topic"])
+            elif message_type == "try_on":
+                invalid = [key for key in ("user_image", "garment_image", "garment_id", "pose_backend")
+                           if data.get(key) is not None and not isinstance(data[key], str)]
+                if invalid:
+                    reject(f"Fields must be strings: {', '.join(invalid)}")
+                    continue
+                if not data.get("user_image"):
+                    reject("try_on needs a user_image")
+                    continue
+                if not data.get("garment_image") and not data.get("garment_id"):
+                    reject("try_on needs a garment_image or a garment_id")
+                    continue
+                if data.get("progressive") and data.get("garment_id"):
+                    # Catalogue garments need no preparation, so there is nothing to preview
+                    reject("Progressive try-on does not support garment_id; send garment_image")
+                    continue
+                
+                # Process the try-on request, sharing the HTTP endpoint's admission limits
+                timings: Dict[str, float] = {}
+                try:
+                    async with try_on_admission.admit(client_id):
+                        started = time.monotonic()
+                        server_error = False
+                        try:
+                            if data.get("progressive"):
+                                result_path = await process_progressive_tryon(
+                                    data["user_image"],
+                                    data.get("garment_image"),
+                                    lambda preview_path: ws_hub.push(connection, {
+                                        "type": "preview",
+                                        "preview_url": result_url_for(preview_path)
+                                    }),
+                                    data.get("pose_backend"),
+                                    progress,
+                                    trace=bool(data.get("trace")),
+                                    timings=timings
+                                )
+                            else:
+                                result_path = await process_virtual_tryon(
+                                    data["user_image"], 
+                                    data.get("garment_image"),
+                                    data.get("pose_backend"),
+                                    progress,
+                                    garment_id=data.get("garment_id"),
+                                    trace=bool(data.get("trace")),
+                                    timings=timings
+                                )
+                        except HTTPException as e:
+                            server_error = e.status_code >= 500
+                            raise
+                        except Exception:
+                            server_error = True
+                            raise
+                        finally:
+                            try_on_latency.record(time.monotonic() - started, ok=not server_error)
+                except AdmissionRejected as e:
+                    ws_hub.push(connection, {
+                        "type": "error",
+                        "status": e.status_code,
+                        "detail": e.detail,
+                        "retry_after": e.retry_after
+                    })
+                    continue
+                except HTTPException as e:
+                    ws_hub.push(connection, {
+                        "type": "error",
+                        "status": e.status_code,
+                        "detail": e.detail
+                    })
+                    continue
                 
                 # Send result back to client
-                result_url = result_path.replace('\\', '/').split('static/')[-1]
-                await websocket.send_json({
+                ws_hub.push(connection, {
                     "type": "result",
-                    "result_url": f"/static/{result_url}"
+                    "result_url": result_url_for(result_path),
+                    "timings": timings
                 })
+            else:
+                reject(f"Unknown message type: {message_type}")
                 
     except WebSocketDisconnect:
-        print(f"Client {client_id} disconnected")
+        logger.info(f"Client {client_id} disconnected")
     except Exception as e:
-        print(f"Error in WebSocket: {str(e)}")
-        await websocket.close()
+        logger.error(f"Error in WebSocket: {str(e)}", exc_info=True)
+    finally:
+        await ws_hub.disconnect(connection)
+
+@router.get("/results/{filename}")
+async def get_result(filename: str, request: Request):
+    """
+    Serve a generated result image.
+    
+    Supports conditional requests (ETag / Last-Modified) and Range requests;
+    the file body is streamed by FileResponse, which hands the path to the
+    server for zero-copy sending when the server supports it.
+    """
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Result not found")
+    path = os.path.join(settings.RESULT_FOLDER, filename)
+    stat_result = await stat(path)
+    if stat_result is None or not stat_lib.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Result not found")
+    
+    etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "public, max-age=86400, immutable"}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                if int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp():
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+    
+    return FileResponse(path, stat_result=stat_result, headers=headers)
+
+@router.get("/pose-backends")
+async def pose_backends():
+    """List the available pose backends, their calibrated latency and the default."""
+    estimator = virtual_tryon_service.pose_estimator
+    return {
+        "default": estimator.active.name,
+        "backends": {
+            name: {"quality": backend.quality, "latency_ms": estimator.latencies.get(name)}
+            for name, backend in estimator.backends.items()
+        },
+    }
+
+@router.get("/garments")
+async def list_garments():
+    """List the garments of the current catalogue version."""
+    version, entries = await asyncio.to_thread(garment_catalogue.listing)
+    garments = [
+        {"garment_id": entry.garment_id, "garment_type": entry.garment_type, "source_size": entry.source_size}
+        for entry in entries
+    ]
+    return {"version": version, "garments": garments}
+
+@router.get("/metrics")
+async def metrics():
+    """Operational metrics as JSON."""
+    service = virtual_tryon_service
+    frame_executor = get_frame_executor()
+    # Broker stats are a database or network round trip
+    task_queue = await asyncio.to_thread(get_broker().stats) if settings.COMPUTE_MODE == "queue" else None
+    return {
+        "admission": try_on_admission.metrics(),
+        "latency": try_on_latency.snapshot(),
+        "pipeline_pool": pool_stats(),
+        "memory_budget": memory_governor.metrics(),
+        "websockets": ws_hub.metrics(),
+        "memory": worker_memory(all_workers=settings.SERVER_MODE == "production"),
+        "single_flight": {
+            "try_on": service.tryon_flight.metrics(),
+            "garment": service.garment_flight.metrics(),
+            "pose": service.pose_flight.metrics(),
+        },
+        "garment_phash": service.garment_index.metrics(),
+        "garment_warp": garment_warper.metrics(),
+        "trace_artifacts": trace_recorder.metrics(),
+        "task_queue": task_queue,
+        "shm_transport": frame_executor.metrics() if frame_executor is not None else None,
+    }
+
+def _hit_rate(hits: int, lookups: int) -> float:
+    return hits / lookups if lookups else 0.0
+
+@router.get("/ready")
+async def readiness():
+    """
+    Readiness and saturation signals for load balancers and autoscalers.
+    
+    Answers 503 while the models are not loaded or the admission queue is
+    full. Built from in-memory counters only, so it is cheap to poll every
+    second.
+    """
+    service = virtual_tryon_service
+    admission = try_on_admission.metrics()
+    pool = pool_stats()
+    models = {
+        "segmentation": service.segmentation_model is not None,
+        "pose_backends": list(service.pose_estimator.backends),
+    }
+    if admission["max_queue"] > 0:
+        queue_full = admission["queue_depth"] >= admission["max_queue"]
+    else:
+        # Without a queue, new requests are rejected while every pipeline is busy
+        queue_full = admission["active"] >= admission["max_concurrent"]
+    # API nodes in queue mode leave the segmentation model to the compute workers
+    segmentation_ready = models["segmentation"] or settings.COMPUTE_MODE == "queue"
+    ready = segmentation_ready and bool(models["pose_backends"]) and not queue_full
+    
+    tryon = service.tryon_flight.metrics()
+    garment = service.garment_flight.metrics()
+    body = {
+        "ready": ready,
+        "models": models,
+        "saturation": max(admission["active"] / admission["max_concurrent"], pool["utilization"]),
+        "pipelines": {"active": admission["active"], "max": admission["max_concurrent"]},
+        "queue": {"depth": admission["queue_depth"], "max": admission["max_queue"]},
+        "pipeline_pool": pool,
+        "latency": try_on_latency.snapshot(),
+        "cache_hit_rates": {
+            "try_on_coalesced": _hit_rate(tryon["shared"], tryon["shared"] + tryon["executed"]),
+            "garment_coalesced": _hit_rate(garment["shared"], garment["shared"] + garment["executed"]),
+            "garment_phash": service.garment_index.metrics()["hit_rate"],
+            "garment_warp": garment_warper.metrics()["hit_rate"],
+        },
+        "rss_bytes": rss_bytes(),
+        "memory_reserved_bytes": memory_governor.metrics()["in_use"],
+        "websockets": ws_hub.metrics()["connections"],
+    }
+    if settings.COMPUTE_MODE == "queue":
+        body["task_queue"] = await asyncio.to_thread(get_broker().stats)
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 @router.get("/health")
 async def health_check():
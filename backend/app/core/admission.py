@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and Retry-After."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class AdmissionController:
+    """
+    Bounds the number of try-on pipelines running at once.
+
+    Requests beyond max_concurrent wait in a bounded queue. Waiters are served
+    round-robin across client ids, so one client cannot monopolise the queue,
+    and each client that identified itself may hold at most per_client_limit
+    running or queued requests. When the queue is full, the client is over its limit, or the wait
+    exceeds queue_timeout, the request is rejected immediately with a
+    Retry-After hint derived from recent service times.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, per_client_limit: int, queue_timeout: float):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.per_client_limit = per_client_limit
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._queued = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._client_load: Dict[str, int] = {}
+        self._service_time_ewma = 1.0
+
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "client_limit": 0, "timeout": 0}
+        self._wait_total = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        return cls(
+            max_concurrent=settings.MAX_CONCURRENT_PIPELINES or os.cpu_count() or 1,
+            max_queue=settings.ADMISSION_QUEUE_SIZE,
+            per_client_limit=settings.ADMISSION_PER_CLIENT_LIMIT,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT_S,
+        )
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely to free up, from the EWMA of service times."""
+        backlog = (self._queued + 1) / self.max_concurrent
+        return max(1, math.ceil(self._service_time_ewma * backlog))
+
+    def _reject(self, reason: str, status_code: int, detail: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        logger.warning(f"Admission rejected ({reason}): active={self._active} queued={self._queued}")
+        return AdmissionRejected(status_code, detail, self._retry_after())
+
+    def _add_load(self, client_id: str, delta: int) -> None:
+        load = self._client_load.get(client_id, 0) + delta
+        if load > 0:
+            self._client_load[client_id] = load
+        else:
+            self._client_load.pop(client_id, None)
+
+    async def acquire(self, client_id: str, limited: bool = True) -> None:
+        """
+        Wait for a pipeline slot.
+
+        Args:
+            client_id: Fairness key of the client
+            limited: Apply per_client_limit; False when the key is only a
+                guess (e.g. a peer address many clients may share behind NAT)
+
+        Raises:
+            AdmissionRejected: 429 if the client is over its limit, 503 if the
+                queue is full or the wait timed out
+        """
+        if limited and self.per_client_limit and self._client_load.get(client_id, 0) >= self.per_client_limit:
+            raise self._reject("client_limit", 429, "Too many concurrent requests for this client")
+
+        if self._active < self.max_concurrent and self._queued == 0:
+            self._active += 1
+            self._add_load(client_id, 1)
+            self.admitted += 1
+            return
+
+        if self._queued >= self.max_queue:
+            raise self._reject("queue_full", 503, "Server is busy, please retry later")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(client_id, deque()).append(future)
+        self._queued += 1
+        self._add_load(client_id, 1)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot to the next waiter
+                self._active -= 1
+                self._grant_next()
+            else:
+                self._discard_waiter(client_id, future)
+            self._add_load(client_id, -1)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject("timeout", 503, "Timed out waiting for a free worker") from None
+        self._wait_total += time.monotonic() - start
+        self.admitted += 1
+
+    def _discard_waiter(self, client_id: str, future: asyncio.Future) -> None:
+        queue = self._waiters.get(client_id)
+        if queue and future in queue:
+            queue.remove(future)
+            self._queued -= 1
+            if not queue:
+                del self._waiters[client_id]
+
+    def _grant_next(self) -> None:
+        """Hand free slots to waiters, rotating across clients."""
+        while self._active < self.max_concurrent and self._waiters:
+            client_id, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._waiters.move_to_end(client_id)
+            else:
+                del self._waiters[client_id]
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    def release(self, client_id: str, service_time: Optional[float] = None) -> None:
+        """Return a slot acquired with acquire()."""
+        if service_time is not None:
+            self._service_time_ewma = 0.8 * self._service_time_ewma + 0.2 * service_time
+        self._active -= 1
+        self._add_load(client_id, -1)
+        self._grant_next()
+
+    @asynccontextmanager
+    async def admit(self, client_id: str, limited: bool = True) -> AsyncIterator[None]:
+        """Hold a pipeline slot for the duration of the block."""
+        await self.acquire(client_id, limited)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(client_id, time.monotonic() - start)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": self._queued,
+            "max_queue": self.max_queue,
+            "clients_waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected["queue_full"],
+            "rejected_client_limit": self.rejected["client_limit"],
+            "rejected_timeout": self.rejected["timeout"],
+            "mean_wait_ms": 1000.0 * self._wait_total / self.admitted if self.admitted else 0.0,
+            "service_time_ewma_s": self._service_time_ewma,
+        }
+
+
+# Shared by the HTTP and WebSocket try-on endpoints
+try_on_admission = AdmissionController.from_settings()
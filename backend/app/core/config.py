@@ -8,6 +8,17 @@ class Settings(BaseSettings):
     VERSION: str = "1.0.0"
     API_V1_STR: str = "/api/v1"
     
+    # Server
+    SERVER_MODE: str = "development"  # development: single process with reload; production: pre-forked workers
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0  # Production worker processes; 0 = CPU count
+    SERVER_BACKLOG: int = 2048  # Listen queue length
+    SERVER_KEEPALIVE_S: int = 75  # Idle keep-alive; longer than typical load balancer idle timeouts
+    SERVER_GRACEFUL_TIMEOUT_S: int = 30  # Time for in-flight requests to finish on shutdown
+    SERVER_LOG_LEVEL: str = "info"
+    SERVER_ACCESS_LOG: bool = False
+    
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 8 days
@@ -21,14 +32,98 @@ class Settings(BaseSettings):
     MAX_CONTENT_LENGTH: int = 16 * 1024 * 1024  # 16MB max upload size
     ALLOWED_EXTENSIONS: set = {"png", "jpg", "jpeg", "mp4"}
     
+    # Image decoding
+    WORKING_MAX_PIXELS: int = 1_000_000  # Oversized JPEGs are decoded at a reduced DCT scale down to about this size
+    
     # AWS S3 Configuration (optional)
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     AWS_STORAGE_BUCKET_NAME: Optional[str] = None
     AWS_S3_REGION: Optional[str] = None
     
+    # Pipeline
+    PIPELINE_WORKERS: int = 0  # Threads for concurrent pipeline stages; 0 = min(8, CPU count)
+    PREVIEW_MAX_SIDE: int = 384  # Longest side of progressive-mode preview inputs
+    PREVIEW_JPEG_QUALITY: int = 80
+    PREVIEW_RETENTION_S: float = 60.0  # Previews are deleted this long after their full result supersedes them
+    
+    # Compute workers
+    COMPUTE_MODE: str = "local"  # local: try-ons run in the API process; queue: sent to compute workers (worker.py)
+    TASK_BROKER_URL: str = "sqlite:///data/tasks.db"  # memory://, sqlite:///path or redis://host:port/db
+    TASK_VISIBILITY_TIMEOUT_S: float = 120.0  # A reserved task not acked within this is given to another worker
+    TASK_MAX_ATTEMPTS: int = 3  # Attempts before a task fails
+    TASK_RESULT_TIMEOUT_S: float = 120.0  # API wait for a worker result before 504
+    TASK_RESULT_TTL_S: float = 600.0  # Unclaimed results are dropped after this
+    COMPUTE_WORKER_CONCURRENCY: int = 0  # Tasks run at once per worker process; 0 = CPU count
+    
+    # Trace artifacts
+    TRACE_SAMPLE_RATE: float = 0.0  # Fraction of try-ons whose pose overlay, masks and stage summary are written
+    TRACE_ON_REQUEST: bool = False  # Also trace try-ons that ask for it with trace=true
+    TRACE_DIR: str = "uploads/traces"  # One directory per traced request, named after its result file
+    TRACE_MAX_REQUESTS: int = 200  # Trace directories kept, oldest deleted first
+    TRACE_QUEUE_SIZE: int = 64  # Artifacts waiting for the writer thread before new ones are dropped
+    
+    # Metrics
+    METRICS_WINDOW_S: float = 60.0  # Window of the latency percentiles in /api/metrics and /api/ready
+    
+    # Admission control
+    MAX_CONCURRENT_PIPELINES: int = 0  # Try-on pipelines running at once; 0 = CPU count
+    ADMISSION_QUEUE_SIZE: int = 32  # Requests waiting for a slot before new ones get 503
+    ADMISSION_PER_CLIENT_LIMIT: int = 2  # Running + queued requests per explicit client_id before 429; 0 = unlimited
+    ADMISSION_QUEUE_TIMEOUT_S: float = 10.0  # Longest wait for a slot before 503
+    
+    # Memory budget
+    MEMORY_REQUEST_BUDGET_MB: int = 512  # Estimated peak memory one try-on may use; 0 = unlimited
+    MEMORY_BUDGET_POLICY: str = "downscale"  # Over budget: downscale the inputs to fit, or reject with 413
+    MEMORY_GOVERNOR_MB: int = 2048  # Estimated memory of all try-ons in flight per process; 0 = no limit
+    MEMORY_GOVERNOR_TIMEOUT_S: float = 10.0  # Longest wait for a reservation before 503
+    
+    # WebSockets
+    WS_SEND_QUEUE_SIZE: int = 64  # Outbound messages buffered per connection
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"  # When a send queue is full: drop_oldest or disconnect
+    WS_SEND_TIMEOUT_S: float = 10.0  # A single send taking longer closes the connection
+    
+    # Background removal
+    BG_REMOVAL_COARSE_TO_FINE: bool = False  # Compute the garment mask on a thumbnail, refine only near the edge (pays off on large images only; see scripts.bench_background)
+    BG_REMOVAL_THUMBNAIL_SIZE: int = 512  # Longest side of the thumbnail
+    BG_REMOVAL_REFINE_BAND: int = 2  # Extra full-resolution pixels refined around the contour
+    MASK_PROCESS_WORKERS: int = 0  # Processes computing garment masks, fed through shared memory; 0 = threads
+    SHM_POOL_MAX_FREE_BYTES: int = 256 * 1024 * 1024  # Idle shared-memory segments kept for reuse
+    
+    # Near-duplicate garment reuse
+    PHASH_ENABLED: bool = True  # Reuse the garment mask of a perceptually identical garment image
+    PHASH_MAX_DISTANCE: int = 3  # Largest Hamming distance between 64-bit dHashes counted as the same garment
+    PHASH_MAX_BYTES: int = 256 * 1024 * 1024  # Garment masks kept in the index before evicting least recently used
+    PHASH_ASPECT_TOLERANCE: float = 0.03  # Relative aspect ratio difference allowed for a match
+    PHASH_MAX_COLOR_DIFF: float = 6.0  # Largest mean difference (0-255) of 16x16 colour thumbnails for a match
+    
+    # Garment warping
+    GARMENT_WARP_ENABLED: bool = True  # Bend tops and pants to the shoulder/hip/knee lines of the pose
+    GARMENT_WARP_GRID_SIZE: int = 32  # Resolution of the cached thin-plate-spline grid, upsampled per request
+    GARMENT_WARP_POSE_QUANTUM: float = 0.02  # Control points are snapped to this fraction of the box to share grids
+    GARMENT_WARP_CACHE_SIZE: int = 256  # Warp grids kept, least recently used evicted
+    
+    # Garment catalogue
+    CATALOGUE_DIR: str = "catalogue"  # Root of the versioned garment index built by scripts/ingest_catalogue.py
+    CATALOGUE_PRESCALED_WIDTHS: str = "256,512"  # Frame widths of pre-scaled cutouts, comma separated
+    CATALOGUE_KEEP_VERSIONS: int = 3
+    
     # Model paths
     MODEL_PATH: str = "models/virtual_tryon_model.pth"
+    MODEL_HOSTING: str = "shared"  # shared: torch weights in shared memory across workers; private: per-process copy
+    POSE_MODEL_PATH: str = "models/openpose/coco"  # Directory with the OpenPose prototxt and caffemodel
+    MEDIAPIPE_POSE_MODEL_PATH: str = "models/mediapipe/pose_landmarker_full.task"
+    
+    # Pose estimation
+    POSE_BACKENDS: str = "openpose,mediapipe,haar"  # Backends to load, comma separated
+    POSE_BACKEND: str = "auto"  # Backend name, or auto to pick one by startup calibration
+    POSE_BACKEND_POLICY: str = "quality"  # quality: best backend within POSE_MAX_LATENCY_MS; latency: fastest
+    POSE_MAX_LATENCY_MS: float = 250.0  # 0 = no latency budget
+    POSE_INPUT_WIDTH: int = 368
+    POSE_INPUT_HEIGHT: int = 368
+    POSE_DNN_BACKEND: str = "default"  # default, opencv, inference_engine, cuda
+    POSE_DNN_TARGET: str = "cpu"  # cpu, opencl, opencl_fp16, cuda, cuda_fp16
+    POSE_PERSON_SELECTION: str = "largest"  # Subject in multi-person photos: largest or central
     
     class Config:
         case_sensitive = True
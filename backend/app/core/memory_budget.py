@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Size = Tuple[int, int]
+
+MB = 1024 * 1024
+
+# Bytes per pixel of the buffers alive at the peak of a try-on.
+# User frame: decoded BGR (3), composited copy (3), encoded result (~1), the
+# garment scaled to its placement box, which is at most the frame (BGRA, 4),
+# and the warp's upsampled grid, remap maps and output (8 + 8 + 4).
+USER_BYTES_PER_PIXEL = 3 + 3 + 1 + 4 + 20
+# Garment frame: decoded BGRA (4), mask and morphology temporaries (2), masked
+# BGRA (4), premultiplied cutout (4) and its uint16 temporaries (8).
+GARMENT_BYTES_PER_PIXEL = 4 + 2 + 4 + 4 + 8
+# Pose network blobs and heatmaps, independent of the frame size
+FIXED_BYTES = 16 * MB
+
+# Requests that plan_request() downscaled or rejected
+_plan_counts = {"downscaled": 0, "rejected": 0}
+
+
+@dataclass
+class MemoryPlan:
+    """
+    Estimated peak memory of a request and the sizes (as pixel budgets; the
+    header size may be before EXIF rotation) its images are decoded to.
+    """
+    footprint: int
+    user_size: Size
+    garment_size: Optional[Size]
+    scale: float = 1.0
+
+
+def estimate_footprint(user_size: Size, garment_size: Optional[Size], preview: bool = False) -> int:
+    """
+    Estimated peak bytes of one try-on.
+
+    Args:
+        user_size: (width, height) of the decoded user image
+        garment_size: (width, height) of the decoded garment image, or None
+            for a catalogue garment, whose cutout is memory-mapped
+        preview: Whether a progressive preview pass runs as well
+    """
+    footprint = FIXED_BYTES + user_size[0] * user_size[1] * USER_BYTES_PER_PIXEL
+    if garment_size is not None:
+        footprint += garment_size[0] * garment_size[1] * GARMENT_BYTES_PER_PIXEL
+    if preview:
+        side = settings.PREVIEW_MAX_SIDE
+        footprint += side * side * (USER_BYTES_PER_PIXEL + GARMENT_BYTES_PER_PIXEL)
+    return footprint
+
+
+def _scaled(size: Size, scale: float) -> Size:
+    return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+
+def plan_request(
+    user_size: Size,
+    garment_size: Optional[Size],
+    budget: int,
+    policy: str = "downscale",
+    preview: bool = False
+) -> MemoryPlan:
+    """
+    Fit a request into the per-request budget.
+
+    The pixel terms of the footprint shrink with the square of the scale, so
+    the largest scale that fits is solved for directly.
+
+    Raises:
+        HTTPException: 413 if the request does not fit and the policy is
+            "reject", or if not even its fixed cost fits
+    """
+    footprint = estimate_footprint(user_size, garment_size, preview)
+    if budget <= 0 or footprint <= budget:
+        return MemoryPlan(footprint, user_size, garment_size)
+
+    fixed = estimate_footprint((0, 0), (0, 0) if garment_size else None, preview)
+    detail = f"Images need about {footprint // MB} MB, over the {budget // MB} MB per-request budget"
+    if policy != "downscale" or fixed >= budget:
+        logger.error(detail)
+        _plan_counts["rejected"] += 1
+        raise HTTPException(status_code=413, detail=detail)
+
+    scale = math.sqrt((budget - fixed) / (footprint - fixed))
+    user_size = _scaled(user_size, scale)
+    garment_size = _scaled(garment_size, scale) if garment_size else None
+    footprint = estimate_footprint(user_size, garment_size, preview)
+    logger.info(f"{detail}; downscaling inputs by {scale:.2f}")
+    _plan_counts["downscaled"] += 1
+    return MemoryPlan(footprint, user_size, garment_size, scale)
+
+
+class MemoryGovernor:
+    """
+    Caps the summed estimated footprint of the requests in flight in this process.
+
+    Reservations are granted in arrival order, so a large request is not
+    starved by a stream of small ones. A reservation larger than the whole
+    capacity is clamped to it and runs alone.
+    """
+
+    def __init__(self, capacity: int, timeout: float = 10.0):
+        self.capacity = capacity
+        self.timeout = timeout
+        self._in_use = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        self.peak = 0
+        self.granted = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_settings(cls) -> "MemoryGovernor":
+        return cls(settings.MEMORY_GOVERNOR_MB * MB, settings.MEMORY_GOVERNOR_TIMEOUT_S)
+
+    def _grant(self, nbytes: int) -> None:
+        self._in_use += nbytes
+        self.peak = max(self.peak, self._in_use)
+        self.granted += 1
+
+    def _wake(self) -> None:
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if self._in_use + nbytes > self.capacity:
+                return
+            self._waiters.popleft()
+            self._grant(nbytes)
+            future.set_result(None)
+
+    async def acquire(self, nbytes: int) -> int:
+        """
+        Reserve nbytes, waiting for earlier reservations to be released.
+
+        Returns:
+            The bytes actually reserved, to pass to release()
+
+        Raises:
+            HTTPException: 503 with Retry-After if the wait exceeds the timeout
+        """
+        if self.capacity <= 0:
+            return 0
+        nbytes = min(nbytes, self.capacity)
+        if not self._waiters and self._in_use + nbytes <= self.capacity:
+            self._grant(nbytes)
+            return nbytes
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                # Granted just as the wait timed out
+                return nbytes
+            future.cancel()
+            self.rejected += 1
+            self._wake()
+            raise HTTPException(
+                status_code=503,
+                detail="Not enough memory for this request right now",
+                headers={"Retry-After": str(max(1, math.ceil(self.timeout)))},
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(nbytes)
+            else:
+                future.cancel()
+                self._wake()
+            raise
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        self._in_use -= nbytes
+        self._wake()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[None]:
+        reserved = await self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(reserved)
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "capacity": self.capacity,
+            "in_use": self._in_use,
+            "peak": self.peak,
+            "waiting": sum(1 for _, future in self._waiters if not future.done()),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "downscaled_over_budget": _plan_counts["downscaled"],
+            "rejected_over_budget": _plan_counts["rejected"],
+        }
+
+
+# Shared by every try-on of this process
+memory_governor = MemoryGovernor.from_settings()
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from app.core.config import settings
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LatencyWindow:
+    """
+    Request latencies of the last window_s seconds, for cheap percentile
+    snapshots. At most max_samples are kept, the oldest dropped first.
+    """
+
+    def __init__(self, window_s: float = 60.0, max_samples: int = 4096):
+        self.window_s = window_s
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_s
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def record(self, seconds: float, ok: bool = True) -> None:
+        """Add a sample; ok=False counts it toward error_rate (server errors only, not bad requests)."""
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, seconds * 1000.0, ok))
+            self._prune(now)
+
+    def snapshot(self) -> Dict[str, float]:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            samples = list(self._samples)
+        latencies = sorted(ms for _, ms, _ in samples)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        span = min(self.window_s, now - self._started)
+        return {
+            "window_s": self.window_s,
+            "count": len(samples),
+            "rate_per_s": len(samples) / span if span > 0 else 0.0,
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "p50_ms": _percentile(latencies, 0.50),
+            "p95_ms": _percentile(latencies, 0.95),
+        }
+
+
+# End-to-end latency of admitted try-ons, HTTP and WebSocket
+try_on_latency = LatencyWindow(settings.METRICS_WINDOW_S)
@@ -0,0 +1,86 @@
+import logging
+import os
+import resource
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# smaps_rollup fields reported, in kB in the file
+_SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared_clean",
+    "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+}
+
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Memory of one process in bytes, from /proc/<pid>/smaps_rollup.
+
+    PSS (proportional set size) divides shared pages between the processes
+    mapping them, so summing it across workers gives the real footprint, while
+    RSS counts shared model weights once per worker. Without /proc (non-Linux),
+    only the peak RSS of the current process is available.
+    """
+    pid = pid or os.getpid()
+    usage: Dict[str, int] = {"pid": pid}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                key = _SMAPS_FIELDS.get(name)
+                if key:
+                    usage[key] = int(rest.split()[0]) * 1024
+        return usage
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.debug(f"Cannot read smaps_rollup for {pid}: {e}")
+
+    if pid == os.getpid():
+        # ru_maxrss is in kB on Linux and bytes on macOS; only used off Linux
+        usage["rss_peak"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
+
+
+def rss_bytes() -> int:
+    """Current RSS of this process from /proc/self/statm; cheap enough to read on every poll."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak rather than current RSS off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def sibling_pids() -> List[int]:
+    """PIDs of all workers forked by this process's parent, including this one."""
+    ppid = os.getppid()
+    try:
+        with open(f"/proc/{ppid}/task/{ppid}/children") as f:
+            pids = [int(pid) for pid in f.read().split()]
+    except (OSError, ValueError):
+        return [os.getpid()]
+    return pids if os.getpid() in pids else [os.getpid()]
+
+
+def worker_memory(all_workers: bool = True) -> Dict[str, object]:
+    """
+    Per-worker memory report for the metrics endpoint.
+
+    Args:
+        all_workers: Include the sibling workers of a pre-forked server, not
+            just this process
+
+    Returns:
+        {"workers": [per-process usage], "total_pss": sum of PSS}
+    """
+    pids = sibling_pids() if all_workers else [os.getpid()]
+    workers = [memory_usage(pid) for pid in pids]
+    return {
+        "workers": workers,
+        "total_pss": sum(w.get("pss", 0) for w in workers),
+    }
@@ -0,0 +1,186 @@
+import gc
+import importlib.util
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import uvicorn
+from uvicorn.importer import import_from_string
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _loop_impl() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def _http_impl() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def worker_count() -> int:
+    return settings.SERVER_WORKERS or os.cpu_count() or 1
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """Bind the listening socket once in the parent; every worker accepts on it."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run(app_path: str, app: Optional[Any] = None) -> None:
+    """
+    Start the server as configured by SERVER_MODE.
+
+    Args:
+        app_path: Import string of the ASGI app, e.g. "main:app"
+        app: The already imported app, if the caller has it; avoids importing
+            the module (and loading the models) a second time
+    """
+    if settings.SERVER_MODE == "production":
+        serve_production(app if app is not None else import_from_string(app_path))
+    else:
+        logger.info("Starting development server with reload")
+        uvicorn.run(
+            app_path,
+            host=settings.SERVER_HOST,
+            port=settings.SERVER_PORT,
+            reload=True,
+            log_level="debug",
+            access_log=True,
+        )
+
+
+def serve_production(app: Any) -> None:
+    """
+    Pre-fork server: the parent binds the socket and holds the imported app
+    (with its models loaded), then forks the workers. Model weights and other
+    read-only state are shared copy-on-write instead of being loaded per
+    worker.
+
+    The parent must not have run inference: OpenMP (torch) and OpenCV thread
+    pools do not survive fork, and a child inheriting their state can
+    deadlock. Model loading is kept single-threaded and everything that
+    starts a pool (pose calibration, MediaPipe graphs) runs in each
+    worker's startup handlers, after _serve_worker has sized the pools for
+    the worker. Those handlers fork the worker's mask processes first.
+
+    The parent supervises the workers, restarting any that die. On SIGTERM or
+    SIGINT it forwards SIGTERM so each worker stops accepting, finishes
+    in-flight requests and runs its shutdown handlers. Workers still alive
+    after SERVER_GRACEFUL_TIMEOUT_S are killed.
+    """
+    sock = bind_socket(settings.SERVER_HOST, settings.SERVER_PORT, settings.SERVER_BACKLOG)
+    workers = worker_count()
+    logger.info(f"Serving on {settings.SERVER_HOST}:{settings.SERVER_PORT} with {workers} workers "
+                f"(loop={_loop_impl()}, http={_http_impl()})")
+
+    # Objects allocated so far live for the whole process; keep the collector
+    # from touching (and so copying) their pages in the children
+    gc.collect()
+    gc.freeze()
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                _serve_worker(app, sock, workers)
+                code = 0
+            except BaseException:
+                logger.exception(f"Worker {os.getpid()} crashed")
+            finally:
+                os._exit(code)
+        children[pid] = index
+        logger.info(f"Started worker {index} (pid {pid})")
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info(f"Received signal {signum}, draining {len(children)} workers")
+        for pid in children:
+            _signal(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        spawn(index)
+
+    deadline = None
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if stopping:
+                if deadline is None:
+                    # Workers get their own graceful timeout; allow a little longer for shutdown handlers
+                    deadline = time.monotonic() + settings.SERVER_GRACEFUL_TIMEOUT_S + 5
+                elif time.monotonic() >= deadline:
+                    for straggler in children:
+                        logger.warning(f"Worker {straggler} did not drain in time, killing it")
+                        _signal(straggler, signal.SIGKILL)
+                    deadline = float("inf")
+            time.sleep(0.2)
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            logger.error(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+            spawn(index)
+
+    sock.close()
+    logger.info("All workers stopped")
+
+
+def _signal(pid: int, signum: int) -> None:
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _serve_worker(app: Any, sock: socket.socket, workers: int) -> None:
+    """Run one uvicorn server on the inherited socket (in the forked child)."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # Split the cores between workers instead of every worker using all of them
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+    config = uvicorn.Config(
+        app,
+        loop=_loop_impl(),
+        http=_http_impl(),
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_KEEPALIVE_S,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT_S,
+        log_level=settings.SERVER_LOG_LEVEL,
+        access_log=settings.SERVER_ACCESS_LOG,
+        proxy_headers=True,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
@@ -0,0 +1,212 @@
+import logging
+import math
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Color range for common background colors (white, light gray, etc.) in HSV
+LOWER_WHITE = np.array([0, 0, 200], dtype=np.uint8)
+UPPER_WHITE = np.array([180, 30, 255], dtype=np.uint8)
+
+# Coarse-mask rows per refinement strip in coarse-to-fine mode
+REFINE_TILE = 16
+
+
+def _bgr(image: np.ndarray) -> np.ndarray:
+    """Drop an alpha channel if present; thresholding works on colour only."""
+    if image.ndim == 3 and image.shape[2] == 4:
+        return image[:, :, :3]
+    return image
+
+
+def garment_mask(image: np.ndarray) -> np.ndarray:
+    """
+    Compute the garment mask at the image's own resolution using colour thresholding.
+
+    Args:
+        image: Garment image in BGR format
+
+    Returns:
+        uint8 mask, 255 inside the largest non-background contour
+    """
+    image = _bgr(image)
+    # Convert to HSV color space
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # Create mask for white/light backgrounds and invert it to get the garment
+    mask = cv2.inRange(hsv, LOWER_WHITE, UPPER_WHITE)
+    mask = cv2.bitwise_not(mask)
+
+    # Apply morphological operations to clean up the mask
+    kernel = np.ones((3, 3), np.uint8)
+    mask = cv2.erode(mask, kernel, iterations=1)
+    mask = cv2.dilate(mask, kernel, iterations=2)
+
+    # Find contours and keep only the largest one (the garment)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if contours:
+        largest_contour = max(contours, key=cv2.contourArea)
+        mask = np.zeros_like(mask)
+        cv2.drawContours(mask, [largest_contour], -1, 255, -1)
+    return mask
+
+
+def garment_mask_coarse_to_fine(image: np.ndarray, thumbnail_size: int = 512, band: int = 2) -> np.ndarray:
+    """
+    Compute the garment mask on a thumbnail and refine it at full resolution
+    only in windows along the upsampled contour.
+
+    The thumbnail is taken by integer-factor decimation, which costs next to
+    nothing; the thumbnail pass then does the expensive work (HSV conversion,
+    morphology, contour extraction) on a fraction of the pixels.
+
+    Args:
+        image: Garment image in BGR format
+        thumbnail_size: Longest side of the thumbnail used for the coarse mask
+        band: Extra refinement margin in full-resolution pixels, on top of the
+            upsampling error of the thumbnail
+
+    Returns:
+        uint8 mask with the same semantics as garment_mask()
+    """
+    image = _bgr(image)
+    factor = math.ceil(max(image.shape[:2]) / thumbnail_size)
+    if factor <= 1:
+        return garment_mask(image)
+
+    small = np.ascontiguousarray(image[::factor, ::factor])
+    coarse = garment_mask(small)
+    return refine_mask(image, coarse, band)
+
+
+def _runs(flags: np.ndarray) -> List[Tuple[int, int]]:
+    """Start/stop indices of the runs of True values in a 1-D boolean array."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], flags.view(np.int8), [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def _refine_window(image: np.ndarray, mask: np.ndarray, edge_band: np.ndarray) -> np.ndarray:
+    """
+    Re-threshold the band pixels of one window.
+
+    A band pixel becomes background only if it is background-coloured and
+    connected to background outside the band, the same way garment_mask()
+    keeps light areas enclosed by the garment contour.
+    """
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    background = cv2.inRange(hsv, LOWER_WHITE, UPPER_WHITE)
+    kernel = np.ones((3, 3), np.uint8)
+    background = cv2.erode(cv2.dilate(background, kernel, iterations=1), kernel, iterations=2)
+
+    outside = cv2.bitwise_not(cv2.bitwise_or(mask, edge_band))
+    reachable = cv2.bitwise_or(outside, cv2.bitwise_and(background, edge_band))
+    count, labels = cv2.connectedComponents(reachable, connectivity=4)
+    open_background = np.zeros(count, dtype=np.uint8)
+    open_background[labels[outside > 0]] = 255
+    open_background[0] = 0
+
+    refined = cv2.bitwise_or(mask, edge_band)
+    refined[cv2.bitwise_and(open_background[labels], edge_band) > 0] = 0
+    return refined
+
+
+def _upsample(coarse: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Redraw the contours of a coarse mask at full resolution (cheaper than resizing)."""
+    w, h = size
+    ch, cw = coarse.shape[:2]
+    sx, sy = w / cw, h / ch
+    contours, _ = cv2.findContours(coarse, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Map coarse pixel centres onto full-resolution pixel centres
+    scaled = [np.round((c + 0.5) * (sx, sy) - 0.5).astype(np.int32) for c in contours]
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.drawContours(mask, scaled, -1, 255, -1)
+    return mask
+
+
+def refine_mask(image: np.ndarray, coarse: np.ndarray, band: int = 2) -> np.ndarray:
+    """
+    Upsample a coarse garment mask to the image size and re-threshold the
+    pixels near its contour at full resolution.
+
+    The band around the contour is found on the coarse mask and split into
+    row strips of REFINE_TILE coarse pixels; only the windows of each strip
+    that contain band pixels are touched at full resolution.
+
+    Args:
+        image: Full-resolution garment image in BGR format
+        coarse: Filled mask computed on a downscaled copy of the image
+        band: Extra refinement margin in full-resolution pixels
+
+    Returns:
+        Full-resolution uint8 mask
+    """
+    image = _bgr(image)
+    h, w = image.shape[:2]
+    ch, cw = coarse.shape[:2]
+    mask = _upsample(coarse, (w, h))
+    sy, sx = h / ch, w / cw
+
+    # The upsampled edge can be off by about one coarse pixel
+    margin = 1 + math.ceil(band / min(sy, sx))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * margin + 1, 2 * margin + 1))
+    coarse_band = cv2.morphologyEx(coarse, cv2.MORPH_GRADIENT, kernel)
+
+    tile = REFINE_TILE
+    for ty in range(0, ch, tile):
+        for tx0, tx1 in _runs(coarse_band[ty:ty + tile].any(axis=0)):
+            # Pad the window so connectivity to the outside background is seen
+            # across window borders; only the unpadded core is written back
+            py0, py1 = max(0, ty - margin), min(ch, ty + tile + margin)
+            px0, px1 = max(0, tx0 - margin), min(cw, tx1 + margin)
+            y0, y1 = int(py0 * sy), min(h, math.ceil(py1 * sy))
+            x0, x1 = int(px0 * sx), min(w, math.ceil(px1 * sx))
+            window_band = cv2.resize(coarse_band[py0:py1, px0:px1], (x1 - x0, y1 - y0),
+                                     interpolation=cv2.INTER_NEAREST)
+            refined = _refine_window(image[y0:y1, x0:x1], mask[y0:y1, x0:x1], window_band)
+
+            cy0, cy1 = int(ty * sy), min(h, math.ceil(min(ch, ty + tile) * sy))
+            cx0, cx1 = int(tx0 * sx), min(w, math.ceil(tx1 * sx))
+            mask[cy0:cy1, cx0:cx1] = refined[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+    return mask
+
+
+def apply_mask(image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Turn a BGR image and a garment mask into a straight-alpha BGRA cutout."""
+    image = _bgr(image)
+    result = cv2.bitwise_and(image, image, mask=mask)
+    rgba = cv2.cvtColor(result, cv2.COLOR_BGR2BGRA)
+    rgba[:, :, 3] = mask
+    return rgba
+
+
+def remove_background(image: np.ndarray, coarse_to_fine: bool = False, thumbnail_size: int = 512,
+                      band: int = 2) -> np.ndarray:
+    """
+    Remove the background from a garment image.
+
+    Args:
+        image: Garment image in BGR format
+        coarse_to_fine: Compute the mask on a thumbnail and refine it near the edge
+        thumbnail_size: Longest side of the thumbnail in coarse-to-fine mode
+        band: Refinement margin in full-resolution pixels
+
+    Returns:
+        BGRA cutout with the mask in the alpha channel
+    """
+    if coarse_to_fine:
+        mask = garment_mask_coarse_to_fine(image, thumbnail_size, band)
+    else:
+        mask = garment_mask(image)
+    return apply_mask(image, mask)
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    """Intersection over union of two binary masks."""
+    a, b = a > 0, b > 0
+    union = np.count_nonzero(a | b)
+    if union == 0:
+        return 1.0
+    return np.count_nonzero(a & b) / union
@@ -0,0 +1,470 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+from .compositing import CutoutPyramid, GarmentCutout
+from .garment_store import PackReader, PackWriter
+from .image_io import decode_image
+
+logger = logging.getLogger(__name__)
+
+# Format 1 stored each cutout as a .npy file; format 2 packs them into one memory-mapped file
+CATALOGUE_FORMAT = 2
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+INDEX_FILE = "index.json"
+PACK_FILE = "garments.pack"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+Point = Tuple[float, float]
+
+
+@dataclass
+class CatalogueEntry:
+    """Precomputed metadata of one catalogue garment; coordinates are in the source frame."""
+    garment_id: str
+    garment_type: str
+    source: str
+    digest: str
+    source_size: Tuple[int, int]
+    bbox: Tuple[int, int, int, int]
+    anchors: Dict[str, Point]
+    # One per stored cutout, largest first: {"key", "x", "y", "source_size"}; "file" in format 1
+    variants: List[Dict]
+
+
+def garment_id_for(path: str) -> str:
+    """Catalogue id of a garment image: its file stem, restricted to URL-safe characters."""
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    return re.sub(r"[^a-z0-9_-]+", "-", stem).strip("-") or "garment"
+
+
+def _row_extent(mask: np.ndarray, row: int, fallback: Tuple[int, int]) -> Tuple[int, int]:
+    cols = np.flatnonzero(mask[row])
+    return (int(cols[0]), int(cols[-1])) if cols.size else fallback
+
+
+def estimate_anchors(mask: np.ndarray, garment_type: str) -> Dict[str, Point]:
+    """
+    Estimate garment landmarks from its mask.
+
+    "left" and "right" refer to image sides. Tops get shoulders (12% below the
+    top edge), neck (top of the centre column) and hem corners; pants get waist
+    and hem corners; hats get crown and brim corners; anything else gets the
+    top and bottom centre.
+
+    Args:
+        mask: Garment mask, nonzero inside the garment
+        garment_type: Detected garment type
+
+    Returns:
+        Anchor name -> (x, y) in mask pixels; empty for an empty mask
+    """
+    ys, xs = np.nonzero(mask)
+    if ys.size == 0:
+        return {}
+    x0, x1, y0, y1 = int(xs.min()), int(xs.max()), int(ys.min()), int(ys.max())
+    height = y1 - y0
+    bounds = (x0, x1)
+    anchors: Dict[str, Point] = {}
+
+    top_l, top_r = _row_extent(mask, y0 + int(round(0.02 * height)), bounds)
+    bottom_row = y1 - int(round(0.02 * height))
+    bottom_l, bottom_r = _row_extent(mask, bottom_row, bounds)
+
+    if garment_type == "top":
+        shoulder_row = y0 + int(round(0.12 * height))
+        left, right = _row_extent(mask, shoulder_row, bounds)
+        anchors["shoulder_left"] = (float(left), float(shoulder_row))
+        anchors["shoulder_right"] = (float(right), float(shoulder_row))
+        center = (left + right) // 2
+        column = np.flatnonzero(mask[:, center])
+        anchors["neck"] = (float(center), float(column[0] if column.size else y0))
+        anchors["hem_left"] = (float(bottom_l), float(bottom_row))
+        anchors["hem_right"] = (float(bottom_r), float(bottom_row))
+    elif garment_type in ("pants", "bottom"):
+        anchors["waist_left"] = (float(top_l), float(y0))
+        anchors["waist_right"] = (float(top_r), float(y0))
+        anchors["hem_left"] = (float(bottom_l), float(bottom_row))
+        anchors["hem_right"] = (float(bottom_r), float(bottom_row))
+    elif garment_type == "hat":
+        anchors["crown"] = ((top_l + top_r) / 2.0, float(y0))
+        anchors["brim_left"] = (float(bottom_l), float(bottom_row))
+        anchors["brim_right"] = (float(bottom_r), float(bottom_row))
+    else:
+        anchors["top_center"] = ((top_l + top_r) / 2.0, float(y0))
+        anchors["bottom_center"] = ((bottom_l + bottom_r) / 2.0, float(y1))
+    return anchors
+
+
+def prescale(cutout: GarmentCutout, widths: Sequence[int]) -> List[GarmentCutout]:
+    """Pre-scaled variants of a cutout for each frame width smaller than its own."""
+    src_w, src_h = cutout.source_size
+    variants = []
+    for width in sorted(set(widths), reverse=True):
+        if 0 < width < src_w:
+            height = max(1, round(src_h * width / src_w))
+            variants.append(cutout.scaled(width, height, cv2.INTER_AREA))
+    return variants
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ingest_directory(
+    source_dir: str,
+    root: str,
+    detect_type: Callable[[np.ndarray, str], str],
+    remove_background: Callable[[np.ndarray], np.ndarray],
+    widths: Sequence[int] = (),
+    keep_versions: int = 3
+) -> str:
+    """
+    Build a new catalogue version from a directory of garment images and make it current.
+
+    Each image is decoded as on the request path, then its type, cutout,
+    bounding box, anchors and pre-scaled variants are computed and stored.
+    The version becomes visible to readers only when the CURRENT pointer is
+    atomically replaced, after everything is written.
+
+    Args:
+        source_dir: Directory of garment images
+        root: Catalogue root directory
+        detect_type: Garment type detector, called with (image, filename)
+        remove_background: Returns the straight-alpha BGRA cutout of an image
+        widths: Frame widths of the pre-scaled variants
+        keep_versions: Number of versions to keep, including the new one
+
+    Returns:
+        The new version name
+    """
+    files = sorted(
+        name for name in os.listdir(source_dir) if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    version, version_dir = _new_version_dir(root)
+    entries: Dict[str, Dict] = {}
+    try:
+        with PackWriter(os.path.join(version_dir, PACK_FILE), {"version": version}) as pack:
+            for name in files:
+                path = os.path.join(source_dir, name)
+                garment_id = garment_id_for(name)
+                if garment_id in entries:
+                    logger.warning(f"Skipping {name}: duplicate garment id {garment_id}")
+                    continue
+                try:
+                    prepared = _prepare_garment(path, name, garment_id, detect_type, remove_background, widths)
+                except Exception as e:
+                    # One bad source image must not abort the whole build
+                    logger.error(f"Skipping {name}: {str(e)}", exc_info=True)
+                    continue
+                if prepared is None:
+                    continue
+
+                entry, cutouts = prepared
+                for variant in cutouts:
+                    key = f"{garment_id}/{variant.source_size[0]}"
+                    pack.add(key, variant.pixels)
+                    entry.variants.append({
+                        "key": key,
+                        "x": variant.x,
+                        "y": variant.y,
+                        "source_size": list(variant.source_size),
+                    })
+                entries[garment_id] = asdict(entry)
+                logger.info(f"Ingested {name} as {garment_id} ({entry.garment_type}, {len(cutouts)} sizes)")
+
+        _write_index(version_dir, version, entries)
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    set_current(root, version)
+    prune_versions(root, keep_versions)
+    return version
+
+
+def _prepare_garment(
+    path: str,
+    name: str,
+    garment_id: str,
+    detect_type: Callable[[np.ndarray, str], str],
+    remove_background: Callable[[np.ndarray], np.ndarray],
+    widths: Sequence[int]
+) -> Optional[Tuple[CatalogueEntry, List[GarmentCutout]]]:
+    """
+    Decode one garment image and compute its entry and cutout variants.
+
+    Returns:
+        (entry without variants, [full cutout] + pre-scaled cutouts), or None
+        if the image is skipped
+    """
+    image = decode_image(path, settings.WORKING_MAX_PIXELS, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        logger.warning(f"Skipping {name}: cannot decode")
+        return None
+    if image.ndim == 2:
+        # Type detection and background removal expect colour
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    garment_type = detect_type(image, name)
+    rgba = remove_background(image)
+    cutout = GarmentCutout.from_rgba(rgba)
+    if cutout.is_empty:
+        logger.warning(f"Skipping {name}: empty garment mask")
+        return None
+
+    entry = CatalogueEntry(
+        garment_id=garment_id,
+        garment_type=garment_type,
+        source=name,
+        digest=_file_digest(path),
+        source_size=cutout.source_size,
+        bbox=(cutout.x, cutout.y, cutout.width, cutout.height),
+        anchors=estimate_anchors(rgba[:, :, 3], garment_type),
+        variants=[],
+    )
+    return entry, [cutout] + prescale(cutout, widths)
+
+
+def _new_version_dir(root: str) -> Tuple[str, str]:
+    """Create a version directory named after the time; builds within the same second get a numbered suffix."""
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    os.makedirs(os.path.join(root, VERSIONS_DIR), exist_ok=True)
+    attempt = 0
+    while True:
+        # Zero-padded so that names still sort in creation order for prune_versions
+        version = f"{stamp}-{attempt:03d}" if attempt else stamp
+        version_dir = os.path.join(root, VERSIONS_DIR, version)
+        try:
+            os.makedirs(version_dir, exist_ok=False)
+            return version, version_dir
+        except FileExistsError:
+            attempt += 1
+
+
+def _write_index(version_dir: str, version: str, entries: Dict[str, Dict]) -> None:
+    index = {"format": CATALOGUE_FORMAT, "version": version, "created": time.time(), "garments": entries}
+    with open(os.path.join(version_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=1)
+
+
+def _load_index(root: str, version: str) -> Dict:
+    with open(os.path.join(root, VERSIONS_DIR, version, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def repack(root: str, drop: Sequence[str] = (), keep_versions: int = 3) -> Tuple[str, int, int]:
+    """
+    Rebuild the current catalogue version into a new, compacted version.
+
+    Cutouts are copied into a fresh pack holding only the garments that are
+    kept; format 1 versions (one .npy per cutout) are converted to a pack on
+    the way. The new version is made current.
+
+    Args:
+        root: Catalogue root directory
+        drop: Garment ids to leave out
+        keep_versions: Number of versions to keep, including the new one
+
+    Returns:
+        (new version, bytes of cutout storage before, bytes after)
+    """
+    current = read_current(root)
+    if current is None:
+        raise ValueError(f"No current catalogue version in {root}")
+    old_dir = os.path.join(root, VERSIONS_DIR, current)
+    index = _load_index(root, current)
+    old_pack_path = os.path.join(old_dir, PACK_FILE)
+    old_pack = PackReader(old_pack_path) if os.path.exists(old_pack_path) else None
+    if old_pack is not None:
+        before = os.path.getsize(old_pack_path)
+    else:
+        before = sum(os.path.getsize(os.path.join(old_dir, v["file"]))
+                     for entry in index["garments"].values() for v in entry["variants"])
+
+    version, version_dir = _new_version_dir(root)
+    entries: Dict[str, Dict] = {}
+    try:
+        with PackWriter(os.path.join(version_dir, PACK_FILE), {"version": version}) as pack:
+            for garment_id, entry in index["garments"].items():
+                if garment_id in drop:
+                    continue
+                variants = []
+                for old_variant in entry["variants"]:
+                    # Copied, so the loaded index is left as it was read
+                    variant = dict(old_variant)
+                    old_file = variant.pop("file", None)
+                    key = variant.pop("key", None) or f"{garment_id}/{variant['source_size'][0]}"
+                    if old_pack is not None:
+                        pixels = old_pack.get(key)
+                    else:
+                        pixels = np.load(os.path.join(old_dir, old_file))
+                    pack.add(key, pixels)
+                    variant["key"] = key
+                    variants.append(variant)
+                entries[garment_id] = {**entry, "variants": variants}
+
+        _write_index(version_dir, version, entries)
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    set_current(root, version)
+    prune_versions(root, keep_versions)
+    return version, before, os.path.getsize(os.path.join(version_dir, PACK_FILE))
+
+
+def set_current(root: str, version: str) -> None:
+    """Atomically point the catalogue at a version."""
+    tmp = os.path.join(root, f".{CURRENT_FILE}.{os.getpid()}")
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def read_current(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def prune_versions(root: str, keep: int) -> List[str]:
+    """Delete all but the newest `keep` versions, never the current one."""
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    current = read_current(root)
+    versions = sorted(os.listdir(versions_dir), reverse=True)
+    removed = [v for v in versions[max(1, keep):] if v != current]
+    for version in removed:
+        shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+    return removed
+
+
+@dataclass
+class _LoadedVersion:
+    """One catalogue version as loaded by a reader; replaced whole, never mutated except for the cutout cache."""
+    version: Optional[str]
+    entries: Dict[str, CatalogueEntry]
+    pack: Optional[PackReader]
+    cutouts: Dict[str, CutoutPyramid]
+
+
+class GarmentCatalogue:
+    """
+    Read side of the on-disk catalogue.
+
+    Follows the CURRENT pointer (re-checked at most once a second). The
+    version's pack is memory-mapped, so switching versions is instant and
+    cutouts are zero-copy views shared through the page cache by every worker.
+    Each lookup works on one loaded version throughout, so a switch while it
+    runs cannot mix an entry of one version with pixels of another.
+
+    Every read may reload the index and map the pack, so async callers run
+    them in a thread.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._loaded = _LoadedVersion(None, {}, None, {})
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._snapshot().version
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        version = read_current(self.root)
+        if version == self._loaded.version:
+            return
+        entries: Dict[str, CatalogueEntry] = {}
+        pack = None
+        if version is not None:
+            try:
+                index = _load_index(self.root, version)
+                pack_path = os.path.join(self.root, VERSIONS_DIR, version, PACK_FILE)
+                if os.path.exists(pack_path):
+                    pack = PackReader(pack_path)
+                for garment_id, data in index["garments"].items():
+                    data["source_size"] = tuple(data["source_size"])
+                    data["bbox"] = tuple(data["bbox"])
+                    data["anchors"] = {k: tuple(v) for k, v in data["anchors"].items()}
+                    entries[garment_id] = CatalogueEntry(**data)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.error(f"Cannot load catalogue version {version}: {e}")
+                return
+        with self._lock:
+            self._loaded = _LoadedVersion(version, entries, pack, {})
+        logger.info(f"Loaded garment catalogue version {version} with {len(entries)} garments")
+
+    def _snapshot(self) -> _LoadedVersion:
+        self.refresh()
+        with self._lock:
+            return self._loaded
+
+    def ids(self) -> List[str]:
+        return sorted(self._snapshot().entries)
+
+    def entry(self, garment_id: str) -> Optional[CatalogueEntry]:
+        return self._snapshot().entries.get(garment_id)
+
+    def versioned_entry(self, garment_id: str) -> Tuple[Optional[str], Optional[CatalogueEntry]]:
+        """The current version and the garment's entry in it (None if unknown)."""
+        loaded = self._snapshot()
+        return loaded.version, loaded.entries.get(garment_id)
+
+    def listing(self) -> Tuple[Optional[str], List[CatalogueEntry]]:
+        """The current version and its entries, sorted by garment id."""
+        loaded = self._snapshot()
+        return loaded.version, [loaded.entries[garment_id] for garment_id in sorted(loaded.entries)]
+
+    def cutout(self, garment_id: str) -> Optional[CutoutPyramid]:
+        """The garment's premultiplied cutout with its pre-scaled variants."""
+        found = self.lookup(garment_id)
+        return found[1] if found else None
+
+    def lookup(self, garment_id: str) -> Optional[Tuple[CatalogueEntry, CutoutPyramid]]:
+        """The garment's entry and cutout, both from the same catalogue version."""
+        loaded = self._snapshot()
+        entry = loaded.entries.get(garment_id)
+        if entry is None:
+            return None
+        with self._lock:
+            pyramid = loaded.cutouts.get(garment_id)
+        if pyramid is None:
+            pyramid = CutoutPyramid([
+                GarmentCutout(self._variant_pixels(loaded, v), v["x"], v["y"], tuple(v["source_size"]))
+                for v in entry.variants
+            ])
+            with self._lock:
+                loaded.cutouts[garment_id] = pyramid
+        return entry, pyramid
+
+    def _variant_pixels(self, loaded: _LoadedVersion, variant: Dict) -> np.ndarray:
+        if "key" in variant and loaded.pack is not None:
+            return loaded.pack.get(variant["key"])
+        # Format 1 catalogue: one .npy per cutout, mapped rather than read
+        return np.load(os.path.join(self.root, VERSIONS_DIR, loaded.version, variant["file"]), mmap_mode="r")
+
+
+garment_catalogue = GarmentCatalogue(settings.CATALOGUE_DIR)
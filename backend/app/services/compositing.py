@@ -0,0 +1,206 @@
+import logging
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows are grouped into bands of this height when blending; each band is
+# blended over the union of its rows' alpha spans in one vectorised step.
+BAND_ROWS = 16
+
+
+def premultiply(rgba: np.ndarray) -> np.ndarray:
+    """Return a copy of a straight-alpha BGRA image with colour premultiplied by alpha."""
+    out = rgba.copy()
+    alpha = rgba[:, :, 3:4].astype(np.uint16)
+    out[:, :, :3] = (rgba[:, :, :3].astype(np.uint16) * alpha + 127) // 255
+    return out
+
+
+class GarmentCutout:
+    """
+    A garment cutout cropped to the tight bounding box of its alpha channel.
+
+    Pixels are stored as premultiplied BGRA, which keeps resized edges free of
+    background fringes. (x, y) is the offset of the crop inside the original
+    garment frame of size source_size, so scaling and placement behave exactly
+    as if the full, mostly transparent frame were still being used.
+    """
+
+    __slots__ = ("pixels", "x", "y", "source_size", "_bands")
+
+    def __init__(self, pixels: np.ndarray, x: int, y: int, source_size: Tuple[int, int]):
+        self.pixels = pixels
+        self.x = x
+        self.y = y
+        self.source_size = source_size
+        self._bands: Optional[List[Tuple[int, int, int, int]]] = None
+
+    @classmethod
+    def from_rgba(cls, rgba: np.ndarray) -> "GarmentCutout":
+        """
+        Build a cutout from a straight-alpha BGRA image such as the output of
+        background.remove_background.
+        """
+        if rgba.ndim != 3 or rgba.shape[2] != 4:
+            raise ValueError(f"Expected a BGRA image, got shape {rgba.shape}")
+        h, w = rgba.shape[:2]
+        x, y, cw, ch = cv2.boundingRect(rgba[:, :, 3])
+        if cw == 0 or ch == 0:
+            return cls(np.zeros((0, 0, 4), dtype=np.uint8), 0, 0, (w, h))
+        return cls(premultiply(rgba[y:y + ch, x:x + cw]), x, y, (w, h))
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def is_empty(self) -> bool:
+        return self.pixels.size == 0
+
+    def scaled(self, width: int, height: int, interpolation: int = cv2.INTER_LINEAR) -> "GarmentCutout":
+        """
+        Scale the cutout as if its whole source frame were resized to width x height.
+
+        Only the cropped pixels are resized, so the cost follows the size of the
+        garment rather than the size of the frame around it.
+        """
+        src_w, src_h = self.source_size
+        if self.is_empty or src_w == 0 or src_h == 0:
+            return GarmentCutout(self.pixels, 0, 0, (width, height))
+        sx, sy = width / src_w, height / src_h
+        x0 = int(np.floor(self.x * sx))
+        y0 = int(np.floor(self.y * sy))
+        x1 = min(width, int(np.ceil((self.x + self.width) * sx)))
+        y1 = min(height, int(np.ceil((self.y + self.height) * sy)))
+        if x1 <= x0 or y1 <= y0:
+            return GarmentCutout(np.zeros((0, 0, 4), dtype=np.uint8), 0, 0, (width, height))
+        resized = cv2.resize(self.pixels, (x1 - x0, y1 - y0), interpolation=interpolation)
+        return GarmentCutout(resized, x0, y0, (width, height))
+
+    def bands(self) -> List[Tuple[int, int, int, int]]:
+        """
+        Row-range mask of the cutout: (row0, row1, col0, col1) rectangles that
+        together cover every pixel with nonzero alpha.
+
+        Computed once per cutout and cached.
+        """
+        if self._bands is None:
+            self._bands = []
+            if not self.is_empty:
+                nonzero = self.pixels[:, :, 3] > 0
+                has_alpha = nonzero.any(axis=1)
+                starts = np.where(has_alpha, nonzero.argmax(axis=1), self.width)
+                ends = np.where(has_alpha, self.width - nonzero[:, ::-1].argmax(axis=1), 0)
+                for r0 in range(0, self.height, BAND_ROWS):
+                    r1 = min(self.height, r0 + BAND_ROWS)
+                    rows = np.flatnonzero(has_alpha[r0:r1])
+                    if rows.size == 0:
+                        continue
+                    self._bands.append((
+                        r0 + int(rows[0]), r0 + int(rows[-1]) + 1,
+                        int(starts[r0:r1].min()), int(ends[r0:r1].max()),
+                    ))
+        return self._bands
+
+    def composite_onto(
+        self,
+        background: np.ndarray,
+        x: int,
+        y: int,
+        opacity: float = 1.0,
+        inplace: bool = False
+    ) -> np.ndarray:
+        """
+        Alpha-blend the cutout onto a BGR(A) background.
+
+        Args:
+            background: Destination image
+            x, y: Position of the cutout's source frame in the destination
+            opacity: Extra global opacity multiplier
+            inplace: Blend into background instead of a copy
+
+        Returns:
+            The blended image
+        """
+        result = background if inplace else background.copy()
+        bg_h, bg_w = result.shape[:2]
+        ox, oy = x + self.x, y + self.y
+
+        for r0, r1, c0, c1 in self.bands():
+            # Clip the band against the destination
+            dr0, dr1 = max(0, oy + r0), min(bg_h, oy + r1)
+            dc0, dc1 = max(0, ox + c0), min(bg_w, ox + c1)
+            if dr0 >= dr1 or dc0 >= dc1:
+                continue
+            fg = self.pixels[dr0 - oy:dr1 - oy, dc0 - ox:dc1 - ox].astype(np.float32)
+            dst = result[dr0:dr1, dc0:dc1, :3]
+            inv_alpha = 1.0 - fg[:, :, 3:4] * (opacity / 255.0)
+            blended = fg[:, :, :3] * opacity + dst.astype(np.float32) * inv_alpha
+            dst[...] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+
+        return result
+
+
+class CutoutPyramid:
+    """
+    A garment cutout with pre-scaled variants, as stored in the catalogue.
+
+    Behaves like the full-size GarmentCutout; scaled() resizes from the
+    smallest variant whose source frame is still at least as large as the
+    target, so big downscales start from a nearby size.
+    """
+
+    __slots__ = ("variants",)
+
+    def __init__(self, variants: List[GarmentCutout]):
+        if not variants:
+            raise ValueError("CutoutPyramid needs at least one variant")
+        # Largest source frame first
+        self.variants = sorted(variants, key=lambda v: v.source_size[0], reverse=True)
+
+    @property
+    def base(self) -> GarmentCutout:
+        return self.variants[0]
+
+    @property
+    def source_size(self) -> Tuple[int, int]:
+        return self.base.source_size
+
+    @property
+    def width(self) -> int:
+        return self.base.width
+
+    @property
+    def height(self) -> int:
+        return self.base.height
+
+    @property
+    def x(self) -> int:
+        return self.base.x
+
+    @property
+    def y(self) -> int:
+        return self.base.y
+
+    @property
+    def is_empty(self) -> bool:
+        return self.base.is_empty
+
+    def composite_onto(self, background: np.ndarray, x: int, y: int, opacity: float = 1.0,
+                       inplace: bool = False) -> np.ndarray:
+        return self.base.composite_onto(background, x, y, opacity, inplace)
+
+    def scaled(self, width: int, height: int, interpolation: int = cv2.INTER_LINEAR) -> GarmentCutout:
+        source = self.base
+        for variant in self.variants[1:]:
+            if variant.source_size[0] < width or variant.source_size[1] < height:
+                break
+            source = variant
+        return source.scaled(width, height, interpolation)
@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Iterable, Optional, Union
+
+import aiofiles
+import aiofiles.os
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+async def path_exists(path: str) -> bool:
+    return await aiofiles.os.path.exists(path)
+
+
+async def is_readable(path: str) -> bool:
+    return await aiofiles.os.access(path, os.R_OK)
+
+
+async def make_dirs(path: str) -> None:
+    await aiofiles.os.makedirs(path, exist_ok=True)
+
+
+async def stat(path: str) -> Optional[os.stat_result]:
+    """Stat a file off the event loop; None if it does not exist."""
+    try:
+        return await aiofiles.os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+async def remove_file(path: str) -> bool:
+    """
+    Delete a file off the event loop.
+
+    Returns:
+        True if the file was removed, False if it did not exist
+    """
+    try:
+        await aiofiles.os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def remove_files(paths: Iterable[str]) -> None:
+    """Delete temporary files off the event loop, logging failures instead of raising them."""
+    for path in paths:
+        try:
+            if await remove_file(path):
+                logger.info(f"Cleaned up temporary file: {path}")
+        except OSError as e:
+            logger.warning(f"Failed to clean up temporary file {path}: {str(e)}")
+
+
+async def file_digest(path: str, chunk_size: int = 1 << 20) -> bytes:
+    """BLAKE2b digest of a file's contents, read in chunks off the event loop."""
+    digest = hashlib.blake2b(digest_size=16)
+    async with aiofiles.open(path, "rb") as f:
+        while True:
+            chunk = await f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+async def write_bytes(path: str, data: Union[bytes, memoryview]) -> None:
+    async with aiofiles.open(path, "wb") as f:
+        await f.write(data)
+
+
+async def write_image(path: str, image: np.ndarray) -> None:
+    """
+    Encode an image in a worker thread and write it without blocking the loop.
+
+    Raises:
+        IOError: If the image cannot be encoded in the format implied by the extension
+    """
+    ext = os.path.splitext(path)[1] or ".png"
+    ok, buffer = await asyncio.to_thread(cv2.imencode, ext, image)
+    if not ok:
+        raise IOError(f"Failed to encode image as {ext}")
+    await write_bytes(path, memoryview(buffer))
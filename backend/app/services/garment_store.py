@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# File layout:
+#   header (64 bytes): magic, format version, table offset, table length
+#   arrays, each starting on a 64-byte boundary, C-contiguous
+#   offset table: UTF-8 JSON {"arrays": {name: {"offset", "shape", "dtype"}}, "meta": {...}}
+PACK_MAGIC = b"GPAK"
+PACK_VERSION = 1
+ALIGNMENT = 64
+_HEADER = struct.Struct("<4sIQQ")
+HEADER_SIZE = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class PackWriter:
+    """
+    Writes arrays into a pack file.
+
+    The file is written under a temporary name and renamed into place by
+    close(), so readers never see a partial pack.
+    """
+
+    def __init__(self, path: str, meta: Optional[Dict] = None):
+        self.path = path
+        self.meta = meta or {}
+        self._tmp_path = f"{path}.tmp{os.getpid()}"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(b"\0" * HEADER_SIZE)
+        self._offset = HEADER_SIZE
+        self._table: Dict[str, Dict] = {}
+
+    def add(self, name: str, array: np.ndarray) -> None:
+        if name in self._table:
+            raise ValueError(f"Duplicate array name in pack: {name}")
+        array = np.ascontiguousarray(array)
+        start = _align(self._offset)
+        self._file.write(b"\0" * (start - self._offset))
+        self._file.write(memoryview(array).cast("B"))
+        self._offset = start + array.nbytes
+        self._table[name] = {"offset": start, "shape": list(array.shape), "dtype": array.dtype.str}
+
+    def close(self) -> None:
+        table = json.dumps({"arrays": self._table, "meta": self.meta}).encode("utf-8")
+        table_offset = _align(self._offset)
+        self._file.write(b"\0" * (table_offset - self._offset))
+        self._file.write(table)
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, table_offset, len(table)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "PackWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PackReader:
+    """
+    Read-only, memory-mapped view of a pack file.
+
+    Opening maps the file and parses only the offset table; get() returns
+    zero-copy array views backed by the page cache, so every worker process
+    reading the same pack shares one copy of the pixels.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, table_offset, table_length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != PACK_MAGIC:
+                raise ValueError(f"Not a garment pack: {path}")
+            if version != PACK_VERSION:
+                raise ValueError(f"Unsupported pack version {version}: {path}")
+            f.seek(table_offset)
+            table = json.loads(f.read(table_length).decode("utf-8"))
+        self._arrays: Dict[str, Dict] = table["arrays"]
+        self.meta: Dict = table.get("meta", {})
+        self.table_offset = table_offset
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._arrays
+
+    def names(self) -> List[str]:
+        return list(self._arrays)
+
+    def get(self, name: str) -> Optional[np.ndarray]:
+        """Zero-copy read-only view of an array, or None if the pack has no such array."""
+        info = self._arrays.get(name)
+        if info is None:
+            return None
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        count = int(np.prod(shape)) * dtype.itemsize
+        start = info["offset"]
+        return self._map[start:start + count].view(dtype).reshape(shape)
+
+    @property
+    def data_bytes(self) -> int:
+        """Bytes of array data, excluding alignment padding."""
+        return sum(int(np.prod(a["shape"])) * np.dtype(a["dtype"]).itemsize for a in self._arrays.values())
+
@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+
+# Filename keywords checked before the image itself, in order
+TYPE_KEYWORDS = (
+    ("hat", ("hat", "cap", "beanie", "head")),
+    ("top", ("shirt", "top", "tshirt", "blouse")),
+    ("pants", ("pants", "jeans", "trousers", "bottom")),
+)
+
+
+def detect_garment_type(garment_img: np.ndarray, filename: str = "") -> str:
+    """
+    Detect the garment type ("top", "pants" or "hat") from filename hints and image properties.
+
+    Args:
+        garment_img: Garment image in BGR(A) format
+        filename: Original file name, whose keywords take precedence
+
+    Returns:
+        The garment type
+    """
+    # First check filename for hints
+    filename = filename.lower()
+    for garment_type, keywords in TYPE_KEYWORDS:
+        if any(keyword in filename for keyword in keywords):
+            return garment_type
+
+    # If no keywords in filename, use image properties
+    h, w = garment_img.shape[:2]
+    aspect_ratio = w / h if h > 0 else 1
+
+    # For square-ish images, check if it looks like a hat
+    if 0.8 <= aspect_ratio <= 1.2:
+        # Check if the image has a curved top (common for hats)
+        gray = cv2.cvtColor(garment_img, cv2.COLOR_BGR2GRAY)
+        edges = cv2.Canny(gray, 50, 150)
+        top_edges = edges[:h//3, :].sum()  # Check top third for edges
+        if top_edges > edges[h//3:2*h//3, :].sum():
+            return "hat"
+
+    if aspect_ratio > 1.3:
+        return "top"  # Wider than tall -> top
+    elif aspect_ratio < 0.7:
+        return "pants"  # Taller than wide -> pants
+    else:
+        return "top"  # Default to top for ambiguous cases
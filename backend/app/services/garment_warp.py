@@ -0,0 +1,231 @@
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .catalogue import estimate_anchors
+from .compositing import GarmentCutout
+from .pose import L_HIP, L_KNEE, L_SHOULDER, R_HIP, R_KNEE, R_SHOULDER, Pose
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+
+# Garment anchor pairs and the keypoint pairs whose line they follow
+WARP_RULES: Dict[str, List[Tuple[Tuple[str, str], Tuple[int, int]]]] = {
+    "top": [
+        (("shoulder_left", "shoulder_right"), (R_SHOULDER, L_SHOULDER)),
+        (("hem_left", "hem_right"), (R_HIP, L_HIP)),
+    ],
+    "pants": [
+        (("waist_left", "waist_right"), (R_HIP, L_HIP)),
+        (("hem_left", "hem_right"), (R_KNEE, L_KNEE)),
+    ],
+}
+WARP_RULES["bottom"] = WARP_RULES["pants"]
+
+# Largest rotation applied to an anchor pair, in degrees
+MAX_TILT = 25.0
+
+# Box corners are pinned so the warp stays inside the placement box
+_CORNERS = ((0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (1.0, 1.0))
+
+
+def normalized_anchors(cutout: GarmentCutout, garment_type: str) -> Dict[str, Point]:
+    """
+    Anchors of a cutout as fractions of its source frame, from its alpha channel.
+
+    Returns:
+        Anchor name -> (x, y) in [0, 1]; empty if the type is not warped
+    """
+    if garment_type not in WARP_RULES or cutout.is_empty:
+        return {}
+    src_w, src_h = cutout.source_size
+    anchors = estimate_anchors(cutout.pixels[:, :, 3], garment_type)
+    return {name: ((x + cutout.x) / src_w, (y + cutout.y) / src_h) for name, (x, y) in anchors.items()}
+
+
+def _tps_kernel(r2: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(r2 > 0, r2 * np.log(r2), 0.0)
+
+
+def tps_grid(dst: np.ndarray, src: np.ndarray, size: int, regularization: float = 1e-3) -> np.ndarray:
+    """
+    Solve a thin-plate spline taking dst points to src points and sample it.
+
+    Args:
+        dst: (N, 2) control points in the output box, normalized to [0, 1]
+        src: (N, 2) matching points in the garment frame, normalized to [0, 1]
+        size: Grid resolution; samples sit at pixel centres (i + 0.5) / size
+        regularization: Smoothing added to the kernel diagonal
+
+    Returns:
+        (size, size, 2) float32 grid of normalized garment-frame coordinates
+    """
+    n = dst.shape[0]
+    d2 = ((dst[:, None, :] - dst[None, :, :]) ** 2).sum(axis=2)
+    system = np.zeros((n + 3, n + 3))
+    system[:n, :n] = _tps_kernel(d2) + regularization * np.eye(n)
+    system[:n, n] = 1.0
+    system[:n, n + 1:] = dst
+    system[n, :n] = 1.0
+    system[n + 1:, :n] = dst.T
+    rhs = np.zeros((n + 3, 2))
+    rhs[:n] = src
+    coefficients = np.linalg.lstsq(system, rhs, rcond=None)[0]
+
+    ticks = (np.arange(size) + 0.5) / size
+    gx, gy = np.meshgrid(ticks, ticks)
+    points = np.stack([gx.ravel(), gy.ravel()], axis=1)
+    r2 = ((points[:, None, :] - dst[None, :, :]) ** 2).sum(axis=2)
+    mapped = (_tps_kernel(r2) @ coefficients[:n] + coefficients[n]
+              + points[:, :1] * coefficients[n + 1] + points[:, 1:] * coefficients[n + 2])
+    return mapped.reshape(size, size, 2).astype(np.float32)
+
+
+class GarmentWarper:
+    """
+    Bends a placed garment cutout to follow the shoulder and hip (or hip and
+    knee) lines of the pose.
+
+    Each anchor pair of the garment is rotated to the slope of its keypoint
+    pair and shifted to its centre, keeping the garment's own width; a thin-
+    plate spline through those points and the pinned box corners gives the
+    warp. Control points are quantized to `quantum` of the box, and the spline
+    is sampled on a small normalized grid cached per quantized (garment
+    anchors, pose) bucket, so similar poses of the same garment reuse a grid
+    and a request only pays for upsampling it and one cv2.remap.
+    """
+
+    def __init__(self, grid_size: int = 32, quantum: float = 0.02, cache_size: int = 256):
+        self.grid_size = grid_size
+        self.quantum = quantum
+        self.cache_size = cache_size
+        self._grids: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls) -> "GarmentWarper":
+        return cls(
+            grid_size=settings.GARMENT_WARP_GRID_SIZE,
+            quantum=settings.GARMENT_WARP_POSE_QUANTUM,
+            cache_size=settings.GARMENT_WARP_CACHE_SIZE,
+        )
+
+    def control_points(
+        self,
+        anchors: Dict[str, Point],
+        pose: Pose,
+        box: Tuple[int, int, int, int],
+        garment_type: str
+    ) -> Optional[Tuple[List[Point], List[Point]]]:
+        """
+        Matching (output box, garment frame) control points, normalized to the
+        box, or None if no anchor pair has both its keypoints.
+        """
+        x, y, width, height = box
+        dst: List[Point] = []
+        src: List[Point] = []
+        max_tilt = math.radians(MAX_TILT)
+        for (left_name, right_name), (kp_a, kp_b) in WARP_RULES.get(garment_type, []):
+            if left_name not in anchors or right_name not in anchors or not pose.has(kp_a, kp_b):
+                continue
+            (ax, ay), (bx, by) = sorted([pose.xy(kp_a), pose.xy(kp_b)])
+            if bx - ax < 1:
+                continue
+            tilt = max(-max_tilt, min(max_tilt, math.atan2(by - ay, bx - ax)))
+            center_x = ((ax + bx) / 2 - x) / width
+            left, right = anchors[left_name], anchors[right_name]
+            mid_x, mid_y = (left[0] + right[0]) / 2, (left[1] + right[1]) / 2
+            half = (right[0] - left[0]) / 2
+            # Rotate the pair about its centre in pixels so the slope is not
+            # distorted by the box aspect ratio
+            dx = half * math.cos(tilt)
+            dy = half * math.sin(tilt) * width / height
+            dst += [(center_x - dx, mid_y - dy), (center_x + dx, mid_y + dy)]
+            src += [left, right]
+        if not dst:
+            return None
+        return dst + list(_CORNERS), src + list(_CORNERS)
+
+    def _quantize(self, points: List[Point]) -> Tuple[int, ...]:
+        return tuple(int(round(c / self.quantum)) for point in points for c in point)
+
+    def grid(self, dst: List[Point], src: List[Point]) -> np.ndarray:
+        """Normalized warp grid for the control points, from the cache when the bucket was seen before."""
+        key = (self._quantize(dst), self._quantize(src))
+        with self._lock:
+            grid = self._grids.get(key)
+            if grid is not None:
+                self._grids.move_to_end(key)
+                self.hits += 1
+                return grid
+            self.misses += 1
+        # Solve with the bucket's representative points, so a cached grid does
+        # not depend on which request filled it
+        q_dst = np.array(key[0], dtype=np.float64).reshape(-1, 2) * self.quantum
+        q_src = np.array(key[1], dtype=np.float64).reshape(-1, 2) * self.quantum
+        grid = tps_grid(q_dst, q_src, self.grid_size)
+        with self._lock:
+            self._grids[key] = grid
+            while len(self._grids) > self.cache_size:
+                self._grids.popitem(last=False)
+        return grid
+
+    def warp(
+        self,
+        cutout: GarmentCutout,
+        anchors: Dict[str, Point],
+        pose: Pose,
+        box: Tuple[int, int, int, int],
+        garment_type: str
+    ) -> GarmentCutout:
+        """
+        Warp a cutout already scaled to the placement box.
+
+        Args:
+            cutout: Garment scaled to the box size (its source_size)
+            anchors: Garment anchors normalized to the garment frame
+            pose: Detected pose in user image pixels
+            box: Placement box (x, y, width, height) in user image pixels
+            garment_type: Garment type; only tops and pants are warped
+
+        Returns:
+            The warped cutout, or the input unchanged if the pose lacks the
+            keypoints to drive a warp
+        """
+        width, height = cutout.source_size
+        points = self.control_points(anchors, pose, box, garment_type)
+        if points is None or cutout.is_empty or width < 2 or height < 2:
+            return cutout
+        grid = self.grid(*points)
+        maps = cv2.resize(grid, (width, height), interpolation=cv2.INTER_LINEAR)
+        map_x = maps[:, :, 0] * width - (cutout.x + 0.5)
+        map_y = maps[:, :, 1] * height - (cutout.y + 0.5)
+        warped = cv2.remap(cutout.pixels, map_x, map_y, cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        x, y, w, h = cv2.boundingRect(warped[:, :, 3])
+        if w == 0 or h == 0:
+            return cutout
+        return GarmentCutout(warped[y:y + h, x:x + w], x, y, (width, height))
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "grids": len(self._grids),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+garment_warper = GarmentWarper.from_settings()
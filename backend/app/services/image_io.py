@@ -0,0 +1,128 @@
+import logging
+import math
+from io import BytesIO
+from typing import Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale by dropping DCT
+# coefficients, which is much cheaper than decoding at full size and resizing.
+_REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def is_jpeg(path: str) -> bool:
+    """Check the file signature rather than trusting the extension."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(3) == JPEG_MAGIC
+    except OSError:
+        return False
+
+
+def probe_size(source: Union[str, bytes]) -> Optional[Tuple[int, int]]:
+    """
+    Read the (width, height) of an image from its header without decoding pixels.
+
+    Args:
+        source: File path or the raw encoded bytes
+
+    Returns:
+        (width, height), or None if the header cannot be parsed
+    """
+    try:
+        fp = BytesIO(source) if isinstance(source, bytes) else source
+        with Image.open(fp) as img:
+            return img.size
+    except Exception as e:
+        logger.warning(f"Could not probe image size: {e}")
+        return None
+
+
+def reduction_factor(width: int, height: int, target_pixels: int) -> int:
+    """
+    Pick the largest DCT scale (1, 2, 4 or 8) that keeps at least target_pixels.
+
+    The decoded image is therefore never smaller than the working size, so
+    callers lose no detail they would have kept after their own resize.
+    """
+    if target_pixels <= 0:
+        return 1
+    for factor in (8, 4, 2):
+        if (width // factor) * (height // factor) >= target_pixels:
+            return factor
+    return 1
+
+
+def decode_image(path: str, target_pixels: int = 0, flags: int = cv2.IMREAD_COLOR) -> Optional[np.ndarray]:
+    """
+    Decode an image from disk, using a reduced-resolution JPEG decode when the
+    file is much larger than the working size.
+
+    Reduced decodes go through cv2.IMREAD_REDUCED_COLOR_*, which applies the EXIF
+    orientation to the already-reduced buffer, so no full-size copy is made.
+
+    Args:
+        path: Path to the image file
+        target_pixels: Working size in pixels; 0 disables the fast path
+        flags: cv2.imread flags used when the fast path does not apply
+
+    Returns:
+        The decoded image, or None if it could not be read (same as cv2.imread)
+    """
+    # Reduced decodes are colour-only; only take the fast path when the caller
+    # wants colour (or unchanged) data and the file is a JPEG, which has no alpha.
+    if target_pixels > 0 and flags in (cv2.IMREAD_COLOR, cv2.IMREAD_UNCHANGED) and is_jpeg(path):
+        size = probe_size(path)
+        if size:
+            factor = reduction_factor(size[0], size[1], target_pixels)
+            if factor > 1:
+                logger.info(f"Decoding {path} at 1/{factor} scale ({size[0]}x{size[1]} source)")
+                return cv2.imread(path, _REDUCED_COLOR_FLAGS[factor])
+    return cv2.imread(path, flags)
+
+
+def decoded_size(path: str, target_pixels: int = 0) -> Optional[Tuple[int, int]]:
+    """(width, height) that decode_image() will produce for a file, from its header."""
+    size = probe_size(path)
+    if size and target_pixels > 0 and is_jpeg(path):
+        factor = reduction_factor(size[0], size[1], target_pixels)
+        # libjpeg rounds reduced dimensions up
+        return -(-size[0] // factor), -(-size[1] // factor)
+    return size
+
+
+def open_upright(data: bytes, target_pixels: int = 0) -> Image.Image:
+    """
+    Open encoded image bytes with PIL, decoding JPEGs at reduced scale and
+    applying the EXIF orientation.
+
+    Image.draft() asks libjpeg for the smallest DCT scale that is still at least
+    the requested size, and the orientation is applied in place on that reduced
+    image rather than on a full-resolution copy.
+
+    Args:
+        data: Raw encoded image bytes
+        target_pixels: Working size in pixels; 0 decodes at full resolution
+
+    Returns:
+        Loaded PIL image in its upright orientation
+    """
+    img = Image.open(BytesIO(data))
+    if target_pixels > 0 and img.format == "JPEG":
+        width, height = img.size
+        if width * height > target_pixels:
+            scale = math.sqrt(target_pixels / (width * height))
+            img.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+    ImageOps.exif_transpose(img, in_place=True)
+    return img
@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+# Largest difference of a single thumbnail cell (0-255) between matching images;
+# re-encoding stays far below it, a print or logo that the mean hides does not
+MAX_CELL_DIFF = 64.0
+
+
+def _on_white(image: np.ndarray) -> np.ndarray:
+    """Composite transparent pixels onto white, the usual product-photo background."""
+    if image.ndim == 3 and image.shape[2] == 4:
+        alpha = image[:, :, 3:4].astype(np.float32) / 255.0
+        image = (image[:, :, :3] * alpha + 255.0 * (1.0 - alpha)).astype(np.uint8)
+    return image
+
+
+def dhash(image: np.ndarray, hash_size: int = 8) -> int:
+    """
+    Difference hash of an image: hash_size x hash_size bits, each telling
+    whether a pixel of the downscaled grey image is brighter than its right
+    neighbour. Robust to re-encoding and resizing, but blind to colour; see
+    color_thumbnail(). Transparent pixels are treated as white.
+    """
+    image = _on_white(image)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def color_thumbnail(image: np.ndarray, size: int = 16) -> np.ndarray:
+    """size x size BGR thumbnail, compared with thumbnail_distance() to tell apart garments dhash confuses."""
+    image = _on_white(image)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def thumbnail_distance(a: np.ndarray, b: np.ndarray) -> Tuple[float, float]:
+    """Mean and largest per-cell absolute colour difference of two thumbnails, on a 0-255 scale."""
+    cells = np.abs(a - b).mean(axis=2)
+    return float(cells.mean()), float(cells.max())
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with Hamming distance.
+
+    Each node keeps children keyed by their distance to it; by the triangle
+    inequality a search for radius r only descends into children whose key is
+    within r of the query's distance to the node.
+    """
+
+    def __init__(self):
+        # node: [hash, item ids, {distance: child node}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, item: int) -> None:
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """Return (distance, item) pairs within radius, nearest first."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class PerceptualIndex(Generic[T]):
+    """
+    Bounded near-duplicate cache keyed by perceptual hash.
+
+    Entries are evicted least-recently-used once their total size exceeds
+    max_bytes. The BK-tree cannot delete, so evicted ids are skipped on lookup
+    and the tree is rebuilt once it holds twice as many ids as live entries.
+    A match also requires the aspect ratio to agree within aspect_tolerance
+    and, when thumbnails are given, the colour thumbnails to differ by at most
+    max_color_diff on average (and MAX_CELL_DIFF in any cell), which the
+    grey-level hash alone does not capture.
+    """
+
+    def __init__(
+        self,
+        max_distance: int = 3,
+        max_bytes: int = 256 * 1024 * 1024,
+        aspect_tolerance: float = 0.03,
+        max_color_diff: float = 6.0
+    ):
+        self.max_distance = max_distance
+        self.max_bytes = max_bytes
+        self.aspect_tolerance = aspect_tolerance
+        self.max_color_diff = max_color_diff
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        # id -> (hash, aspect ratio, colour thumbnail, value, size in bytes)
+        self._entries: "OrderedDict[int, Tuple[int, float, Optional[np.ndarray], T, int]]" = OrderedDict()
+        self._next_id = 0
+        self._bytes = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self._lookup_seconds = 0.0
+        self._lookup_max = 0.0
+
+    def _same_colors(self, stored: Optional[np.ndarray], thumbnail: Optional[np.ndarray]) -> bool:
+        if stored is None or thumbnail is None:
+            return stored is None and thumbnail is None
+        mean_diff, max_diff = thumbnail_distance(stored, thumbnail)
+        return mean_diff <= self.max_color_diff and max_diff <= MAX_CELL_DIFF
+
+    def lookup(self, image_hash: int, aspect: float, thumbnail: Optional[np.ndarray] = None) -> Optional[Tuple[int, T]]:
+        """
+        Find the nearest stored entry.
+
+        Returns:
+            (Hamming distance, value), or None if nothing is close enough
+        """
+        start = time.perf_counter()
+        with self._lock:
+            match = None
+            for distance, item in self._tree.search(image_hash, self.max_distance):
+                entry = self._entries.get(item)
+                if entry is None:
+                    continue
+                if abs(entry[1] - aspect) <= self.aspect_tolerance * aspect and self._same_colors(entry[2], thumbnail):
+                    self._entries.move_to_end(item)
+                    match = (distance, entry[3])
+                    break
+            elapsed = time.perf_counter() - start
+            self.lookups += 1
+            self.hits += match is not None
+            self._lookup_seconds += elapsed
+            self._lookup_max = max(self._lookup_max, elapsed)
+        return match
+
+    def add(
+        self,
+        image_hash: int,
+        aspect: float,
+        value: T,
+        nbytes: int,
+        thumbnail: Optional[np.ndarray] = None
+    ) -> None:
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            item = self._next_id
+            self._next_id += 1
+            self._entries[item] = (image_hash, aspect, thumbnail, value, nbytes)
+            self._tree.add(image_hash, item)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, _, _, _, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+            if self._tree.size > 2 * len(self._entries) + 16:
+                self._rebuild()
+
+    def _rebuild(self) -> None:
+        tree = BKTree()
+        for item, (image_hash, _, _, _, _) in self._entries.items():
+            tree.add(image_hash, item)
+        self._tree = tree
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "lookup_mean_ms": 1000.0 * self._lookup_seconds / self.lookups if self.lookups else 0.0,
+                "lookup_max_ms": 1000.0 * self._lookup_max,
+            }
@@ -0,0 +1,174 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One node of the try-on pipeline.
+
+    The stage function is called with the results of its dependencies as
+    keyword arguments named after the dependency stages.
+    """
+    name: str
+    fn: Callable[..., Any]
+    deps: Tuple[str, ...] = ()
+
+
+class StageGraph:
+    """
+    A small dependency graph of pipeline stages.
+
+    Stages whose dependencies are satisfied run concurrently on the shared
+    worker pool. Every stage runs at most once per run(), so intermediates that
+    several stages need are computed a single time, and each stage records its
+    wall-clock time in milliseconds.
+    """
+
+    def __init__(self, stages: Iterable[Stage], executor: Optional[ThreadPoolExecutor] = None):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage name: {stage.name}")
+            self.stages[stage.name] = stage
+        self.executor = executor
+        self._check_acyclic()
+
+    def _check_acyclic(self) -> None:
+        visiting, done = set(), set()
+
+        def visit(name: str) -> None:
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage graph has a cycle through: {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                if dep in self.stages:
+                    visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _timed(self, stage: Stage, kwargs: Dict[str, Any]) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        result = stage.fn(**kwargs)
+        return result, (time.perf_counter() - start) * 1000.0
+
+    def _pooled(self, stage: Stage, kwargs: Dict[str, Any]) -> Tuple[Any, float]:
+        """_timed on a pool thread, counted as busy for pool_stats()."""
+        global _busy
+        with _executor_lock:
+            _busy += 1
+        try:
+            return self._timed(stage, kwargs)
+        finally:
+            with _executor_lock:
+                _busy -= 1
+
+    @staticmethod
+    def _notify(on_stage: Optional[Callable[[str, float], None]], name: str, ms: float) -> None:
+        if on_stage is None:
+            return
+        try:
+            on_stage(name, ms)
+        except Exception as e:
+            logger.warning(f"Stage callback failed for {name}: {e}")
+
+    def run(
+        self,
+        seed: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None,
+        on_stage: Optional[Callable[[str, float], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Execute the graph.
+
+        Args:
+            seed: Values that are already known, keyed by stage name. Seeded
+                stages are not executed, which lets callers inject precomputed
+                intermediates.
+            timings: Optional dict that receives per-stage timings in milliseconds
+            on_stage: Optional callback invoked with (stage name, ms) as each
+                stage completes, e.g. to publish progress events
+
+        Returns:
+            Dictionary of every stage result (and seed value) keyed by name
+        """
+        results: Dict[str, Any] = dict(seed or {})
+        timings = timings if timings is not None else {}
+        pending = {name: stage for name, stage in self.stages.items() if name not in results}
+
+        for stage in pending.values():
+            missing = [dep for dep in stage.deps if dep not in self.stages and dep not in results]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown inputs: {missing}")
+
+        executor = self.executor or get_executor()
+        running: Dict[Future, Stage] = {}
+        try:
+            while pending or running:
+                ready = [s for s in pending.values() if all(dep in results for dep in s.deps)]
+                for stage in ready:
+                    del pending[stage.name]
+                    kwargs = {dep: results[dep] for dep in stage.deps}
+                    if not running and len(ready) == 1:
+                        # Nothing to overlap with: skip the pool hand-off
+                        results[stage.name], timings[stage.name] = self._timed(stage, kwargs)
+                        self._notify(on_stage, stage.name, timings[stage.name])
+                        break
+                    running[executor.submit(self._pooled, stage, kwargs)] = stage
+
+                if not running:
+                    continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    results[stage.name], timings[stage.name] = future.result()
+                    self._notify(on_stage, stage.name, timings[stage.name])
+        finally:
+            for future in running:
+                future.cancel()
+
+        logger.info("Stage timings (ms): " + ", ".join(f"{k}={v:.1f}" for k, v in timings.items()))
+        return results
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_busy = 0
+
+
+def _pool_size() -> int:
+    return settings.PIPELINE_WORKERS or min(8, os.cpu_count() or 1)
+
+
+def pool_stats() -> Dict[str, float]:
+    """Threads of the stage pool and how many are running a stage."""
+    workers = _pool_size()
+    with _executor_lock:
+        busy = _busy
+    return {"workers": workers, "busy": busy, "utilization": busy / workers}
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide worker pool used for pipeline stages."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = _pool_size()
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+            logger.info(f"Started pipeline worker pool with {workers} threads")
+        return _executor
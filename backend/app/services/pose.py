@@ -0,0 +1,225 @@
+import logging
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# OpenPose COCO keypoint layout
+NOSE = 0
+NECK = 1
+R_SHOULDER = 2
+R_ELBOW = 3
+R_WRIST = 4
+L_SHOULDER = 5
+L_ELBOW = 6
+L_WRIST = 7
+R_HIP = 8
+R_KNEE = 9
+R_ANKLE = 10
+L_HIP = 11
+L_KNEE = 12
+L_ANKLE = 13
+R_EYE = 14
+L_EYE = 15
+R_EAR = 16
+L_EAR = 17
+NUM_KEYPOINTS = 18
+
+KEYPOINT_NAMES = (
+    "Nose", "Neck", "RShoulder", "RElbow", "RWrist",
+    "LShoulder", "LElbow", "LWrist", "RHip", "RKnee",
+    "RAnkle", "LHip", "LKnee", "LAnkle", "REye",
+    "LEye", "REar", "LEar",
+)
+KEYPOINT_INDEX = {name: i for i, name in enumerate(KEYPOINT_NAMES)}
+
+# Column layout of the pose array
+X, Y, CONFIDENCE = 0, 1, 2
+
+Keypoints = Dict[str, Tuple[float, float]]
+
+
+class Pose:
+    """
+    A single-person pose backed by an (18, 3) float32 array of (x, y, confidence).
+
+    Rows follow the OpenPose COCO layout (see the index constants above). A
+    keypoint with confidence 0 was not detected.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Optional[np.ndarray] = None):
+        if data is None:
+            data = np.zeros((NUM_KEYPOINTS, 3), dtype=np.float32)
+        elif data.shape != (NUM_KEYPOINTS, 3):
+            raise ValueError(f"Pose data must have shape ({NUM_KEYPOINTS}, 3), got {data.shape}")
+        self.data = data.astype(np.float32, copy=False)
+
+    @classmethod
+    def from_keypoints(cls, keypoints: Keypoints, confidence: float = 1.0) -> "Pose":
+        """
+        Build a pose from a name -> (x, y) or (x, y, confidence) mapping.
+
+        Unknown names are ignored.
+        """
+        pose = cls()
+        for name, point in keypoints.items():
+            idx = KEYPOINT_INDEX.get(name)
+            if idx is None or point is None:
+                continue
+            pose.data[idx, X] = point[0]
+            pose.data[idx, Y] = point[1]
+            pose.data[idx, CONFIDENCE] = point[2] if len(point) > 2 else confidence
+        return pose
+
+    @classmethod
+    def coerce(cls, keypoints: Union["Pose", Keypoints, None]) -> "Pose":
+        """Accept either a Pose or a legacy keypoint dictionary."""
+        if isinstance(keypoints, Pose):
+            return keypoints
+        return cls.from_keypoints(keypoints or {})
+
+    def to_keypoints(self, threshold: float = 0.0) -> Dict[str, Tuple[int, int]]:
+        """Return detected keypoints as a name -> (x, y) dictionary of pixel coordinates."""
+        return {
+            KEYPOINT_NAMES[i]: (int(round(float(x))), int(round(float(y))))
+            for i, (x, y, conf) in enumerate(self.data)
+            if conf > threshold
+        }
+
+    def present(self, threshold: float = 0.0) -> np.ndarray:
+        """Boolean mask of detected keypoints."""
+        return self.data[:, CONFIDENCE] > threshold
+
+    def has(self, *indices: int, threshold: float = 0.0) -> bool:
+        return bool(np.all(self.data[list(indices), CONFIDENCE] > threshold))
+
+    def xy(self, index: int) -> Tuple[float, float]:
+        return float(self.data[index, X]), float(self.data[index, Y])
+
+    def count(self, threshold: float = 0.0) -> int:
+        return int(np.count_nonzero(self.present(threshold)))
+
+    def scaled(self, sx: float, sy: Optional[float] = None) -> "Pose":
+        """Return a copy with coordinates scaled, e.g. to map a preview pose to full resolution."""
+        data = self.data.copy()
+        data[:, X] *= sx
+        data[:, Y] *= sx if sy is None else sy
+        return Pose(data)
+
+    def __bool__(self) -> bool:
+        return bool(np.any(self.data[:, CONFIDENCE] > 0))
+
+    def __repr__(self) -> str:
+        return f"Pose({self.count()} keypoints)"
+
+
+def stack_poses(poses: Iterable[Union[Pose, Keypoints, None]]) -> np.ndarray:
+    """Stack poses into an (N, 18, 3) array for the batch positioning functions."""
+    arrays = [Pose.coerce(p).data for p in poses]
+    if not arrays:
+        return np.zeros((0, NUM_KEYPOINTS, 3), dtype=np.float32)
+    return np.stack(arrays)
+
+
+def garment_boxes(poses: np.ndarray, garment_types: Sequence[str], threshold: float = 0.0) -> np.ndarray:
+    """
+    Compute garment boxes for a batch of poses in one vectorised pass.
+
+    Rules, in order of preference for each row:
+      * top: shoulders and neck; width 1.8x shoulder width, height 1.2x width,
+        starting a third of the height above the neck
+      * bottom/pants: hips; width 1.6x hip width, height 0.8x width, starting
+        at the higher hip
+      * hat: nose; 0.3x the image width, above the eyes
+      * any type: a square of 0.4x the image width centred on the neck
+      * otherwise a square of a third of the image centred in the frame
+
+    The image size is approximated as twice the extent of the detected keypoints.
+
+    Args:
+        poses: (N, 18, 3) array of (x, y, confidence)
+        garment_types: N garment type names
+        threshold: Minimum confidence for a keypoint to count as detected
+
+    Returns:
+        (N, 4) int array of (x, y, width, height); all zeros for empty poses
+    """
+    poses = np.asarray(poses, dtype=np.float64)
+    if poses.ndim == 2:
+        poses = poses[None]
+    n = poses.shape[0]
+    types = np.asarray(garment_types, dtype=object)
+    if types.shape != (n,):
+        raise ValueError(f"Expected {n} garment types, got {types.shape}")
+
+    xs, ys = poses[:, :, X], poses[:, :, Y]
+    present = poses[:, :, CONFIDENCE] > threshold
+    detected = present.any(axis=1)
+    width = np.where(detected, np.where(present, xs, -np.inf).max(axis=1), 0.0) * 2
+    height = np.where(detected, np.where(present, ys, -np.inf).max(axis=1), 0.0) * 2
+
+    def has(*indices: int) -> np.ndarray:
+        return present[:, list(indices)].all(axis=1)
+
+    # Top: shoulders and neck
+    shoulder_width = np.abs(xs[:, R_SHOULDER] - xs[:, L_SHOULDER])
+    center_x = np.floor((xs[:, R_SHOULDER] + xs[:, L_SHOULDER]) / 2)
+    top_w = np.trunc(shoulder_width * 1.8)
+    top_h = np.trunc(top_w * 1.2)
+    top = np.stack([
+        np.maximum(0, center_x - np.floor(top_w / 2)),
+        np.maximum(0, ys[:, NECK] - np.floor(top_h / 3)),
+        top_w, top_h,
+    ], axis=1)
+
+    # Bottom: hips
+    hip_width = np.abs(xs[:, R_HIP] - xs[:, L_HIP])
+    center_x = np.floor((xs[:, R_HIP] + xs[:, L_HIP]) / 2)
+    bottom_w = np.trunc(hip_width * 1.6)
+    bottom_h = np.trunc(bottom_w * 0.8)
+    bottom = np.stack([
+        np.maximum(0, center_x - np.floor(bottom_w / 2)),
+        np.minimum(ys[:, R_HIP], ys[:, L_HIP]),
+        bottom_w, bottom_h,
+    ], axis=1)
+
+    # Hat: nose, with the eyes approximated 40px above it
+    hat_size = np.trunc(width * 0.3)
+    hat = np.stack([
+        np.maximum(0, xs[:, NOSE] - np.floor(hat_size / 2)),
+        np.maximum(0, ys[:, NOSE] - 40 - hat_size),
+        hat_size, hat_size,
+    ], axis=1)
+
+    # Fallback: square around the neck
+    neck_size = np.trunc(width * 0.4)
+    neck = np.stack([
+        np.maximum(0, xs[:, NECK] - np.floor(neck_size / 2)),
+        np.maximum(0, ys[:, NECK] - np.floor(neck_size / 2)),
+        neck_size, neck_size,
+    ], axis=1)
+
+    # Last resort: centre of the frame
+    center_size = np.floor(np.minimum(width, height) / 3)
+    center = np.stack([
+        np.floor((width - center_size) / 2),
+        np.floor((height - center_size) / 2),
+        center_size, center_size,
+    ], axis=1)
+
+    is_top = types == "top"
+    is_bottom = (types == "bottom") | (types == "pants")
+    is_hat = types == "hat"
+    conditions = [
+        ~detected,
+        is_top & has(R_SHOULDER, L_SHOULDER, NECK),
+        is_bottom & has(R_HIP, L_HIP),
+        is_hat & has(NOSE),
+        has(NECK),
+    ]
+    choices = [np.zeros((n, 4)), top, bottom, hat, neck]
+    boxes = np.select([c[:, None] for c in conditions], choices, default=center)
+    return boxes.astype(np.int64)
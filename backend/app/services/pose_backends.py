@@ -0,0 +1,346 @@
+import logging
+import os
+import statistics
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .pose import NUM_KEYPOINTS, Pose
+from .pose_parsing import COCO_OUTPUT_CHANNELS, PafParser, select_person
+
+logger = logging.getLogger(__name__)
+
+# Names accepted by the POSE_DNN_BACKEND / POSE_DNN_TARGET settings, resolved
+# lazily because not every OpenCV build exposes every backend.
+DNN_BACKENDS = {
+    "default": "DNN_BACKEND_DEFAULT",
+    "opencv": "DNN_BACKEND_OPENCV",
+    "inference_engine": "DNN_BACKEND_INFERENCE_ENGINE",
+    "cuda": "DNN_BACKEND_CUDA",
+}
+DNN_TARGETS = {
+    "cpu": "DNN_TARGET_CPU",
+    "opencl": "DNN_TARGET_OPENCL",
+    "opencl_fp16": "DNN_TARGET_OPENCL_FP16",
+    "cuda": "DNN_TARGET_CUDA",
+    "cuda_fp16": "DNN_TARGET_CUDA_FP16",
+}
+
+# OpenPose COCO limbs, rooted at the neck
+POSE_PAIRS = [
+    [1, 0], [1, 2], [2, 3], [3, 4], [1, 5], [5, 6],
+    [6, 7], [1, 8], [8, 9], [9, 10], [1, 11], [11, 12], [12, 13],
+    [0, 14], [14, 16], [0, 15], [15, 17]
+]
+
+
+class PoseBackend:
+    """
+    Interface for a pose estimation implementation.
+
+    quality ranks backends for the "quality" selection policy (higher is
+    better); available is False when the backend's model or library is missing.
+    """
+
+    name = "base"
+    quality = 0
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def estimate(self, image: np.ndarray) -> Optional[Pose]:
+        raise NotImplementedError
+
+    def estimate_batch(self, images: Sequence[np.ndarray]) -> List[Optional[Pose]]:
+        return [self.estimate(image) for image in images]
+
+    def estimate_people(self, image: np.ndarray) -> List[Pose]:
+        pose = self.estimate(image)
+        return [pose] if pose else []
+
+
+class OpenPoseBackend(PoseBackend):
+    """OpenPose COCO model run through OpenCV's DNN module."""
+
+    name = "openpose"
+    quality = 3
+
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        input_size: Tuple[int, int] = (368, 368),
+        backend: str = "default",
+        target: str = "cpu",
+        threshold: float = 0.1,
+        person_selection: str = "largest"
+    ):
+        self.net = None
+        self.in_width, self.in_height = input_size
+        self.threshold = threshold
+        self.person_selection = person_selection
+        self.paf_parser = PafParser(POSE_PAIRS, peak_threshold=threshold)
+        # cv2.dnn.Net is not safe to drive from several threads at once
+        self._net_lock = threading.Lock()
+
+        try:
+            if model_path and os.path.exists(model_path):
+                proto_file = os.path.join(model_path, "pose_deploy_linevec.prototxt")
+                weights_file = os.path.join(model_path, "pose_iter_440000.caffemodel")
+                self.net = cv2.dnn.readNetFromCaffe(proto_file, weights_file)
+                self._configure_net(backend, target)
+                logger.info("Loaded custom OpenPose model")
+            else:
+                logger.warning("Could not load OpenPose model, OpenPose backend unavailable")
+        except Exception as e:
+            logger.warning(f"Failed to load pose estimation model: {e}")
+
+    @property
+    def available(self) -> bool:
+        return self.net is not None
+
+    def _configure_net(self, backend: str, target: str) -> None:
+        """Select the DNN backend and target device explicitly."""
+        backend_id = getattr(cv2.dnn, DNN_BACKENDS.get(backend, ""), None)
+        target_id = getattr(cv2.dnn, DNN_TARGETS.get(target, ""), None)
+        if backend_id is None or target_id is None:
+            logger.warning(f"Unsupported DNN backend/target {backend}/{target}, using default/cpu")
+            backend_id, target_id = cv2.dnn.DNN_BACKEND_DEFAULT, cv2.dnn.DNN_TARGET_CPU
+        self.net.setPreferableBackend(backend_id)
+        self.net.setPreferableTarget(target_id)
+        logger.info(f"OpenPose DNN backend={backend} target={target} input={self.in_width}x{self.in_height}")
+
+    def _forward(self, images: Sequence[np.ndarray]) -> np.ndarray:
+        """Run the network on a batch built with blobFromImages."""
+        blob = cv2.dnn.blobFromImages(
+            list(images), 1.0 / 255, (self.in_width, self.in_height),
+            (0, 0, 0), swapRB=False, crop=False)
+        with self._net_lock:
+            self.net.setInput(blob)
+            return self.net.forward()
+
+    def estimate(self, image: np.ndarray) -> Optional[Pose]:
+        return self.estimate_batch([image])[0]
+
+    def estimate_batch(self, images: Sequence[np.ndarray]) -> List[Optional[Pose]]:
+        output = self._forward(images)
+        return [
+            self._parse_output(output[i], image.shape[1], image.shape[0])
+            for i, image in enumerate(images)
+        ]
+
+    def estimate_people(self, image: np.ndarray) -> List[Pose]:
+        output = self._forward([image])[0]
+        if output.shape[0] >= COCO_OUTPUT_CHANNELS:
+            return self.paf_parser.parse(output, image.shape[1], image.shape[0])
+        pose = self._parse_single(output, image.shape[1], image.shape[0])
+        return [pose] if pose else []
+
+    def _parse_output(self, output: np.ndarray, frame_width: int, frame_height: int) -> Optional[Pose]:
+        """
+        Extract the subject's pose from the network output of a single image.
+
+        With part affinity fields available, keypoints are grouped per person
+        so that parts of different people are never mixed, and one person is
+        chosen according to person_selection.
+        """
+        if output.shape[0] >= COCO_OUTPUT_CHANNELS:
+            people = self.paf_parser.parse(output, frame_width, frame_height)
+            return select_person(people, frame_width, frame_height, self.person_selection)
+        return self._parse_single(output, frame_width, frame_height)
+
+    def _parse_single(self, output: np.ndarray, frame_width: int, frame_height: int) -> Optional[Pose]:
+        """Extract one keypoint per part from the global maximum of each heatmap."""
+        pose = Pose()
+        map_height, map_width = output.shape[1:3]
+        scale_x = frame_width / map_width
+        scale_y = frame_height / map_height
+
+        for i in range(NUM_KEYPOINTS):
+            # Find the global maximum of the part's confidence map and map it
+            # back to frame coordinates instead of upsampling the whole map
+            min_val, prob, min_loc, point = cv2.minMaxLoc(output[i])
+
+            if prob > self.threshold:
+                pose.data[i] = ((point[0] + 0.5) * scale_x, (point[1] + 0.5) * scale_y, prob)
+
+        return pose if pose else None
+
+
+class HaarBackend(PoseBackend):
+    """
+    A simple fallback that detects face and upper body with OpenCV's Haar cascades.
+
+    Always available; used when no learned model can be loaded.
+    """
+
+    name = "haar"
+    quality = 1
+
+    def __init__(self):
+        # Load the pre-trained Haar Cascade models once
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.upper_body_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_upperbody.xml')
+        # Cascade classifiers keep internal scratch buffers; serialize detection
+        self._lock = threading.Lock()
+
+    def estimate(self, image: np.ndarray) -> Optional[Pose]:
+        try:
+            # Convert to grayscale
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+            # Detect faces and upper body
+            with self._lock:
+                faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+                bodies = self.upper_body_cascade.detectMultiScale(gray, 1.1, 4)
+
+            keypoints = {}
+
+            # If we found a face, use it as a reference
+            if len(faces) > 0:
+                x, y, w, h = faces[0]
+                keypoints["Nose"] = (x + w // 2, y + h // 2)
+                keypoints["Neck"] = (x + w // 2, y + h)
+
+            # If we found an upper body, use it as a reference
+            if len(bodies) > 0:
+                x, y, w, h = bodies[0]
+                if "Neck" not in keypoints:
+                    keypoints["Neck"] = (x + w // 2, y + h // 4)
+                keypoints["RShoulder"] = (x + w, y + h // 4)
+                keypoints["LShoulder"] = (x, y + h // 4)
+                keypoints["RHip"] = (x + w, y + h)
+                keypoints["LHip"] = (x, y + h)
+
+            return Pose.from_keypoints(keypoints) if keypoints else None
+
+        except Exception as e:
+            logger.error(f"Error in simple pose estimation: {e}")
+            return None
+
+
+# BlazePose landmark for each COCO keypoint; the neck is the shoulder midpoint
+_BLAZEPOSE_TO_COCO = np.array([0, -1, 12, 14, 16, 11, 13, 15, 24, 26, 28, 23, 25, 27, 5, 2, 8, 7])
+_BLAZEPOSE_L_SHOULDER, _BLAZEPOSE_R_SHOULDER = 11, 12
+
+
+class MediaPipeBackend(PoseBackend):
+    """
+    MediaPipe PoseLandmarker using a bundled local .task model.
+
+    The 33 BlazePose landmarks are mapped onto the 18-keypoint COCO layout.
+    Unavailable when mediapipe is not installed or the model file is missing;
+    the model is never downloaded at runtime. The landmarker starts its own
+    threads, so it is created on first use: a server that forks after loading
+    the backends gives each worker its own.
+    """
+
+    name = "mediapipe"
+    quality = 2
+
+    def __init__(self, model_path: Optional[str] = None, min_visibility: float = 0.3):
+        self.landmarker = None
+        self._options = None
+        self.min_visibility = min_visibility
+        self._lock = threading.Lock()
+        if not model_path or not os.path.exists(model_path):
+            logger.info(f"MediaPipe pose model not found at {model_path}, MediaPipe backend unavailable")
+            return
+        try:
+            import mediapipe as mp
+            from mediapipe.tasks.python import BaseOptions
+            from mediapipe.tasks.python import vision
+
+            self._options = vision.PoseLandmarkerOptions(
+                base_options=BaseOptions(model_asset_path=model_path),
+                running_mode=vision.RunningMode.IMAGE,
+                num_poses=1,
+            )
+            self._mp = mp
+            self._vision = vision
+            logger.info(f"Found MediaPipe pose model at {model_path}")
+        except ImportError:
+            logger.info("mediapipe is not installed, MediaPipe backend unavailable")
+        except Exception as e:
+            logger.warning(f"Failed to load MediaPipe pose model: {e}")
+
+    @property
+    def available(self) -> bool:
+        return self._options is not None
+
+    def estimate(self, image: np.ndarray) -> Optional[Pose]:
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        mp_image = self._mp.Image(image_format=self._mp.ImageFormat.SRGB, data=rgb)
+        with self._lock:
+            if self.landmarker is None:
+                self.landmarker = self._vision.PoseLandmarker.create_from_options(self._options)
+            result = self.landmarker.detect(mp_image)
+        if not result.pose_landmarks:
+            return None
+
+        h, w = image.shape[:2]
+        landmarks = np.array(
+            [(lm.x * w, lm.y * h, lm.visibility) for lm in result.pose_landmarks[0]],
+            dtype=np.float32,
+        )
+        data = landmarks[np.maximum(_BLAZEPOSE_TO_COCO, 0)]
+        data[1] = (landmarks[_BLAZEPOSE_L_SHOULDER] + landmarks[_BLAZEPOSE_R_SHOULDER]) / 2
+        data[data[:, 2] < self.min_visibility, 2] = 0.0
+        pose = Pose(data)
+        return pose if pose else None
+
+
+def measure_latency(backend: PoseBackend, image: np.ndarray, runs: int = 3) -> float:
+    """Median latency of a backend on this host in milliseconds, after one warm-up run."""
+    backend.estimate(image)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.estimate(image)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def calibration_image(width: int = 640, height: int = 480) -> np.ndarray:
+    """A deterministic synthetic frame of a typical working size."""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    cv2.ellipse(image, (width // 2, height // 5), (width // 14, height // 10), 0, 0, 360, (180, 190, 220), -1)
+    cv2.rectangle(image, (width * 3 // 8, height // 3), (width * 5 // 8, height * 4 // 5), (60, 60, 160), -1)
+    return image
+
+
+def select_backend(
+    backends: Dict[str, PoseBackend],
+    latencies: Dict[str, float],
+    policy: str = "quality",
+    max_latency_ms: float = 0.0
+) -> PoseBackend:
+    """
+    Choose a backend from the calibrated latencies.
+
+    Args:
+        backends: Available backends by name
+        latencies: Measured median latency in ms by backend name
+        policy: "latency" picks the fastest backend; "quality" picks the best
+            backend within max_latency_ms (or the fastest if none fits)
+        max_latency_ms: Latency budget for the quality policy; 0 = unlimited
+
+    Returns:
+        The selected backend
+    """
+    measured = [b for name, b in backends.items() if name in latencies]
+    if not measured:
+        return next(iter(backends.values()))
+    fastest = min(measured, key=lambda b: latencies[b.name])
+    if policy == "latency":
+        return fastest
+    if policy != "quality":
+        logger.warning(f"Unknown pose backend policy {policy!r}, using 'quality'")
+    within_budget = [b for b in measured if not max_latency_ms or latencies[b.name] <= max_latency_ms]
+    if not within_budget:
+        return fastest
+    return max(within_budget, key=lambda b: (b.quality, -latencies[b.name]))
@@ -1,145 +1,222 @@
 import cv2
 import numpy as np
-from typing import Tuple, Dict, List, Optional, Any
+from typing import Tuple, Dict, List, Optional, Any, Sequence, Union
 import logging
-import os
+import time
+
+from .pose import (
+    KEYPOINT_NAMES, L_EAR, L_HIP, L_KNEE, L_SHOULDER, NOSE, R_EAR, R_HIP, R_KNEE, R_SHOULDER,
+    Keypoints, Pose, garment_boxes, stack_poses,
+)
+from .pose_backends import (
+    POSE_PAIRS, HaarBackend, MediaPipeBackend, OpenPoseBackend, PoseBackend,
+    calibration_image, measure_latency, select_backend,
+)
 
 logger = logging.getLogger(__name__)
 
 class PoseEstimator:
-    def __init__(self, model_path: Optional[str] = None):
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        input_size: Tuple[int, int] = (368, 368),
+        backend: str = "default",
+        target: str = "cpu",
+        person_selection: str = "largest",
+        mediapipe_model_path: Optional[str] = None,
+        enabled_backends: Sequence[str] = ("openpose", "mediapipe", "haar"),
+        preferred_backend: str = "auto",
+        policy: str = "quality",
+        max_latency_ms: float = 0.0,
+        calibrate: bool = True
+    ):
         """
-        Initialize the pose estimation model using OpenCV's DNN module.
+        Initialize the available pose backends and pick the default one.
         
         Args:
             model_path: Path to the OpenPose model files
+            input_size: OpenPose network input (width, height)
+            backend: OpenPose DNN backend name (see DNN_BACKENDS)
+            target: OpenPose DNN target device name (see DNN_TARGETS)
+            person_selection: Which person to use in multi-person images
+                ("largest" or "central")
+            mediapipe_model_path: Path to a local MediaPipe PoseLandmarker .task file
+            enabled_backends: Backends to load, by name
+            preferred_backend: Backend name to use by default, or "auto" to
+                choose by calibrated latency according to policy
+            policy: "quality" or "latency" (see select_backend)
+            max_latency_ms: Latency budget for the quality policy; 0 = unlimited
+            calibrate: Measure backend latencies on this host at startup; pass
+                False to call calibrate() later (e.g. after the server forks)
         """
-        self.net = None
-        self.in_height = 368
-        self.in_width = 368
         self.threshold = 0.1
-        self.pose_pairs = [
-            [1, 0], [1, 2], [2, 3], [3, 4], [1, 5], [5, 6],
-            [6, 7], [1, 8], [8, 9], [9, 10], [1, 11], [11, 12], [12, 13]
-        ]
-        self.keypoints_map = {
-            0: "Nose", 1: "Neck", 2: "RShoulder", 3: "RElbow", 4: "RWrist",
-            5: "LShoulder", 6: "LElbow", 7: "LWrist", 8: "RHip", 9: "RKnee",
-            10: "RAnkle", 11: "LHip", 12: "LKnee", 13: "LAnkle", 14: "REye",
-            15: "LEye", 16: "REar", 17: "LEar"
+        self.pose_pairs = POSE_PAIRS
+        self.keypoints_map = dict(enumerate(KEYPOINT_NAMES))
+        # Amortized latency of the most recent estimate_poses() call
+        self.last_batch_stats: Dict[str, float] = {}
+        
+        factories = {
+            "openpose": lambda: OpenPoseBackend(
+                model_path, input_size, backend, target, self.threshold, person_selection),
+            "mediapipe": lambda: MediaPipeBackend(mediapipe_model_path),
+            "haar": HaarBackend,
         }
+        self.backends: Dict[str, PoseBackend] = {}
+        for name in enabled_backends:
+            if name not in factories:
+                logger.warning(f"Unknown pose backend: {name}")
+                continue
+            candidate = factories[name]()
+            if candidate.available:
+                self.backends[name] = candidate
+        # The Haar cascades ship with OpenCV, so there is always a fallback
+        self.fallback = self.backends.get("haar") or HaarBackend()
+        self.backends.setdefault("haar", self.fallback)
         
-        try:
-            # Try to load the model from the specified path or use a default model
-            if model_path and os.path.exists(model_path):
-                proto_file = os.path.join(model_path, "pose_deploy_linevec.prototxt")
-                weights_file = os.path.join(model_path, "pose_iter_440000.caffemodel")
-                self.net = cv2.dnn.readNetFromCaffe(proto_file, weights_file)
-                logger.info("Loaded custom OpenPose model")
-            else:
-                # Fallback to a simpler approach if model loading fails
-                logger.warning("Could not load OpenPose model, using simple body detection")
-        except Exception as e:
-            logger.warning(f"Failed to load pose estimation model: {e}")
+        self.preferred_backend = preferred_backend
+        self.policy = policy
+        self.max_latency_ms = max_latency_ms
+        self.latencies: Dict[str, float] = {}
+        self.active = self._choose_backend()
+        if calibrate and preferred_backend == "auto":
+            self.calibrate()
+
+    def _choose_backend(self) -> PoseBackend:
+        """The preferred backend, or the one select_backend picks from the latencies measured so far."""
+        if self.preferred_backend != "auto" and self.preferred_backend in self.backends:
+            active = self.backends[self.preferred_backend]
+        else:
+            if self.preferred_backend != "auto":
+                logger.warning(f"Preferred pose backend {self.preferred_backend!r} is unavailable")
+            active = select_backend(self.backends, self.latencies, self.policy, self.max_latency_ms)
+        logger.info(f"Pose backends available: {sorted(self.backends)}; using {active.name}")
+        return active
+
+    @property
+    def net(self):
+        """The OpenPose network, or None when that backend is not loaded."""
+        openpose = self.backends.get("openpose")
+        return openpose.net if openpose else None
+
+    def calibrate(self, image: Optional[np.ndarray] = None, runs: int = 3) -> Dict[str, float]:
+        """
+        Measure each available backend's median latency on this host and, with
+        preferred_backend "auto", select the default backend from them.
+        
+        This is the first inference of every backend; it starts OpenCV's and
+        MediaPipe's thread pools, so it must run after the process forks.
+        
+        Returns:
+            Latency in milliseconds by backend name
+        """
+        image = calibration_image() if image is None else image
+        for name, candidate in self.backends.items():
+            try:
+                self.latencies[name] = measure_latency(candidate, image, runs)
+                logger.info(f"Pose backend {name}: {self.latencies[name]:.1f} ms")
+            except Exception as e:
+                logger.warning(f"Calibration of pose backend {name} failed: {e}")
+        if self.preferred_backend == "auto":
+            self.active = self._choose_backend()
+        return self.latencies
+
+    def backend_for(self, name: Optional[str] = None) -> PoseBackend:
+        """Resolve a per-request backend override, defaulting to the selected backend."""
+        if not name:
+            return self.active
+        if name not in self.backends:
+            logger.warning(f"Pose backend {name!r} is unavailable, using {self.active.name}")
+            return self.active
+        return self.backends[name]
 
-    def estimate_pose(self, image: np.ndarray) -> Optional[Dict[str, Tuple[float, float]]]:
+    def estimate_pose(self, image: np.ndarray, backend: Optional[str] = None) -> Optional[Dict[str, Tuple[float, float]]]:
         """
-        Estimate pose keypoints from an image using OpenCV's DNN module.
+        Estimate pose keypoints from an image.
         
         Args:
             image: Input image in BGR format
+            backend: Optional backend name overriding the selected one
             
         Returns:
             Dictionary of landmark names to (x, y) coordinates, or None if no pose detected
         """
-        if self.net is None:
-            return self._estimate_pose_simple(image)
+        pose = self.estimate(image, backend)
+        return pose.to_keypoints() if pose else None
+
+    def estimate(self, image: np.ndarray, backend: Optional[str] = None) -> Optional[Pose]:
+        """
+        Estimate the pose in an image, keeping per-keypoint confidences.
+        
+        Args:
+            image: Input image in BGR format
+            backend: Optional backend name overriding the selected one
             
+        Returns:
+            Pose, or None if no pose detected
+        """
+        selected = self.backend_for(backend)
         try:
-            # Prepare the frame
-            frame_height, frame_width = image.shape[:2]
-            
-            # Prepare the frame for the network
-            inp_blob = cv2.dnn.blobFromImage(
-                image, 1.0 / 255, (self.in_width, self.in_height),
-                (0, 0, 0), swapRB=False, crop=False)
-                
-            # Set the input to the network
-            self.net.setInput(inp_blob)
-            
-            # Run forward pass to get the output
-            output = self.net.forward()
-            
-            # Extract keypoints
-            points = []
-            keypoints = {}
-            
-            for i in range(len(self.keypoints_map)):
-                # Confidence map of corresponding body's part.
-                prob_map = output[0, i, :, :]
-                prob_map = cv2.resize(prob_map, (frame_width, frame_height))
-                
-                # Find global maxima of the prob_map.
-                min_val, prob, min_loc, point = cv2.minMaxLoc(prob_map)
-                
-                if prob > self.threshold:
-                    x = point[0]
-                    y = point[1]
-                    keypoints[self.keypoints_map[i]] = (x, y)
-                    points.append((x, y))
-                else:
-                    points.append(None)
-            
-            return keypoints if keypoints else None
-            
+            return selected.estimate(image)
         except Exception as e:
-            logger.error(f"Error in pose estimation: {e}")
-            return self._estimate_pose_simple(image)
-    
-    def _estimate_pose_simple(self, image: np.ndarray) -> Optional[Dict[str, Tuple[float, float]]]:
+            logger.error(f"Error in pose estimation ({selected.name}): {e}")
+            return self.fallback.estimate(image)
+
+    def estimate_people(self, image: np.ndarray, backend: Optional[str] = None) -> List[Pose]:
         """
-        A simple fallback pose estimation that detects face and body using OpenCV's Haar cascades.
-        This is used when the DNN model is not available.
+        Estimate the poses of every person in an image.
+        
+        Only the OpenPose backend separates people (using its part affinity
+        fields); other backends return at most one pose.
+        
+        Args:
+            image: Input image in BGR format
+            backend: Optional backend name overriding the selected one
+            
+        Returns:
+            Poses, best-scoring person first
         """
+        selected = self.backend_for(backend)
         try:
-            # Convert to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # Load the pre-trained Haar Cascade models
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            upper_body_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_upperbody.xml')
-            
-            # Detect faces and upper body
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-            bodies = upper_body_cascade.detectMultiScale(gray, 1.1, 4)
-            
-            keypoints = {}
-            
-            # If we found a face, use it as a reference
-            if len(faces) > 0:
-                x, y, w, h = faces[0]
-                keypoints["Nose"] = (x + w // 2, y + h // 2)
-                keypoints["Neck"] = (x + w // 2, y + h)
-            
-            # If we found an upper body, use it as a reference
-            if len(bodies) > 0:
-                x, y, w, h = bodies[0]
-                if "Neck" not in keypoints:
-                    keypoints["Neck"] = (x + w // 2, y + h // 4)
-                keypoints["RShoulder"] = (x + w, y + h // 4)
-                keypoints["LShoulder"] = (x, y + h // 4)
-                keypoints["RHip"] = (x + w, y + h)
-                keypoints["LHip"] = (x, y + h)
-            
-            return keypoints if keypoints else None
-            
+            return selected.estimate_people(image)
         except Exception as e:
-            logger.error(f"Error in simple pose estimation: {e}")
-            return None
+            logger.error(f"Error in multi-person pose estimation ({selected.name}): {e}")
+            return self.fallback.estimate_people(image)
+
+    def estimate_poses(self, images: Sequence[np.ndarray], backend: Optional[str] = None) -> List[Optional[Pose]]:
+        """
+        Estimate poses for a batch of images.
         
-        return keypoints
+        The OpenPose backend runs the whole batch through a single DNN forward
+        pass, so batch try-on and video frames pay the per-call overhead once.
+        The amortized per-image latency is logged and kept in last_batch_stats.
+        
+        Args:
+            images: Input images in BGR format; they may differ in size
+            backend: Optional backend name overriding the selected one
+            
+        Returns:
+            One Pose (or None if no pose detected) per input image
+        """
+        if not images:
+            return []
+        selected = self.backend_for(backend)
+        start = time.perf_counter()
+        try:
+            poses = selected.estimate_batch(images)
+        except Exception as e:
+            logger.error(f"Error in batched pose estimation ({selected.name}): {e}")
+            poses = self.fallback.estimate_batch(images)
+        total_ms = (time.perf_counter() - start) * 1000.0
+        self.last_batch_stats = {
+            "images": len(images),
+            "total_ms": total_ms,
+            "per_image_ms": total_ms / len(images),
+        }
+        logger.info(f"Estimated {len(images)} poses in {total_ms:.1f} ms "
+                    f"({total_ms / len(images):.1f} ms/image amortized)")
+        return poses
 
-    def draw_pose(self, image: np.ndarray, keypoints: Dict[str, Tuple[float, float]]) -> np.ndarray:
+    def draw_pose(self, image: np.ndarray, keypoints: Union[Pose, Keypoints]) -> np.ndarray:
         """
         Draw the detected pose on the image for debugging.
         
@@ -150,6 +227,8 @@ class PoseEstimator:
         Returns:
             Image with pose drawn
         """
+        if isinstance(keypoints, Pose):
+            keypoints = keypoints.to_keypoints()
         if not keypoints:
             return image
             
@@ -222,115 +301,51 @@ class PoseEstimator:
 
     def get_garment_position(
         self, 
-        keypoints: Dict[str, Tuple[float, float]], 
+        keypoints: Union[Pose, Keypoints], 
         garment_type: str
     ) -> Tuple[int, int, int, int]:
         """
         Calculate the position and size of the garment based on pose keypoints.
         
         Args:
-            keypoints: Dictionary of detected keypoints
-            garment_type: Type of garment ('top', 'bottom', 'hat', etc.)
+            keypoints: Detected pose, or a dictionary of detected keypoints
+            garment_type: Type of garment ('top', 'pants'/'bottom', 'hat', etc.)
             
         Returns:
             Tuple of (x, y, width, height) for the garment
         """
-        if not keypoints:
+        pose = Pose.coerce(keypoints)
+        if not pose:
             logger.warning("No keypoints provided for garment positioning")
             return 0, 0, 0, 0
-            
-        # Get image dimensions from keypoints (approximate)
-        max_x = max([k[0] for k in keypoints.values()]) if keypoints else 0
-        max_y = max([k[1] for k in keypoints.values()]) if keypoints else 0
-        height, width = max_y * 2, max_x * 2
+        x, y, width, height = garment_boxes(pose.data[None], [garment_type])[0]
+        return int(x), int(y), int(width), int(height)
+
+    def get_garment_positions(
+        self,
+        poses: Sequence[Union[Pose, Keypoints]],
+        garment_types: Sequence[str]
+    ) -> np.ndarray:
+        """
+        Batch version of get_garment_position for video frames and batch try-on.
         
-        try:
-            if garment_type == 'top':
-                # Use shoulders and neck for top positioning
-                if 'RShoulder' in keypoints and 'LShoulder' in keypoints and 'Neck' in keypoints:
-                    neck = keypoints['Neck']
-                    r_shoulder = keypoints['RShoulder']
-                    l_shoulder = keypoints['LShoulder']
-                    
-                    # Calculate shoulder width and body center
-                    shoulder_width = abs(r_shoulder[0] - l_shoulder[0])
-                    center_x = (r_shoulder[0] + l_shoulder[0]) // 2
-                    
-                    # Calculate dimensions
-                    garment_width = int(shoulder_width * 1.8)  # Add padding
-                    garment_height = int(garment_width * 1.2)  # Slightly taller than wide
-                    
-                    # Position
-                    x = center_x - garment_width // 2
-                    y = neck[1] - garment_height // 3  # Start above neck
-                    
-                    return max(0, x), max(0, y), garment_width, garment_height
-                
-            elif garment_type == 'bottom':
-                # Use hips for bottom positioning
-                if 'RHip' in keypoints and 'LHip' in keypoints:
-                    r_hip = keypoints['RHip']
-                    l_hip = keypoints['LHip']
-                    
-                    # Calculate hip width and center
-                    hip_width = abs(r_hip[0] - l_hip[0])
-                    center_x = (r_hip[0] + l_hip[0]) // 2
-                    
-                    # Calculate dimensions
-                    garment_width = int(hip_width * 1.6)  # Add padding
-                    garment_height = int(garment_width * 0.8)  # Wider than tall
-                    
-                    # Position
-                    x = center_x - garment_width // 2
-                    y = min(r_hip[1], l_hip[1])  # Start at the higher hip point
-                    
-                    return max(0, x), y, garment_width, garment_height
-                
-            elif garment_type == 'hat':
-                # Use nose and eyes for hat positioning
-                if 'Nose' in keypoints:
-                    nose = keypoints['Nose']
-                    eye_level = nose[1] - 40  # Approximate eye level
-                    
-                    # Calculate hat size based on face size
-                    hat_size = int(width * 0.3)
-                    
-                    # Position hat above the head
-                    x = nose[0] - hat_size // 2
-                    y = eye_level - hat_size
-                    
-                    return max(0, x), max(0, y), hat_size, hat_size
-            
-            # Fallback positioning based on available keypoints
-            if 'Neck' in keypoints:
-                neck = keypoints['Neck']
-                size = int(width * 0.4)  # Default size
-                x = neck[0] - size // 2
-                y = neck[1] - size // 2
-                return max(0, x), max(0, y), size, size
-                
-            # Last resort: use image center
-            logger.warning("Using fallback garment positioning")
-            size = min(width, height) // 3
-            return (width - size) // 2, (height - size) // 2, size, size
-            
-        except Exception as e:
-            logger.error(f"Error in get_garment_position: {e}")
-            # Return a safe default
-            size = min(width, height) // 3
-            return (width - size) // 2, (height - size) // 2, size, size
+        Returns:
+            (N, 4) int array of (x, y, width, height)
+        """
+        return garment_boxes(stack_poses(poses), garment_types)
 
-    def _get_top_position(self, keypoints: Dict[str, Tuple[float, float]]) -> Tuple[int, int, int, int]:
+    def _get_top_position(self, keypoints: Union[Pose, Keypoints]) -> Tuple[int, int, int, int]:
         """Calculate position for a top (shirt/jacket)."""
-        # Get relevant keypoints
-        left_shoulder = keypoints.get('LEFT_SHOULDER')
-        right_shoulder = keypoints.get('RIGHT_SHOULDER')
-        left_hip = keypoints.get('LEFT_HIP')
-        right_hip = keypoints.get('RIGHT_HIP')
-        
-        if not all([left_shoulder, right_shoulder, left_hip, right_hip]):
+        pose = Pose.coerce(keypoints)
+        if not pose.has(L_SHOULDER, R_SHOULDER, L_HIP, R_HIP):
             return 0, 0, 0, 0
             
+        # Get relevant keypoints
+        left_shoulder = pose.xy(L_SHOULDER)
+        right_shoulder = pose.xy(R_SHOULDER)
+        left_hip = pose.xy(L_HIP)
+        right_hip = pose.xy(R_HIP)
+            
         # Calculate width based on shoulder width
         shoulder_width = abs(left_shoulder[0] - right_shoulder[0])
         width = int(shoulder_width * 1.4)  # Add some margin
@@ -342,23 +357,24 @@ class PoseEstimator:
         
         # Center x-coordinate
         center_x = (left_shoulder[0] + right_shoulder[0]) // 2
-        x = center_x - (width // 2)
+        x = int(center_x - (width // 2))
         
         # Start y-coordinate slightly above shoulders
         y = int(shoulder_y - (height * 0.1))
         
         return x, y, width, height
     
-    def _get_pants_position(self, keypoints: Dict[str, Tuple[float, float]]) -> Tuple[int, int, int, int]:
+    def _get_pants_position(self, keypoints: Union[Pose, Keypoints]) -> Tuple[int, int, int, int]:
         """Calculate position for pants."""
-        left_hip = keypoints.get('LEFT_HIP')
-        right_hip = keypoints.get('RIGHT_HIP')
-        left_knee = keypoints.get('LEFT_KNEE')
-        right_knee = keypoints.get('RIGHT_KNEE')
-        
-        if not all([left_hip, right_hip, left_knee, right_knee]):
+        pose = Pose.coerce(keypoints)
+        if not pose.has(L_HIP, R_HIP, L_KNEE, R_KNEE):
             return 0, 0, 0, 0
             
+        left_hip = pose.xy(L_HIP)
+        right_hip = pose.xy(R_HIP)
+        left_knee = pose.xy(L_KNEE)
+        right_knee = pose.xy(R_KNEE)
+            
         # Calculate width based on hip width
         hip_width = abs(left_hip[0] - right_hip[0])
         width = int(hip_width * 1.3)  # Add some margin
@@ -370,22 +386,23 @@ class PoseEstimator:
         
         # Center x-coordinate
         center_x = (left_hip[0] + right_hip[0]) // 2
-        x = center_x - (width // 2)
+        x = int(center_x - (width // 2))
         
         # Start y-coordinate at hips
         y = int(hip_y - (height * 0.1))
         
         return x, y, width, height
     
-    def _get_hat_position(self, keypoints: Dict[str, Tuple[float, float]]) -> Tuple[int, int, int, int]:
+    def _get_hat_position(self, keypoints: Union[Pose, Keypoints]) -> Tuple[int, int, int, int]:
         """Calculate position for a hat."""
-        left_ear = keypoints.get('LEFT_EAR')
-        right_ear = keypoints.get('RIGHT_EAR')
-        nose = keypoints.get('NOSE')
-        
-        if not all([left_ear, right_ear, nose]):
+        pose = Pose.coerce(keypoints)
+        if not pose.has(L_EAR, R_EAR, NOSE):
             return 0, 0, 0, 0
             
+        left_ear = pose.xy(L_EAR)
+        right_ear = pose.xy(R_EAR)
+        nose = pose.xy(NOSE)
+            
         # Calculate width based on head width
         head_width = abs(left_ear[0] - right_ear[0])
         width = int(head_width * 1.8)  # Make hat wider than head
@@ -393,7 +410,7 @@ class PoseEstimator:
         
         # Center x-coordinate
         center_x = (left_ear[0] + right_ear[0]) // 2
-        x = center_x - (width // 2)
+        x = int(center_x - (width // 2))
         
         # Position above head
         head_top = min(left_ear[1], right_ear[1], nose[1])
@@ -401,8 +418,10 @@ class PoseEstimator:
         
         return x, y, width, height
 
-    def draw_pose(self, image: np.ndarray, keypoints: Dict[str, Tuple[float, float]]) -> np.ndarray:
+    def draw_pose(self, image: np.ndarray, keypoints: Union[Pose, Keypoints]) -> np.ndarray:
         """Draw pose landmarks on the image for debugging."""
+        if isinstance(keypoints, Pose):
+            keypoints = keypoints.to_keypoints()
         if not keypoints:
             return image
             
@@ -0,0 +1,195 @@
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .pose import CONFIDENCE, NUM_KEYPOINTS, X, Y, Pose
+
+logger = logging.getLogger(__name__)
+
+# Part affinity field channels (x, y) of the COCO OpenPose output for each limb
+PAF_CHANNELS: Dict[Tuple[int, int], Tuple[int, int]] = {
+    (1, 0): (47, 48), (1, 2): (31, 32), (2, 3): (33, 34), (3, 4): (35, 36),
+    (1, 5): (39, 40), (5, 6): (41, 42), (6, 7): (43, 44), (1, 8): (19, 20),
+    (8, 9): (21, 22), (9, 10): (23, 24), (1, 11): (25, 26), (11, 12): (27, 28),
+    (12, 13): (29, 30), (0, 14): (49, 50), (14, 16): (53, 54), (0, 15): (51, 52),
+    (15, 17): (55, 56),
+}
+# Heatmaps (18 parts + background) followed by 38 PAF channels
+COCO_OUTPUT_CHANNELS = 57
+
+
+class PafParser:
+    """
+    Group keypoints into people using OpenPose part affinity fields.
+
+    All heatmap peaks are extracted with non-maximum suppression, every
+    candidate limb is scored by sampling the PAF along its segment in a single
+    batched NumPy gather, and limbs are greedily assembled into skeletons
+    following the pose pair tree.
+    """
+
+    def __init__(
+        self,
+        pose_pairs: Sequence[Sequence[int]],
+        peak_threshold: float = 0.1,
+        paf_threshold: float = 0.05,
+        samples: int = 10,
+        min_parts: int = 4,
+        min_mean_score: float = 0.4,
+        upsample: int = 4
+    ):
+        self.pose_pairs = [tuple(pair) for pair in pose_pairs if tuple(pair) in PAF_CHANNELS]
+        self.peak_threshold = peak_threshold
+        self.paf_threshold = paf_threshold
+        self.samples = samples
+        self.min_parts = min_parts
+        self.min_mean_score = min_mean_score
+        self.upsample = upsample
+
+    def find_peaks(self, heatmap: np.ndarray) -> np.ndarray:
+        """Return (k, 3) array of (x, y, score) local maxima above the threshold."""
+        smoothed = cv2.GaussianBlur(heatmap, (3, 3), 0)
+        local_max = cv2.dilate(smoothed, np.ones((3, 3), np.uint8))
+        ys, xs = np.nonzero((smoothed == local_max) & (smoothed > self.peak_threshold))
+        return np.stack([xs, ys, heatmap[ys, xs]], axis=1).astype(np.float32)
+
+    def score_limbs(self, peaks_a: np.ndarray, peaks_b: np.ndarray, paf_x: np.ndarray,
+                    paf_y: np.ndarray) -> List[Tuple[int, int, float]]:
+        """
+        Score every (a, b) candidate pair by the PAF line integral and greedily
+        keep the best non-conflicting connections.
+
+        Returns:
+            List of (index into peaks_a, index into peaks_b, score)
+        """
+        if len(peaks_a) == 0 or len(peaks_b) == 0:
+            return []
+        map_h, map_w = paf_x.shape
+        a, b = peaks_a[:, :2], peaks_b[:, :2]
+
+        delta = b[None, :, :] - a[:, None, :]                       # (na, nb, 2)
+        norm = np.linalg.norm(delta, axis=2) + 1e-6                  # (na, nb)
+        unit = delta / norm[..., None]
+
+        t = np.linspace(0.0, 1.0, self.samples, dtype=np.float32)
+        points = a[:, None, None, :] + t[None, None, :, None] * delta[:, :, None, :]  # (na, nb, K, 2)
+        ix = np.clip(np.rint(points[..., 0]).astype(np.intp), 0, map_w - 1)
+        iy = np.clip(np.rint(points[..., 1]).astype(np.intp), 0, map_h - 1)
+        dots = paf_x[iy, ix] * unit[..., 0:1] + paf_y[iy, ix] * unit[..., 1:2]  # (na, nb, K)
+
+        # Penalise limbs longer than half the map height
+        scores = dots.mean(axis=2) + np.minimum(0.5 * map_h / norm - 1.0, 0.0)
+        valid = (np.count_nonzero(dots > self.paf_threshold, axis=2) >= 0.8 * self.samples) & (scores > 0)
+
+        ia, ib = np.nonzero(valid)
+        if ia.size == 0:
+            return []
+        order = np.argsort(-scores[ia, ib])
+        used_a, used_b = set(), set()
+        connections = []
+        for i, j in zip(ia[order].tolist(), ib[order].tolist()):
+            if i in used_a or j in used_b:
+                continue
+            used_a.add(i)
+            used_b.add(j)
+            connections.append((i, j, float(scores[i, j])))
+        return connections
+
+    def parse(self, output: np.ndarray, frame_width: int, frame_height: int) -> List[Pose]:
+        """
+        Parse the network output of one image into per-person poses.
+
+        Args:
+            output: (C, H, W) network output with heatmaps followed by PAFs
+            frame_width, frame_height: Size of the original image
+
+        Returns:
+            Poses in frame coordinates, best-scoring person first
+        """
+        maps = output[:COCO_OUTPUT_CHANNELS]
+        if self.upsample > 1:
+            # One resize call for all channels (H, W, C layout)
+            hwc = np.ascontiguousarray(maps.transpose(1, 2, 0))
+            hwc = cv2.resize(hwc, None, fx=self.upsample, fy=self.upsample, interpolation=cv2.INTER_CUBIC)
+            maps = hwc.transpose(2, 0, 1)
+        map_h, map_w = maps.shape[1:3]
+
+        peaks = [self.find_peaks(maps[part]) for part in range(NUM_KEYPOINTS)]
+
+        # people[p, part] is the index of the assigned peak of that part, or -1
+        people = np.full((0, NUM_KEYPOINTS), -1, dtype=np.intp)
+        person_scores: List[float] = []
+        owners: List[Dict[int, int]] = [dict() for _ in range(NUM_KEYPOINTS)]
+
+        for part_a, part_b in self.pose_pairs:
+            ch_x, ch_y = PAF_CHANNELS[(part_a, part_b)]
+            connections = self.score_limbs(peaks[part_a], peaks[part_b], maps[ch_x], maps[ch_y])
+            for ia, ib, score in connections:
+                owner = owners[part_a].get(ia)
+                if owner is None:
+                    owner = owners[part_b].get(ib)
+                    if owner is not None and people[owner, part_a] == -1:
+                        people[owner, part_a] = ia
+                        owners[part_a][ia] = owner
+                        person_scores[owner] += float(peaks[part_a][ia, 2]) + score
+                    elif owner is None:
+                        row = np.full((1, NUM_KEYPOINTS), -1, dtype=np.intp)
+                        row[0, part_a], row[0, part_b] = ia, ib
+                        people = np.vstack([people, row])
+                        owner = len(people) - 1
+                        owners[part_a][ia] = owner
+                        owners[part_b][ib] = owner
+                        person_scores.append(float(peaks[part_a][ia, 2] + peaks[part_b][ib, 2]) + score)
+                elif people[owner, part_b] == -1:
+                    people[owner, part_b] = ib
+                    owners[part_b][ib] = owner
+                    person_scores[owner] += float(peaks[part_b][ib, 2]) + score
+
+        scale_x = frame_width / map_w
+        scale_y = frame_height / map_h
+        poses = []
+        for p in np.argsort(-np.asarray(person_scores, dtype=np.float32)):
+            assigned = people[p] >= 0
+            n_parts = int(np.count_nonzero(assigned))
+            if n_parts < self.min_parts or person_scores[p] / n_parts < self.min_mean_score:
+                continue
+            pose = Pose()
+            for part in np.flatnonzero(assigned):
+                x, y, score = peaks[part][people[p, part]]
+                pose.data[part] = ((x + 0.5) * scale_x, (y + 0.5) * scale_y, score)
+            poses.append(pose)
+        return poses
+
+
+def select_person(poses: Sequence[Pose], frame_width: int, frame_height: int,
+                  policy: str = "largest") -> Optional[Pose]:
+    """
+    Pick the subject of a multi-person image.
+
+    Args:
+        poses: Candidate poses
+        frame_width, frame_height: Size of the image
+        policy: "largest" for the biggest keypoint bounding box, "central" for
+            the person whose keypoint centroid is closest to the image centre
+
+    Returns:
+        The selected pose, or None if there are no candidates
+    """
+    if not poses:
+        return None
+    if len(poses) == 1:
+        return poses[0]
+    data = np.stack([pose.data for pose in poses])
+    present = data[:, :, CONFIDENCE] > 0
+    xs = np.where(present, data[:, :, X], np.nan)
+    ys = np.where(present, data[:, :, Y], np.nan)
+    if policy == "central":
+        dx = np.nanmean(xs, axis=1) - frame_width / 2
+        dy = np.nanmean(ys, axis=1) - frame_height / 2
+        return poses[int(np.argmin(dx * dx + dy * dy))]
+    if policy != "largest":
+        logger.warning(f"Unknown person selection policy {policy!r}, using 'largest'")
+    area = (np.nanmax(xs, axis=1) - np.nanmin(xs, axis=1)) * (np.nanmax(ys, axis=1) - np.nanmin(ys, axis=1))
+    return poses[int(np.argmax(area))]
@@ -0,0 +1,290 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Smallest segment; sizes are rounded up to a power of two so segments of
+# similar frames can be reused
+MIN_SEGMENT_BYTES = 64 * 1024
+
+# Segments a pool process keeps mapped between calls
+ATTACH_CACHE_SIZE = 32
+
+
+class FrameHandle(NamedTuple):
+    """What crosses the process boundary instead of the pixels."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def _segment_size(nbytes: int) -> int:
+    return max(MIN_SEGMENT_BYTES, 1 << max(0, nbytes - 1).bit_length())
+
+
+class SharedFramePool:
+    """
+    Shared-memory segments for frames, owned by one process.
+
+    put() copies an array into a free segment (or a new one) and returns a
+    handle; release() gives the segment back to the free list for the next
+    frame of the same size class, and free segments beyond max_free_bytes
+    are unlinked. A handle has a single owner, so view() arrays must not be
+    kept past release(); callers copy what they keep.
+    """
+
+    def __init__(self, max_free_bytes: int = 256 * 1024 * 1024):
+        self.max_free_bytes = max_free_bytes
+        self._lock = threading.Lock()
+        self._segments: Dict[str, shared_memory.SharedMemory] = {}
+        self._in_use: Set[str] = set()
+        # size class -> names of free segments, most recently freed last
+        self._free: Dict[int, List[str]] = {}
+        self._free_bytes = 0
+        self._counter = 0
+        self.allocations = 0
+        self.reuses = 0
+        atexit.register(self.close)
+
+    def _take(self, nbytes: int) -> shared_memory.SharedMemory:
+        size = _segment_size(nbytes)
+        with self._lock:
+            free = self._free.get(size)
+            if free:
+                name = free.pop()
+                self._free_bytes -= size
+                self._in_use.add(name)
+                self.reuses += 1
+                return self._segments[name]
+            self._counter += 1
+            name = f"tryon_{os.getpid()}_{self._counter}"
+        segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        with self._lock:
+            self._segments[name] = segment
+            self._in_use.add(name)
+            self.allocations += 1
+        return segment
+
+    def alloc(self, shape: Tuple[int, ...], dtype: Any) -> FrameHandle:
+        """An uninitialised frame, e.g. for another process to write a result into."""
+        dtype = np.dtype(dtype)
+        segment = self._take(int(np.prod(shape)) * dtype.itemsize)
+        return FrameHandle(segment.name, tuple(shape), dtype.str)
+
+    def put(self, array: np.ndarray) -> FrameHandle:
+        """Copy an array into shared memory."""
+        handle = self.alloc(array.shape, array.dtype)
+        np.copyto(self.view(handle), array)
+        return handle
+
+    def view(self, handle: FrameHandle) -> np.ndarray:
+        """Array over a frame of this pool; valid until the handle is released."""
+        segment = self._segments[handle.name]
+        return np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=segment.buf)
+
+    def release(self, handle: FrameHandle) -> None:
+        """Return a frame's segment to the free list."""
+        unlink = []
+        with self._lock:
+            self._in_use.remove(handle.name)
+            size = self._segments[handle.name].size
+            self._free.setdefault(size, []).append(handle.name)
+            self._free_bytes += size
+            # Trim the largest free segments first
+            for size in sorted(self._free, reverse=True):
+                while self._free[size] and self._free_bytes > self.max_free_bytes:
+                    unlink.append(self._segments.pop(self._free[size].pop(0)))
+                    self._free_bytes -= size
+        for segment in unlink:
+            segment.close()
+            segment.unlink()
+
+    def close(self) -> None:
+        """Unlink every segment; called at exit."""
+        with self._lock:
+            segments = list(self._segments.values())
+            self._segments.clear()
+            self._in_use.clear()
+            self._free.clear()
+            self._free_bytes = 0
+        for segment in segments:
+            try:
+                segment.close()
+                segment.unlink()
+            except (BufferError, FileNotFoundError):
+                pass
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "in_use": len(self._in_use),
+                "bytes": sum(segment.size for segment in self._segments.values()),
+                "free_bytes": self._free_bytes,
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+            }
+
+
+_attached: "OrderedDict[str, shared_memory.SharedMemory]" = OrderedDict()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Map an existing segment without making this process responsible for unlinking it."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    segment = shared_memory.SharedMemory(name=name)
+    # Before 3.13 attaching registers the segment with the resource tracker,
+    # which then warns about (and unlinks) segments the owner already unlinked
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def open_frame(handle: FrameHandle) -> np.ndarray:
+    """
+    Map a frame in a process that does not own it.
+
+    Segments stay mapped in a small per-process cache, since the owner reuses
+    them for later frames.
+    """
+    segment = _attached.get(handle.name)
+    if segment is None:
+        segment = _attach(handle.name)
+        _attached[handle.name] = segment
+        while len(_attached) > ATTACH_CACHE_SIZE:
+            _, old = _attached.popitem(last=False)
+            try:
+                old.close()
+            except BufferError:
+                pass
+    else:
+        _attached.move_to_end(handle.name)
+    return np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=segment.buf)
+
+
+def _init_process() -> None:
+    # The pool processes are the parallelism; keep OpenCV single-threaded in each
+    cv2.setNumThreads(1)
+
+
+def _run(fn: Callable[..., np.ndarray], inputs: Sequence[FrameHandle], output: FrameHandle, args: tuple) -> None:
+    arrays = [open_frame(handle) for handle in inputs]
+    out = open_frame(output)
+    out[...] = fn(*arrays, *args)
+
+
+class SharedFrameExecutor:
+    """
+    Process pool whose image arguments and results travel through a
+    SharedFramePool: each input is copied once into shared memory and the
+    worker writes its result into a preallocated frame, so only handles are
+    pickled.
+
+    Processes are forked, so they inherit the imported modules instead of
+    re-importing the app. Forking copies only the calling thread, and a child
+    of a process with other threads running (pipeline threads, OpenCV or
+    OpenMP pools) can inherit locks that are never released; start() the
+    executor at process startup, before any of them exist.
+    """
+
+    def __init__(self, workers: int, pool: Optional[SharedFramePool] = None):
+        self.workers = workers
+        self.pool = pool or SharedFramePool()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Fork the pool processes now, from the calling thread."""
+        # With the fork start method the executor launches every process on the first submit
+        self._get_executor().submit(os.getpid).result()
+        logger.info(f"Started {self.workers} mask processes")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                if threading.active_count() > 1:
+                    logger.warning("Forking mask processes from a threaded process; "
+                                   "call start_frame_executor() at startup")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                    initializer=_init_process,
+                )
+            return self._executor
+
+    def call(
+        self,
+        fn: Callable[..., np.ndarray],
+        inputs: Sequence[np.ndarray],
+        output_shape: Tuple[int, ...],
+        output_dtype: Any,
+        *args: Any
+    ) -> np.ndarray:
+        """
+        Run fn(*inputs, *args) in a pool process and return its result.
+
+        fn must be a module-level function returning an array of
+        output_shape and output_dtype. The result is copied out of shared
+        memory, so its segment can be reused as soon as this returns.
+        """
+        handles = [self.pool.put(array) for array in inputs]
+        output = self.pool.alloc(output_shape, output_dtype)
+        try:
+            self._get_executor().submit(_run, fn, handles, output, args).result()
+            return self.pool.view(output).copy()
+        finally:
+            for handle in handles + [output]:
+                self.pool.release(handle)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.pool.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"workers": self.workers, **self.pool.metrics()}
+
+
+_frame_executor: Optional[SharedFrameExecutor] = None
+_frame_executor_lock = threading.Lock()
+
+
+def get_frame_executor() -> Optional[SharedFrameExecutor]:
+    """The process-wide executor, or None when MASK_PROCESS_WORKERS is 0."""
+    global _frame_executor
+    if settings.MASK_PROCESS_WORKERS <= 0:
+        return None
+    with _frame_executor_lock:
+        if _frame_executor is None:
+            _frame_executor = SharedFrameExecutor(
+                settings.MASK_PROCESS_WORKERS, SharedFramePool(settings.SHM_POOL_MAX_FREE_BYTES)
+            )
+        return _frame_executor
+
+
+def start_frame_executor() -> None:
+    """Fork the executor's processes; call at process startup, before other threads start."""
+    executor = get_frame_executor()
+    if executor is not None:
+        executor.start()
+
+
+def shutdown_frame_executor() -> None:
+    with _frame_executor_lock:
+        if _frame_executor is not None:
+            _frame_executor.shutdown()
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def content_key(*parts: Any) -> str:
+    """
+    Hash request inputs into a single-flight key.
+
+    Arrays contribute their shape, dtype and pixel bytes; bytes are hashed as
+    is; anything else by its repr. Parts are length-prefixed so adjacent parts
+    cannot run together.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            header = f"nd{part.shape}{part.dtype.str}".encode()
+            data = memoryview(np.ascontiguousarray(part)).cast("B")
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            header, data = b"b", memoryview(part).cast("B")
+        else:
+            header, data = b"r", repr(part).encode()
+        digest.update(header)
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Thread-safe duplicate suppression for blocking calls.
+
+    While a call for a key is running, other threads calling do() with the same
+    key wait for it and receive the same result (or exception) instead of
+    repeating the work. Nothing is cached once the call finishes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            logger.info(f"{self.name}: joining in-flight call")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"in_flight": in_flight, "executed": self.executed, "shared": self.shared}
+
+
+class AsyncSingleFlight:
+    """
+    Duplicate suppression for coroutines on one event loop.
+
+    The first caller for a key starts the work as a task; concurrent callers
+    with the same key await that task. Each caller awaits through a shield, so
+    a disconnecting client does not cancel the work for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.executed += 1
+        else:
+            logger.info(f"{self.name}: joining in-flight call")
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here so abandoned failures are not reported as unhandled
+
+    def metrics(self) -> Dict[str, int]:
+        return {"in_flight": len(self._tasks), "executed": self.executed, "shared": self.shared}
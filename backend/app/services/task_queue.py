@@ -0,0 +1,574 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+from .file_io import remove_files
+
+logger = logging.getLogger(__name__)
+
+# Task states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Longest single blocking wait for a result; a cancelled wait ends within one slice
+RESULT_WAIT_SLICE_S = 1.0
+# Threads blocked on results; more concurrent waits take turns a slice at a time
+RESULT_WAITERS = 32
+
+
+@dataclass
+class Task:
+    """A unit of work handed to a compute worker."""
+    task_id: str
+    payload: Dict[str, Any]
+    attempts: int
+    # Identifies this reservation; ack() and nack() only apply while it holds
+    receipt: str = ""
+
+
+@dataclass
+class TaskResult:
+    status: str  # DONE or FAILED
+    value: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+
+class Broker:
+    """
+    At-least-once task queue between API nodes and compute workers.
+
+    A reserved task stays invisible to other workers until its visibility
+    timeout; a worker that crashes or stalls past it loses the task, which is
+    queued again until it has been attempted max_attempts times and then
+    fails. Workers ack() a result or nack() an error (retried the same way),
+    passing the receipt of their reservation: once the task has been queued
+    again or reserved by another worker, a late ack or nack is ignored.
+    """
+
+    def __init__(self, visibility_timeout: float = 120.0, max_attempts: int = 3, result_ttl: float = 600.0):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    def reserve(self, worker_id: str, wait: float = 1.0) -> Optional[Task]:
+        """Take the oldest visible task, waiting up to `wait` seconds for one."""
+        raise NotImplementedError
+
+    def ack(self, task_id: str, receipt: str, value: Dict[str, Any]) -> bool:
+        """Store the result of a reserved task; False if the reservation was lost."""
+        raise NotImplementedError
+
+    def nack(self, task_id: str, receipt: str, error: str) -> bool:
+        """Queue a reserved task again, or fail it; False if the reservation was lost."""
+        raise NotImplementedError
+
+    def wait_result(self, task_id: str, timeout: float) -> Optional[TaskResult]:
+        """Block until the task finishes; None on timeout. Each result is returned once."""
+        raise NotImplementedError
+
+    def requeue_expired(self) -> int:
+        """Queue again (or fail) tasks whose visibility timeout passed; drop stale results."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def _exhausted(self, attempts: int) -> bool:
+        return attempts >= self.max_attempts
+
+
+class InMemoryBroker(Broker):
+    """Broker for a single process, e.g. tests or workers running as threads of the API."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._cond = threading.Condition()
+        self._queue: Deque[str] = deque()
+        self._tasks: Dict[str, Task] = {}
+        self._deadlines: Dict[str, float] = {}
+        self._receipts: Dict[str, str] = {}
+        self._results: Dict[str, Tuple[TaskResult, float]] = {}
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        task_id = uuid.uuid4().hex
+        with self._cond:
+            self._tasks[task_id] = Task(task_id, payload, 0)
+            self._queue.append(task_id)
+            self._cond.notify_all()
+        return task_id
+
+    def reserve(self, worker_id: str, wait: float = 1.0) -> Optional[Task]:
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                self._requeue_expired_locked()
+                while self._queue:
+                    task = self._tasks.get(self._queue.popleft())
+                    if task is None or task.task_id in self._deadlines:
+                        # Finished or already reserved since it was queued
+                        continue
+                    task.attempts += 1
+                    receipt = uuid.uuid4().hex
+                    self._deadlines[task.task_id] = time.monotonic() + self.visibility_timeout
+                    self._receipts[task.task_id] = receipt
+                    return Task(task.task_id, task.payload, task.attempts, receipt)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def _finish(self, task_id: str, result: TaskResult) -> None:
+        self._tasks.pop(task_id, None)
+        self._deadlines.pop(task_id, None)
+        self._receipts.pop(task_id, None)
+        self._results[task_id] = (result, time.monotonic())
+        self._cond.notify_all()
+
+    def _release(self, task_id: str, error: str) -> None:
+        """End a reservation: queue the task again, or fail it after its last attempt."""
+        self._deadlines.pop(task_id, None)
+        self._receipts.pop(task_id, None)
+        if self._exhausted(self._tasks[task_id].attempts):
+            self._finish(task_id, TaskResult(FAILED, error=error))
+        else:
+            self._queue.append(task_id)
+            self._cond.notify_all()
+
+    def ack(self, task_id: str, receipt: str, value: Dict[str, Any]) -> bool:
+        with self._cond:
+            if self._receipts.get(task_id) != receipt:
+                return False
+            self._finish(task_id, TaskResult(DONE, value=value))
+            return True
+
+    def nack(self, task_id: str, receipt: str, error: str) -> bool:
+        with self._cond:
+            if self._receipts.get(task_id) != receipt:
+                return False
+            self._release(task_id, error)
+            return True
+
+    def wait_result(self, task_id: str, timeout: float) -> Optional[TaskResult]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while task_id not in self._results:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._results.pop(task_id)[0]
+
+    def _requeue_expired_locked(self) -> int:
+        now = time.monotonic()
+        expired = [task_id for task_id, deadline in self._deadlines.items() if deadline <= now]
+        for task_id in expired:
+            self._release(task_id, "Visibility timeout exceeded")
+        for task_id in [t for t, (_, at) in self._results.items() if now - at > self.result_ttl]:
+            del self._results[task_id]
+        return len(expired)
+
+    def requeue_expired(self) -> int:
+        with self._cond:
+            return self._requeue_expired_locked()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"queued": len(self._queue), "running": len(self._deadlines), "finished": len(self._results)}
+
+
+class SQLiteBroker(Broker):
+    """
+    Broker in a local SQLite file, shared by API and worker processes on one node.
+
+    Reservation runs in an IMMEDIATE transaction, so two workers never take
+    the same task.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            visible_at REAL NOT NULL,
+            worker TEXT,
+            receipt TEXT,
+            result TEXT,
+            error TEXT,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, visible_at);
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self._SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(tasks)")}
+        if "receipt" not in columns:
+            # Databases created before reservations carried receipts
+            self._db.execute("ALTER TABLE tasks ADD COLUMN receipt TEXT")
+
+    def _transaction(self, fn, *args):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(*args)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return value
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        task_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO tasks (task_id, payload, status, visible_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (task_id, json.dumps(payload), QUEUED, now, now),
+            )
+        return task_id
+
+    def _reserve_one(self, worker_id: str) -> Optional[Task]:
+        now = time.time()
+        row = self._db.execute(
+            "SELECT task_id, payload, attempts FROM tasks WHERE status = ? AND visible_at <= ? "
+            "ORDER BY visible_at LIMIT 1",
+            (QUEUED, now),
+        ).fetchone()
+        if row is None:
+            return None
+        task_id, payload, attempts = row
+        receipt = uuid.uuid4().hex
+        self._db.execute(
+            "UPDATE tasks SET status = ?, attempts = ?, visible_at = ?, worker = ?, receipt = ?, updated_at = ? "
+            "WHERE task_id = ?",
+            (RUNNING, attempts + 1, now + self.visibility_timeout, worker_id, receipt, now, task_id),
+        )
+        return Task(task_id, json.loads(payload), attempts + 1, receipt)
+
+    def reserve(self, worker_id: str, wait: float = 1.0) -> Optional[Task]:
+        deadline = time.monotonic() + wait
+        while True:
+            task = self._transaction(self._reserve_one, worker_id)
+            if task is not None or time.monotonic() >= deadline:
+                return task
+            time.sleep(min(0.2, max(0.0, deadline - time.monotonic())))
+
+    def ack(self, task_id: str, receipt: str, value: Dict[str, Any]) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "UPDATE tasks SET status = ?, result = ?, receipt = NULL, updated_at = ? "
+                "WHERE task_id = ? AND status = ? AND receipt = ?",
+                (DONE, json.dumps(value), time.time(), task_id, RUNNING, receipt),
+            ).rowcount > 0
+
+    def _nack(self, task_id: str, receipt: str, error: str) -> bool:
+        row = self._db.execute("SELECT attempts FROM tasks WHERE task_id = ? AND status = ? AND receipt = ?",
+                               (task_id, RUNNING, receipt)).fetchone()
+        if row is None:
+            return False
+        status = FAILED if self._exhausted(row[0]) else QUEUED
+        self._db.execute(
+            "UPDATE tasks SET status = ?, error = ?, receipt = NULL, visible_at = ?, updated_at = ? WHERE task_id = ?",
+            (status, error, time.time(), time.time(), task_id),
+        )
+        return True
+
+    def nack(self, task_id: str, receipt: str, error: str) -> bool:
+        return self._transaction(self._nack, task_id, receipt, error)
+
+    def _has_result(self, task_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM tasks WHERE task_id = ? AND status IN (?, ?)",
+                                    (task_id, DONE, FAILED)).fetchone() is not None
+
+    def _take_result(self, task_id: str) -> Optional[TaskResult]:
+        row = self._db.execute("SELECT status, result, error FROM tasks WHERE task_id = ? AND status IN (?, ?)",
+                               (task_id, DONE, FAILED)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        status, result, error = row
+        return TaskResult(status, value=json.loads(result) if result else None, error=error)
+
+    def wait_result(self, task_id: str, timeout: float) -> Optional[TaskResult]:
+        deadline = time.monotonic() + timeout
+        interval = 0.01
+        while True:
+            # Polls only read; the write transaction is taken once there is a result to remove
+            if self._has_result(task_id):
+                result = self._transaction(self._take_result, task_id)
+                if result is not None:
+                    return result
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            interval = min(interval * 2, 0.25)
+
+    def _requeue_expired(self) -> int:
+        now = time.time()
+        expired = self._db.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, receipt = NULL, "
+            "error = 'Visibility timeout exceeded', updated_at = ? WHERE status = ? AND visible_at <= ?",
+            (self.max_attempts, FAILED, QUEUED, now, RUNNING, now),
+        ).rowcount
+        self._db.execute("DELETE FROM tasks WHERE status IN (?, ?) AND updated_at < ?",
+                         (DONE, FAILED, now - self.result_ttl))
+        return expired
+
+    def requeue_expired(self) -> int:
+        return self._transaction(self._requeue_expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        counts = dict(rows)
+        return {"queued": counts.get(QUEUED, 0), "running": counts.get(RUNNING, 0),
+                "finished": counts.get(DONE, 0) + counts.get(FAILED, 0)}
+
+
+class RedisBroker(Broker):
+    """
+    Broker on Redis, for API nodes and workers on different machines.
+
+    Queued ids are a list, reserved ids a sorted set scored by their
+    visibility deadline and each result a list the API node waits on with
+    BLPOP. Every state change is one Lua script, so a crash between steps
+    cannot lose a task. Requires the redis package.
+    """
+
+    # KEYS: queue, inflight; ARGV: deadline, task key prefix, receipt.
+    # Ids of tasks finished while queued (no hash left) are skipped.
+    _RESERVE = """
+        while true do
+            local task_id = redis.call('LPOP', KEYS[1])
+            if not task_id then return false end
+            local key = ARGV[2] .. task_id
+            if redis.call('EXISTS', key) == 1 and not redis.call('ZSCORE', KEYS[2], task_id) then
+                redis.call('ZADD', KEYS[2], ARGV[1], task_id)
+                local attempts = redis.call('HINCRBY', key, 'attempts', 1)
+                redis.call('HSET', key, 'receipt', ARGV[3])
+                return {task_id, redis.call('HGET', key, 'payload'), attempts}
+            end
+        end
+    """
+
+    # KEYS: inflight, task, result; ARGV: task id, receipt, result, result ttl
+    _ACK = """
+        if redis.call('HGET', KEYS[2], 'receipt') ~= ARGV[2] then return 0 end
+        if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return 0 end
+        redis.call('DEL', KEYS[2])
+        redis.call('RPUSH', KEYS[3], ARGV[3])
+        redis.call('EXPIRE', KEYS[3], ARGV[4])
+        return 1
+    """
+
+    # KEYS: inflight, task, result, queue; ARGV: task id, receipt ('' for any),
+    # max attempts, failed result, result ttl, expiry time ('' for any).
+    # Queues the task again, or fails it after its last attempt.
+    _RELEASE = """
+        if ARGV[2] ~= '' and redis.call('HGET', KEYS[2], 'receipt') ~= ARGV[2] then return 0 end
+        local deadline = redis.call('ZSCORE', KEYS[1], ARGV[1])
+        if not deadline then return 0 end
+        if ARGV[6] ~= '' and tonumber(deadline) > tonumber(ARGV[6]) then return 0 end
+        redis.call('ZREM', KEYS[1], ARGV[1])
+        local attempts = tonumber(redis.call('HGET', KEYS[2], 'attempts') or '0')
+        if attempts >= tonumber(ARGV[3]) then
+            redis.call('DEL', KEYS[2])
+            redis.call('RPUSH', KEYS[3], ARGV[4])
+            redis.call('EXPIRE', KEYS[3], ARGV[5])
+            return 2
+        end
+        redis.call('HDEL', KEYS[2], 'receipt')
+        redis.call('RPUSH', KEYS[4], ARGV[1])
+        return 1
+    """
+
+    def __init__(self, url: str, prefix: str = "tryon", **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("The redis package is required for a redis:// TASK_BROKER_URL") from e
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._queue_key = f"{prefix}:queue"
+        self._inflight_key = f"{prefix}:inflight"
+        self._task_prefix = f"{prefix}:task:"
+        self._result_prefix = f"{prefix}:result:"
+        self._reserve_script = self._redis.register_script(self._RESERVE)
+        self._ack_script = self._redis.register_script(self._ACK)
+        self._release_script = self._redis.register_script(self._RELEASE)
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        task_id = uuid.uuid4().hex
+        pipe = self._redis.pipeline()
+        pipe.hset(self._task_prefix + task_id, mapping={"payload": json.dumps(payload), "attempts": 0})
+        pipe.rpush(self._queue_key, task_id)
+        pipe.execute()
+        return task_id
+
+    def reserve(self, worker_id: str, wait: float = 1.0) -> Optional[Task]:
+        deadline = time.monotonic() + wait
+        while True:
+            receipt = uuid.uuid4().hex
+            reserved = self._reserve_script(
+                keys=[self._queue_key, self._inflight_key],
+                args=[time.time() + self.visibility_timeout, self._task_prefix, receipt],
+            )
+            if reserved:
+                task_id, payload, attempts = reserved
+                return Task(task_id, json.loads(payload), int(attempts), receipt)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+
+    @staticmethod
+    def _encode(result: TaskResult) -> str:
+        return json.dumps({"status": result.status, "value": result.value, "error": result.error})
+
+    def ack(self, task_id: str, receipt: str, value: Dict[str, Any]) -> bool:
+        return bool(self._ack_script(
+            keys=[self._inflight_key, self._task_prefix + task_id, self._result_prefix + task_id],
+            args=[task_id, receipt, self._encode(TaskResult(DONE, value=value)), int(self.result_ttl)],
+        ))
+
+    def _release(self, task_id: str, receipt: str, error: str, expired_before: str = "") -> int:
+        return self._release_script(
+            keys=[self._inflight_key, self._task_prefix + task_id, self._result_prefix + task_id, self._queue_key],
+            args=[task_id, receipt, self.max_attempts, self._encode(TaskResult(FAILED, error=error)),
+                  int(self.result_ttl), expired_before],
+        )
+
+    def nack(self, task_id: str, receipt: str, error: str) -> bool:
+        return bool(self._release(task_id, receipt, error))
+
+    def wait_result(self, task_id: str, timeout: float) -> Optional[TaskResult]:
+        popped = self._redis.blpop([self._result_prefix + task_id], timeout=max(1, int(timeout)))
+        if popped is None:
+            return None
+        data = json.loads(popped[1])
+        return TaskResult(data["status"], value=data["value"], error=data["error"])
+
+    def requeue_expired(self) -> int:
+        now = time.time()
+        expired = 0
+        for task_id in self._redis.zrangebyscore(self._inflight_key, "-inf", now):
+            # The script re-checks the deadline, so a task reserved again meanwhile is left alone
+            expired += bool(self._release(task_id, "", "Visibility timeout exceeded", repr(now)))
+        return expired
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._redis.llen(self._queue_key), "running": self._redis.zcard(self._inflight_key)}
+
+
+def broker_from_url(url: str, **kwargs) -> Broker:
+    """
+    Create a broker from a URL: memory://, sqlite:///relative/path.db,
+    sqlite:////absolute/path.db or redis://host:port/db.
+    """
+    if url.startswith("memory://"):
+        return InMemoryBroker(**kwargs)
+    if url.startswith("sqlite:///"):
+        return SQLiteBroker(url[len("sqlite:///"):], **kwargs)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url, **kwargs)
+    raise ValueError(f"Unsupported TASK_BROKER_URL: {url}")
+
+
+_broker: Optional[Broker] = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> Broker:
+    """The process-wide broker configured by TASK_BROKER_URL, created on first use."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = broker_from_url(
+                settings.TASK_BROKER_URL,
+                visibility_timeout=settings.TASK_VISIBILITY_TIMEOUT_S,
+                max_attempts=settings.TASK_MAX_ATTEMPTS,
+                result_ttl=settings.TASK_RESULT_TTL_S,
+            )
+        return _broker
+
+
+_result_waiters = ThreadPoolExecutor(max_workers=RESULT_WAITERS, thread_name_prefix="task-wait")
+
+
+async def run_task(
+    payload: Dict[str, Any],
+    timeout: Optional[float] = None,
+    cleanup: Sequence[str] = ()
+) -> Dict[str, Any]:
+    """
+    Enqueue a task for the compute workers and wait for its result.
+
+    The wait blocks threads of a dedicated executor, RESULT_WAIT_SLICE_S at a
+    time, so it neither holds the default executor nor outlives a cancelled
+    request by more than a slice.
+
+    Args:
+        payload: Task payload
+        timeout: Seconds to wait for the result; TASK_RESULT_TIMEOUT_S if None
+        cleanup: Files the task owns once enqueued: the worker deletes them
+            when the task finishes, even if this caller stopped waiting.
+            They are deleted here if the task cannot be enqueued.
+
+    Raises:
+        HTTPException: 504 if no result arrives in time, 500 if the task failed
+    """
+    broker = get_broker()
+    timeout = settings.TASK_RESULT_TIMEOUT_S if timeout is None else timeout
+    try:
+        task_id = await asyncio.to_thread(broker.enqueue, {**payload, "cleanup": list(cleanup)})
+    except BaseException:
+        await remove_files(cleanup)
+        raise
+    logger.info(f"Enqueued {payload.get('kind')} task {task_id}")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            logger.error(f"Task {task_id} produced no result within {timeout}s")
+            raise HTTPException(status_code=504, detail="Timed out waiting for a compute worker")
+        result = await loop.run_in_executor(
+            _result_waiters, broker.wait_result, task_id, min(RESULT_WAIT_SLICE_S, remaining)
+        )
+        if result is not None:
+            break
+    if result.status != DONE:
+        logger.error(f"Task {task_id} failed: {result.error}")
+        raise HTTPException(status_code=500, detail=f"Try-on failed on the compute worker: {result.error}")
+    value = result.value or {}
+    if "status_code" in value:
+        # Rejected by the worker as a client error; not retried
+        raise HTTPException(status_code=value["status_code"], detail=value.get("detail"))
+    return value
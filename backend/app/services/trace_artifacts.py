@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Renders an artifact: an image for .jpg/.png names, a JSON-serializable value for .json
+Render = Callable[[], Any]
+
+
+class Trace:
+    """Artifacts of one traced request, written under their own directory."""
+
+    def __init__(self, recorder: "TraceRecorder", trace_id: str):
+        self.recorder = recorder
+        self.trace_id = trace_id
+        self.directory = os.path.join(recorder.directory, trace_id)
+
+    def capture(self, filename: str, render: Render) -> None:
+        """
+        Queue an artifact for the background writer.
+
+        render runs on the writer thread, so drawing and encoding stay off the
+        request path; it must not depend on buffers the request still mutates.
+        """
+        self.recorder._submit(os.path.join(self.directory, filename), render)
+
+
+class TraceRecorder:
+    """
+    Samples requests for tracing and writes their artifacts from one
+    background thread.
+
+    A request is traced with probability sample_rate, or when it asks to be
+    and per-request tracing is allowed. Artifacts that do not fit the bounded
+    queue are dropped rather than slowing the request down, and only the
+    max_traces most recent trace directories are kept.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: float = 0.0,
+        allow_request: bool = False,
+        max_traces: int = 200,
+        queue_size: int = 64
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.allow_request = allow_request
+        self.max_traces = max_traces
+        self._queue: "queue.Queue[Optional[Tuple[str, Render]]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._traces: Deque[str] = deque()
+        self._scanned = False
+        self.started = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @classmethod
+    def from_settings(cls) -> "TraceRecorder":
+        return cls(settings.TRACE_DIR, settings.TRACE_SAMPLE_RATE, settings.TRACE_ON_REQUEST,
+                   settings.TRACE_MAX_REQUESTS, settings.TRACE_QUEUE_SIZE)
+
+    def start(self, trace_id: str, requested: bool = False) -> Optional[Trace]:
+        """
+        Decide whether to trace a request.
+
+        Args:
+            trace_id: Name of the request's artifact directory
+            requested: Whether the request asked to be traced
+
+        Returns:
+            A Trace to capture artifacts into, or None if the request is not traced
+        """
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and not (requested and self.allow_request):
+            return None
+        with self._lock:
+            self.started += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                self._thread.start()
+        logger.info(f"Tracing request {trace_id} to {os.path.join(self.directory, trace_id)}")
+        return Trace(self, trace_id)
+
+    def _submit(self, path: str, render: Render) -> None:
+        try:
+            self._queue.put_nowait((path, render))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _scan(self) -> None:
+        """Adopt trace directories left by earlier runs, oldest first, so retention covers them."""
+        self._scanned = True
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.is_dir()]
+        except FileNotFoundError:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        self._traces.extend(entry.name for entry in entries)
+
+    def _open_trace(self, trace_dir: str) -> None:
+        """Create a new trace directory and delete the oldest ones beyond max_traces."""
+        if not self._scanned:
+            self._scan()
+        if os.path.isdir(trace_dir):
+            return
+        os.makedirs(trace_dir, exist_ok=True)
+        self._traces.append(os.path.basename(trace_dir))
+        while self.max_traces > 0 and len(self._traces) > self.max_traces:
+            shutil.rmtree(os.path.join(self.directory, self._traces.popleft()), ignore_errors=True)
+
+    def _write(self, path: str, render: Render) -> None:
+        value = render()
+        if value is None:
+            return
+        self._open_trace(os.path.dirname(path))
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(value, f, indent=2, default=str)
+        elif not cv2.imwrite(path, np.ascontiguousarray(value)):
+            raise ValueError(f"Could not encode {path}")
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, render = item
+            try:
+                self._write(path, render)
+                with self._lock:
+                    self.written += 1
+            except Exception as e:
+                logger.error(f"Error writing trace artifact {path}: {str(e)}", exc_info=True)
+                with self._lock:
+                    self.failed += 1
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write the queued artifacts and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "allow_request": self.allow_request,
+                "traces": self.started,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "queued": self._queue.qsize(),
+            }
+
+
+# Shared by every try-on of this process
+trace_recorder = TraceRecorder.from_settings()
@@ -1,7 +1,8 @@
+import asyncio
 import os
 import cv2
 import numpy as np
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, Awaitable, Callable, Sequence, Set
 import uuid
 from pathlib import Path
 import logging
@@ -12,9 +13,24 @@ import torchvision.transforms as transforms
 from PIL import Image
 import requests
 from io import BytesIO
+from .background import apply_mask, garment_mask, garment_mask_coarse_to_fine, refine_mask
+from .catalogue import CatalogueEntry, garment_catalogue
+from .compositing import GarmentCutout
+from .file_io import file_digest, make_dirs, path_exists, remove_file, remove_files, write_bytes, write_image
+from .garment_type import detect_garment_type
+from .garment_warp import garment_warper, normalized_anchors
+from .image_io import decode_image, decoded_size, open_upright
+from .phash_index import PerceptualIndex, color_thumbnail, dhash
+from .pipeline import Stage, StageGraph
+from .pose import Pose
 from .pose_estimation import PoseEstimator
+from .shm_transport import get_frame_executor
+from .single_flight import AsyncSingleFlight, SingleFlight, content_key
+from .task_queue import run_task
+from .trace_artifacts import Trace, trace_recorder
 
 from app.core.config import settings
+from app.core.memory_budget import MB, MemoryPlan, memory_governor, plan_request
 
 # Initialize device
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -24,8 +40,38 @@ logger = logging.getLogger(__name__)
 class VirtualTryOnService:
     def __init__(self):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.segmentation_model = self._load_segmentation_model()
-        self.pose_estimator = PoseEstimator()
+        # In queue mode API nodes only enqueue try-ons; the compute workers hold the model
+        self.segmentation_model = self._load_segmentation_model() if settings.COMPUTE_MODE != "queue" else None
+        self.pose_estimator = PoseEstimator(
+            settings.POSE_MODEL_PATH,
+            input_size=(settings.POSE_INPUT_WIDTH, settings.POSE_INPUT_HEIGHT),
+            backend=settings.POSE_DNN_BACKEND,
+            target=settings.POSE_DNN_TARGET,
+            person_selection=settings.POSE_PERSON_SELECTION,
+            mediapipe_model_path=settings.MEDIAPIPE_POSE_MODEL_PATH,
+            enabled_backends=[name.strip() for name in settings.POSE_BACKENDS.split(",") if name.strip()],
+            preferred_backend=settings.POSE_BACKEND,
+            policy=settings.POSE_BACKEND_POLICY,
+            max_latency_ms=settings.POSE_MAX_LATENCY_MS,
+            # Measured per process in warm_up(), after the production server forks
+            calibrate=False,
+        )
+        
+        # Concurrent identical work (retries, double submits) is computed once
+        self.tryon_flight = AsyncSingleFlight("try-on")
+        self.garment_flight = SingleFlight("garment preparation")
+        self.pose_flight = SingleFlight("pose estimation")
+        
+        # Pending deletions of progressive previews
+        self._preview_expiry: Set["asyncio.Future[None]"] = set()
+        
+        # Re-encoded or resized copies of a garment reuse its garment mask
+        self.garment_index: PerceptualIndex[np.ndarray] = PerceptualIndex(
+            max_distance=settings.PHASH_MAX_DISTANCE,
+            max_bytes=settings.PHASH_MAX_BYTES,
+            aspect_tolerance=settings.PHASH_ASPECT_TOLERANCE,
+            max_color_diff=settings.PHASH_MAX_COLOR_DIFF,
+        )
         
         # Initialize result folder from settings
         self.result_folder = settings.RESULT_FOLDER
@@ -34,17 +80,43 @@ class VirtualTryOnService:
         os.makedirs(self.result_folder, exist_ok=True)
         logger.info(f"Initialized VirtualTryOnService on {self.device}. Result folder: {self.result_folder}")
         
+    def warm_up(self) -> None:
+        """
+        Per-process startup after the models are loaded: calibrate the pose
+        backends, which is their first inference.
+
+        Inference starts OpenMP and OpenCV thread pools, and a process that
+        forks with them running can deadlock its children. The production
+        server therefore only loads weights before forking and each worker
+        calls this from its startup handler; compute workers call it directly.
+        API nodes in queue mode run no inference, so they skip calibration.
+        """
+        if settings.COMPUTE_MODE == "queue":
+            return
+        if self.pose_estimator.preferred_backend == "auto":
+            self.pose_estimator.calibrate()
+
     def _load_segmentation_model(self) -> Optional[torch.nn.Module]:
         """Load the segmentation model."""
+        # Copying weights in parallel would start torch's OpenMP pool in a
+        # process that may fork; one thread copies them inline
+        threads = torch.get_num_threads()
+        torch.set_num_threads(1)
         try:
             model = torch.hub.load('pytorch/vision:v0.10.0', 'deeplabv3_resnet50', pretrained=True)
             model = model.to(self.device)
             model.eval()
-            logger.info("Successfully loaded DeepLabV3 model")
+            if settings.MODEL_HOSTING == "shared" and self.device.type == "cpu":
+                # Move the weights into shared memory: loaded once before the
+                # production server forks, every worker maps the same pages
+                model.share_memory()
+            logger.info(f"Successfully loaded DeepLabV3 model ({settings.MODEL_HOSTING} weights)")
             return model
         except Exception as e:
             logger.error(f"Error loading segmentation model: {e}")
             return None
+        finally:
+            torch.set_num_threads(threads)
 
     async def process_image_upload(self, file: UploadFile) -> str:
         """
@@ -76,7 +148,7 @@ class VirtualTryOnService:
                 raise HTTPException(status_code=400, detail=error_msg)
             
             # Create uploads directory if it doesn't exist
-            os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
+            await make_dirs(settings.UPLOAD_FOLDER)
             
             # Create unique filename with original extension
             filename = f"{uuid.uuid4()}.{file_extension}"
@@ -93,18 +165,12 @@ class VirtualTryOnService:
                     logger.error(error_msg)
                     raise HTTPException(status_code=400, detail=error_msg)
                 
-                # Verify it's a valid image by trying to open it
+                # Verify it's a valid image and re-encode it off the event loop
                 try:
-                    img = Image.open(BytesIO(file_content))
-                    img.verify()  # Verify that it is, in fact, an image
-                    img = Image.open(BytesIO(file_content))  # Reopen after verify
-                    
-                    # Convert to RGB if needed
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
+                    encoded = await asyncio.to_thread(self._normalize_upload, file_content, file_extension)
                     
                     # Save the processed image
-                    img.save(file_path)
+                    await write_bytes(file_path, encoded)
                     logger.info(f"Successfully saved uploaded file to: {file_path}")
                     
                 except Exception as img_error:
@@ -130,6 +196,21 @@ class VirtualTryOnService:
             logger.error(error_msg, exc_info=True)
             raise HTTPException(status_code=500, detail="Error processing file upload")
 
+    def _normalize_upload(self, file_content: bytes, file_extension: str) -> bytes:
+        """Validate an uploaded image and re-encode it as upright RGB in its original format."""
+        img = Image.open(BytesIO(file_content))
+        img.verify()  # Verify that it is, in fact, an image
+        # Reopen after verify, decoding oversized JPEGs at reduced scale
+        img = open_upright(file_content, settings.WORKING_MAX_PIXELS)
+        
+        # Convert to RGB if needed
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        output = BytesIO()
+        img.save(output, format=Image.registered_extensions().get(f".{file_extension}"))
+        return output.getvalue()
+
     def _preprocess_image(self, image_path: str, target_size: tuple = (512, 512)) -> torch.Tensor:
         """Preprocess image for model input."""
         img = Image.open(image_path).convert('RGB')
@@ -151,71 +232,32 @@ class VirtualTryOnService:
         mask = output_predictions.byte().cpu().numpy()
         return mask
 
-    def _detect_garment_type(self, garment_img: np.ndarray, filename: str = '') -> str:
-        """Detect garment type based on filename and image properties."""
-        # First check filename for hints
-        filename = filename.lower()
-        if any(keyword in filename for keyword in ['hat', 'cap', 'beanie', 'head']):
-            return 'hat'
-        elif any(keyword in filename for keyword in ['shirt', 'top', 'tshirt', 'blouse']):
-            return 'top'
-        elif any(keyword in filename for keyword in ['pants', 'jeans', 'trousers', 'bottom']):
-            return 'pants'
-        
-        # If no keywords in filename, use image properties
-        h, w = garment_img.shape[:2]
-        aspect_ratio = w / h if h > 0 else 1
-        
-        # For square-ish images, check if it looks like a hat
-        if 0.8 <= aspect_ratio <= 1.2:
-            # Check if the image has a curved top (common for hats)
-            gray = cv2.cvtColor(garment_img, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150)
-            top_edges = edges[:h//3, :].sum()  # Check top third for edges
-            if top_edges > edges[h//3:2*h//3, :].sum():
-                return 'hat'
-        
-        if aspect_ratio > 1.3:
-            return 'top'  # Wider than tall -> top
-        elif aspect_ratio < 0.7:
-            return 'pants'  # Taller than wide -> pants
-        else:
-            return 'top'  # Default to top for ambiguous cases
-
-    def _remove_background(self, image: np.ndarray) -> np.ndarray:
-        """Remove background from the garment image using color thresholding."""
-        # Convert to HSV color space
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # Define color ranges for common background colors (white, light gray, etc.)
-        lower_white = np.array([0, 0, 200], dtype=np.uint8)
-        upper_white = np.array([180, 30, 255], dtype=np.uint8)
-        
-        # Create mask for white/light backgrounds
-        mask = cv2.inRange(hsv, lower_white, upper_white)
-        
-        # Invert the mask to get the garment
-        mask = cv2.bitwise_not(mask)
-        
-        # Apply morphological operations to clean up the mask
-        kernel = np.ones((3,3), np.uint8)
-        mask = cv2.erode(mask, kernel, iterations=1)
-        mask = cv2.dilate(mask, kernel, iterations=2)
-        
-        # Find contours and keep only the largest one (the garment)
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if contours:
-            largest_contour = max(contours, key=cv2.contourArea)
-            mask = np.zeros_like(mask)
-            cv2.drawContours(mask, [largest_contour], -1, 255, -1)
-        
-        # Apply the mask to the original image
-        result = cv2.bitwise_and(image, image, mask=mask)
-        
-        # Add alpha channel
-        b, g, r = cv2.split(result)
-        a = mask
-        return cv2.merge([b, g, r, a])
+    def _garment_mask(self, image: np.ndarray, coarse_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Compute the garment mask using color thresholding.
+        
+        Args:
+            image: Garment image in BGR format
+            coarse_mask: Optional mask of a downscaled copy (e.g. from the
+                preview); only its contour band is re-thresholded
+        """
+        executor = get_frame_executor()
+        if executor is not None:
+            # Out of process, with the pixels passed through shared memory
+            shape = image.shape[:2]
+            if coarse_mask is not None:
+                return executor.call(refine_mask, (image, coarse_mask), shape, np.uint8,
+                                     settings.BG_REMOVAL_REFINE_BAND)
+            if settings.BG_REMOVAL_COARSE_TO_FINE:
+                return executor.call(garment_mask_coarse_to_fine, (image,), shape, np.uint8,
+                                     settings.BG_REMOVAL_THUMBNAIL_SIZE, settings.BG_REMOVAL_REFINE_BAND)
+            return executor.call(garment_mask, (image,), shape, np.uint8)
+        if coarse_mask is not None:
+            return refine_mask(image, coarse_mask, settings.BG_REMOVAL_REFINE_BAND)
+        if settings.BG_REMOVAL_COARSE_TO_FINE:
+            return garment_mask_coarse_to_fine(image, settings.BG_REMOVAL_THUMBNAIL_SIZE,
+                                               settings.BG_REMOVAL_REFINE_BAND)
+        return garment_mask(image)
 
     def _resize_garment(self, garment_img: np.ndarray, user_img: np.ndarray, garment_type: str) -> np.ndarray:
         """Resize garment based on its type and user image dimensions."""
@@ -366,75 +408,49 @@ class VirtualTryOnService:
         positioned[y:y+garment_h, x:x+garment_w] = garment_img
         return positioned
 
-    def _simple_overlay(self, user_img: np.ndarray, garment_img: np.ndarray, alpha: float = 0.8) -> np.ndarray:
+    def _simple_overlay(self, user_img: np.ndarray, cutout: GarmentCutout, alpha: float = 0.8) -> np.ndarray:
         """Simple overlay fallback when pose estimation fails."""
-        result = user_img.copy()
-        
         # Resize garment to be proportional to user
         h, w = user_img.shape[:2]
-        gh, gw = garment_img.shape[:2]
+        gw, gh = cutout.source_size
         scale = min(w/(gw*1.5), h/(gh*1.5))  # 1.5x padding
         new_w, new_h = int(gw * scale), int(gh * scale)
-        garment_img = cv2.resize(garment_img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        scaled = cutout.scaled(new_w, new_h)
         
         # Center the garment
         x = (w - new_w) // 2
         y = (h - new_h) // 2
         
-        return self._blend_images(result, garment_img, x, y, alpha)
+        return scaled.composite_onto(user_img, x, y, alpha)
 
-    def _blend_images(self, bg_img: np.ndarray, fg_img: np.ndarray, x: int, y: int, alpha: float = 1.0) -> np.ndarray:
-        """Blend foreground image with background at specified position."""
-        result = bg_img.copy()
-        fg_h, fg_w = fg_img.shape[:2]
-        bg_h, bg_w = bg_img.shape[:2]
-        
-        # Ensure coordinates are within bounds
-        x1, y1 = max(0, x), max(0, y)
-        x2, y2 = min(bg_w, x + fg_w), min(bg_h, y + fg_h)
-        
-        # Adjust if out of bounds
-        if x1 >= x2 or y1 >= y2:
-            return result
-            
-        # Calculate the region of the foreground to use
-        fg_x1, fg_y1 = max(0, -x), max(0, -y)
-        fg_x2 = fg_x1 + (x2 - x1)
-        fg_y2 = fg_y1 + (y2 - y1)
-        
-        # Extract the regions
-        bg_region = result[y1:y2, x1:x2]
-        fg_region = fg_img[fg_y1:fg_y2, fg_x1:fg_x2]
-        
-        # Handle different channel counts
-        if len(fg_region.shape) == 2:  # Grayscale
-            fg_region = cv2.cvtColor(fg_region, cv2.COLOR_GRAY2BGR)
-        
-        # If foreground has alpha channel, use it for blending
-        if fg_region.shape[2] == 4:
-            alpha_channel = fg_region[:, :, 3] / 255.0
-            alpha_mask = alpha_channel[..., None] * alpha
-        else:
-            alpha_mask = np.ones((fg_region.shape[0], fg_region.shape[1], 1)) * alpha
-        
-        # Blend the images
-        for c in range(0, 3):
-            bg_region[..., c] = (
-                alpha_mask[..., 0] * fg_region[..., c] +
-                (1 - alpha_mask[..., 0]) * bg_region[..., c]
-            )
-        
-        result[y1:y2, x1:x2] = bg_region
-        return result
-
-    def _overlay_garment(self, user_img: np.ndarray, garment_img: np.ndarray, garment_type: Optional[str] = None) -> np.ndarray:
+    def _overlay_garment(
+        self,
+        user_img: np.ndarray,
+        garment_img: np.ndarray,
+        garment_type: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
+        pose_backend: Optional[str] = None,
+        progress: Optional[Callable[[str, float], None]] = None,
+        precomputed: Optional[Dict[str, Any]] = None,
+        intermediates: Optional[Dict[str, Any]] = None
+    ) -> np.ndarray:
         """
         Overlay the garment on the user image using pose estimation.
         
+        Garment preparation (type detection, background removal) and user
+        analysis (pose estimation) do not depend on each other, so they run as
+        separate branches of a stage graph on the worker pool.
+        
         Args:
             user_img: User image in BGR format
             garment_img: Garment image in BGR format with alpha channel
-            garment_type: Type of garment (top, pants, hat, etc.)
+            garment_type: Type of garment (top, pants, hat, etc.); detected if not given
+            timings: Optional dict that receives per-stage timings in milliseconds
+            pose_backend: Optional pose backend name overriding the default
+            progress: Optional callback receiving (stage name, ms) as stages finish
+            precomputed: Optional stage results to seed instead of computing
+                them, e.g. "pose" or "coarse_mask" from a preview pass
+            intermediates: Optional dict that receives every stage result
             
         Returns:
             Image with garment overlaid on user
@@ -442,64 +458,19 @@ class VirtualTryOnService:
         logger.info("Starting garment overlay process...")
         try:
             logger.info(f"Input image shape: {user_img.shape}")
-            logger.info(f"Garment image shape: {garment_img.shape}")
-            
-            # Convert to RGB for pose estimation
-            logger.info("Converting image to RGB for pose estimation...")
-            user_img_rgb = cv2.cvtColor(user_img, cv2.COLOR_BGR2RGB)
-            
-            # Detect garment type if not provided
-            if not garment_type:
-                logger.info("Detecting garment type...")
-                garment_type = self._detect_garment_type(garment_img)
-                logger.info(f"Detected garment type: {garment_type}")
-            
-            # Remove background from garment
-            logger.info("Removing background from garment...")
-            garment_no_bg = self._remove_background(garment_img)
-            if garment_no_bg is None or garment_no_bg.size == 0:
-                logger.error("Failed to remove background from garment")
-                return user_img
-            logger.info(f"Garment after background removal shape: {garment_no_bg.shape}")
-            
-            # Estimate pose
-            logger.info("Estimating pose...")
-            keypoints = self.pose_estimator.estimate_pose(user_img)
-            
-            if not keypoints:
-                logger.warning("Could not detect pose, falling back to simple overlay")
-                return self._simple_overlay(user_img, garment_no_bg)
-            
-            logger.info(f"Detected {len(keypoints)} keypoints")
-                
-            # Get garment position based on pose
-            logger.info("Calculating garment position...")
-            x, y, width, height = self.pose_estimator.get_garment_position(keypoints, garment_type)
-            logger.info(f"Calculated garment position: x={x}, y={y}, width={width}, height={height}")
-            
-            if width == 0 or height == 0:
-                logger.warning("Could not determine garment position, falling back to simple overlay")
-                return self._simple_overlay(user_img, garment_no_bg)
-            
-            # Resize garment to fit the calculated dimensions
-            logger.info(f"Resizing garment to {width}x{height}...")
-            resized_garment = cv2.resize(garment_no_bg, (width, height), interpolation=cv2.INTER_LINEAR)
-            
-            # Enable debug output
-            debug = True
-            if debug:
-                debug_img = self.pose_estimator.draw_pose(user_img.copy(), keypoints)
-                cv2.rectangle(debug_img, (x, y), (x + width, y + height), (0, 255, 0), 2)
-                debug_path = os.path.join(settings.UPLOAD_FOLDER, 'debug_pose.jpg')
-                cv2.imwrite(debug_path, debug_img)
-                logger.info(f"Debug image saved to: {debug_path}")
-            
-            # Overlay the garment
-            logger.info("Blending garment onto user image...")
-            result = self._blend_images(user_img.copy(), resized_garment, x, y)
-            
-            logger.info("Garment overlay completed successfully")
-            return result
+            if garment_img is not None:
+                logger.info(f"Garment image shape: {garment_img.shape}")
+            
+            seed = {"user_img": user_img, "garment_img": garment_img, "pose_backend": pose_backend,
+                    "coarse_mask": None}
+            seed.update(precomputed or {})
+            if garment_type:
+                seed["garment_type"] = garment_type
+            
+            results = self._build_overlay_graph().run(seed, timings, progress)
+            if intermediates is not None:
+                intermediates.update(results)
+            return results["composite"]
             
         except Exception as e:
             logger.error(f"Error in garment overlay: {str(e)}", exc_info=True)
@@ -509,19 +480,237 @@ class VirtualTryOnService:
             logger.error(f"Traceback: {traceback.format_exc()}")
             return user_img
 
+    def _build_overlay_graph(self) -> StageGraph:
+        """Declare the try-on stages and their dependencies."""
+        return StageGraph([
+            Stage("garment_key", self._stage_garment_key, ("garment_img",)),
+            Stage("garment_type", self._stage_garment_type, ("garment_img", "garment_key")),
+            Stage("garment_match", self._stage_garment_match, ("garment_img",)),
+            Stage("garment_mask", self._stage_garment_mask,
+                  ("garment_img", "garment_key", "coarse_mask", "garment_match")),
+            Stage("garment_cutout", self._stage_garment_cutout, ("garment_img", "garment_mask", "garment_match")),
+            Stage("garment_anchors", self._stage_garment_anchors, ("garment_cutout", "garment_type")),
+            Stage("pose", self._stage_estimate_pose, ("user_img", "pose_backend")),
+            Stage("composite", self._stage_composite,
+                  ("user_img", "garment_cutout", "garment_type", "pose", "garment_anchors")),
+        ])
+
+    def _stage_garment_key(self, garment_img: np.ndarray) -> str:
+        """Hash the garment pixels once; the single-flight keys of the garment stages derive from it."""
+        return content_key(garment_img)
+
+    def _stage_garment_type(self, garment_img: np.ndarray, garment_key: str) -> str:
+        logger.info("Detecting garment type...")
+        key = content_key("garment_type", garment_key)
+        garment_type = self.garment_flight.do(key, detect_garment_type, garment_img)
+        logger.info(f"Detected garment type: {garment_type}")
+        return garment_type
+
+    def _stage_garment_match(
+        self,
+        garment_img: np.ndarray
+    ) -> Optional[Tuple[int, np.ndarray, Optional[np.ndarray]]]:
+        """
+        Look the garment up in the perceptual-hash index.
+        
+        Only the mask of a near-duplicate is reused; the cutout is always
+        taken from this image's own pixels, so a garment of another colour or
+        print that hashes alike cannot leak into the result.
+        
+        Returns:
+            (hash, colour thumbnail, mask of a near-duplicate rescaled to this
+            image or None), or None if the index is disabled
+        """
+        if not settings.PHASH_ENABLED:
+            return None
+        image_hash = dhash(garment_img)
+        thumbnail = color_thumbnail(garment_img)
+        height, width = garment_img.shape[:2]
+        match = self.garment_index.lookup(image_hash, width / height, thumbnail)
+        if match is None:
+            return image_hash, thumbnail, None
+        distance, mask = match
+        logger.info(f"Reusing garment mask of a near-duplicate image (distance {distance})")
+        if mask.shape[:2] != (height, width):
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_LINEAR)
+        return image_hash, thumbnail, mask
+
+    def _stage_garment_mask(
+        self,
+        garment_img: np.ndarray,
+        garment_key: str,
+        coarse_mask: Optional[np.ndarray],
+        garment_match: Optional[Tuple[int, np.ndarray, Optional[np.ndarray]]] = None
+    ) -> Optional[np.ndarray]:
+        if garment_match is not None and garment_match[2] is not None:
+            return garment_match[2]
+        logger.info("Removing background from garment...")
+        key = content_key(
+            "garment_mask", garment_key, coarse_mask, settings.BG_REMOVAL_COARSE_TO_FINE,
+            settings.BG_REMOVAL_THUMBNAIL_SIZE, settings.BG_REMOVAL_REFINE_BAND
+        )
+        return self.garment_flight.do(key, self._garment_mask, garment_img, coarse_mask)
+
+    def _stage_garment_cutout(
+        self,
+        garment_img: np.ndarray,
+        garment_mask: Optional[np.ndarray],
+        garment_match: Optional[Tuple[int, np.ndarray, Optional[np.ndarray]]] = None
+    ) -> Optional[GarmentCutout]:
+        garment_no_bg = apply_mask(garment_img, garment_mask)
+        if garment_no_bg is None or garment_no_bg.size == 0:
+            return None
+        # Keep only the tight alpha bounding box, premultiplied
+        cutout = GarmentCutout.from_rgba(garment_no_bg)
+        if garment_match is not None and garment_match[2] is None:
+            image_hash, thumbnail, _ = garment_match
+            height, width = garment_img.shape[:2]
+            self.garment_index.add(image_hash, width / height, garment_mask, garment_mask.nbytes, thumbnail)
+        logger.info(f"Garment cutout: {cutout.width}x{cutout.height} at ({cutout.x}, {cutout.y}) "
+                    f"of {cutout.source_size[0]}x{cutout.source_size[1]}")
+        return cutout
+
+    def _stage_garment_anchors(
+        self,
+        garment_cutout: Optional[GarmentCutout],
+        garment_type: str
+    ) -> Optional[Dict[str, Tuple[float, float]]]:
+        """Garment landmarks that drive the pose warp, normalized to the garment frame."""
+        if not settings.GARMENT_WARP_ENABLED or garment_cutout is None:
+            return None
+        return normalized_anchors(garment_cutout, garment_type) or None
+
+    def _stage_estimate_pose(self, user_img: np.ndarray, pose_backend: Optional[str]) -> Optional[Pose]:
+        logger.info("Estimating pose...")
+        key = content_key(user_img, pose_backend or self.pose_estimator.active.name)
+        return self.pose_flight.do(key, self.pose_estimator.estimate, user_img, pose_backend)
+
+    def _stage_composite(
+        self,
+        user_img: np.ndarray,
+        garment_cutout: Optional[GarmentCutout],
+        garment_type: str,
+        pose: Optional[Pose],
+        garment_anchors: Optional[Dict[str, Tuple[float, float]]] = None
+    ) -> np.ndarray:
+        """Position, resize and blend the prepared garment onto the user image."""
+        if garment_cutout is None:
+            logger.error("Failed to remove background from garment")
+            return user_img
+        
+        if not pose:
+            logger.warning("Could not detect pose, falling back to simple overlay")
+            return self._simple_overlay(user_img, garment_cutout)
+        
+        logger.info(f"Detected {pose.count()} keypoints")
+            
+        # Get garment position based on pose
+        logger.info("Calculating garment position...")
+        x, y, width, height = self.pose_estimator.get_garment_position(pose, garment_type)
+        logger.info(f"Calculated garment position: x={x}, y={y}, width={width}, height={height}")
+        
+        if width == 0 or height == 0:
+            logger.warning("Could not determine garment position, falling back to simple overlay")
+            return self._simple_overlay(user_img, garment_cutout)
+        
+        # Resize garment to fit the calculated dimensions; only the cropped
+        # cutout is resized, not the transparent frame around it
+        logger.info(f"Resizing garment to {width}x{height}...")
+        resized_garment = garment_cutout.scaled(width, height)
+        if garment_anchors:
+            resized_garment = garment_warper.warp(
+                resized_garment, garment_anchors, pose, (x, y, width, height), garment_type
+            )
+        
+        # Overlay the garment
+        logger.info("Blending garment onto user image...")
+        result = resized_garment.composite_onto(user_img, x, y)
+        
+        logger.info("Garment overlay completed successfully")
+        return result
+
+    def _capture_trace(
+        self,
+        trace: Trace,
+        results: Dict[str, Any],
+        timings: Optional[Dict[str, float]],
+        prefix: str = ""
+    ) -> None:
+        """
+        Queue the keypoint overlay, garment masks and a stage summary of an
+        overlay graph run for the trace writer.
+        
+        The images are drawn and encoded on the writer thread; the queued
+        artifacts hold references to the stage results until then.
+        """
+        user_img = results["user_img"]
+        pose: Optional[Pose] = results.get("pose")
+        garment_type = results.get("garment_type")
+        box = None
+        if pose and garment_type:
+            box = self.pose_estimator.get_garment_position(pose, garment_type)
+        
+        def pose_overlay() -> np.ndarray:
+            image = self.pose_estimator.draw_pose(user_img, pose) if pose else user_img
+            if image is user_img:
+                image = user_img.copy()
+            if box and box[2] and box[3]:
+                x, y, width, height = box
+                cv2.rectangle(image, (x, y), (x + width, y + height), (0, 255, 0), 2)
+            return image
+        
+        trace.capture(f"{prefix}pose.jpg", pose_overlay)
+        for name in ("coarse_mask", "garment_mask"):
+            mask = results.get(name)
+            if mask is not None:
+                trace.capture(f"{prefix}{name}.png", lambda mask=mask: mask)
+        summary = {
+            "garment_type": garment_type,
+            "keypoints": pose.to_keypoints() if pose else None,
+            "garment_box": box,
+            "timings_ms": dict(timings) if timings is not None else None,
+        }
+        trace.capture(f"{prefix}stages.json", lambda: summary)
+
     async def process_virtual_tryon(
         self, 
         user_image_path: str, 
         garment_image_path: str,
-        output_path: Optional[str] = None
+        output_path: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
+        pose_backend: Optional[str] = None,
+        progress: Optional[Callable[[str, float], None]] = None,
+        garment_id: Optional[str] = None,
+        trace: bool = False,
+        cleanup: Sequence[str] = ()
     ) -> str:
         """
         Process virtual try-on with the given user and garment images.
         
+        Concurrent requests for the same image contents and pose backend share
+        one computation and receive the same result path, unless an explicit
+        output_path is given.
+        
+        With a catalogue garment_id, the garment type and cutout come from the
+        precomputed catalogue and garment_image_path is ignored.
+        
         Args:
             user_image_path: Path to the user's image file
             garment_image_path: Path to the garment image file
             output_path: Optional path to save the result
+            timings: Optional dict that receives per-stage timings in milliseconds
+            pose_backend: Optional pose backend name overriding the default
+            progress: Optional callback receiving (stage name, ms) as stages
+                finish; called from worker threads. Requests that join an
+                in-flight computation receive no progress events.
+            garment_id: Optional catalogue garment id
+            trace: Ask for trace artifacts (honoured when TRACE_ON_REQUEST is
+                set); requests that join an in-flight computation are not traced
+            cleanup: Files to delete once no computation reads them, e.g. this
+                request's uploads. When this call starts a shared computation
+                they are deleted as it finishes, even if this caller is
+                cancelled first and other requests still wait for it;
+                otherwise before this call returns.
             
         Returns:
             Path to the processed result image
@@ -529,91 +718,383 @@ class VirtualTryOnService:
         Raises:
             HTTPException: If there's an error processing the images
         """
+        # Set once the shared computation has taken over deleting cleanup
+        handed_over = False
         try:
             logger.info(f"Starting virtual try-on process")
             logger.info(f"User image path: {user_image_path}")
-            logger.info(f"Garment image path: {garment_image_path}")
+            logger.info(f"Garment: {garment_id or garment_image_path}")
             
             # Verify input files exist
-            if not os.path.exists(user_image_path):
+            if not await path_exists(user_image_path):
                 error_msg = f"User image not found at path: {user_image_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=400, detail=error_msg)
-                
-            if not os.path.exists(garment_image_path):
+            
+            if garment_id:
+                # Checking the catalogue may reload it from disk
+                catalogue_version, entry = await asyncio.to_thread(garment_catalogue.versioned_entry, garment_id)
+                if entry is None:
+                    error_msg = f"Unknown garment_id: {garment_id}"
+                    logger.error(error_msg)
+                    raise HTTPException(status_code=404, detail=error_msg)
+                garment_image_path = None
+            elif not await path_exists(garment_image_path):
                 error_msg = f"Garment image not found at path: {garment_image_path}"
                 logger.error(error_msg)
                 raise HTTPException(status_code=400, detail=error_msg)
             
-            # Create output directory if it doesn't exist
-            os.makedirs(self.result_folder, exist_ok=True)
+            if output_path:
+                return await self._render_tryon(user_image_path, garment_image_path, output_path,
+                                                timings, pose_backend, progress, garment_id, trace)
             
-            # Create output path if not provided
-            if not output_path:
-                output_filename = f"result_{uuid.uuid4()}.png"
-                output_path = os.path.join(self.result_folder, output_filename)
+            # Uploads get unique file names, so identical requests are matched by content
+            if garment_id:
+                user_digest = await file_digest(user_image_path)
+                garment_key = ("catalogue", catalogue_version, garment_id)
+            else:
+                user_digest, garment_key = await asyncio.gather(
+                    file_digest(user_image_path), file_digest(garment_image_path)
+                )
+            key = content_key(user_digest, garment_key, pose_backend)
+            output_path = os.path.join(self.result_folder, f"result_{uuid.uuid4()}.png")
             
-            logger.info(f"Loading images...")
-            # Load images with error handling
-            try:
-                user_img = cv2.imread(user_image_path)
-                if user_img is None:
-                    raise ValueError(f"Failed to load user image: {user_image_path}")
-                    
-                garment_img = cv2.imread(garment_image_path, cv2.IMREAD_UNCHANGED)
+            def start() -> Awaitable[str]:
+                # Called synchronously when this request starts the computation
+                nonlocal handed_over
+                handed_over = True
+                return self._render_shared(cleanup, user_image_path, garment_image_path, output_path,
+                                           timings, pose_backend, progress, garment_id, trace)
+            
+            return await self.tryon_flight.do(key, start)
+            
+        except HTTPException:
+            # Re-raise HTTP exceptions as-is
+            raise
+            
+        except Exception as e:
+            # Catch any other exceptions and return a 500 error
+            error_msg = f"Unexpected error in virtual try-on: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise HTTPException(status_code=500, detail=error_msg)
+        
+        finally:
+            if not handed_over:
+                await remove_files(cleanup)
+    
+    async def _render_shared(self, cleanup: Sequence[str], *args: Any) -> str:
+        """_render_tryon for a shared computation, which owns the leader's input files."""
+        try:
+            return await self._render_tryon(*args)
+        finally:
+            await remove_files(cleanup)
+    
+    async def _plan_memory(
+        self,
+        user_image_path: str,
+        garment_image_path: Optional[str],
+        preview: bool = False
+    ) -> MemoryPlan:
+        """
+        Estimate the request's peak memory from the image headers and fit it
+        into MEMORY_REQUEST_BUDGET_MB, downscaling or rejecting per
+        MEMORY_BUDGET_POLICY.
+        """
+        # Unreadable headers count as empty; the decode that follows reports them
+        user_size = await asyncio.to_thread(decoded_size, user_image_path, settings.WORKING_MAX_PIXELS)
+        garment_size = None
+        if garment_image_path is not None:
+            garment_size = await asyncio.to_thread(decoded_size, garment_image_path, settings.WORKING_MAX_PIXELS)
+            garment_size = garment_size or (0, 0)
+        return plan_request(user_size or (0, 0), garment_size, settings.MEMORY_REQUEST_BUDGET_MB * MB,
+                            settings.MEMORY_BUDGET_POLICY, preview)
+    
+    @staticmethod
+    def _fit_pixels(image: np.ndarray, max_pixels: int) -> np.ndarray:
+        """Downscale an image, keeping its aspect ratio, to at most max_pixels."""
+        h, w = image.shape[:2]
+        if h * w <= max_pixels:
+            return image
+        scale = (max_pixels / (h * w)) ** 0.5
+        return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    
+    async def _load_images(
+        self,
+        user_image_path: str,
+        garment_image_path: Optional[str],
+        plan: Optional[MemoryPlan] = None
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Decode the user (BGR) and garment (with alpha, if any) images; the
+        garment is None when no garment path is given.
+        
+        Decoding reads the files, so it runs in worker threads rather than on
+        the event loop. A downscaling memory plan caps the decoded sizes.
+        
+        Raises:
+            HTTPException: 400 if either image cannot be decoded
+        """
+        logger.info(f"Loading images...")
+        
+        def target_pixels(size: Optional[Tuple[int, int]]) -> int:
+            if plan is None or plan.scale >= 1.0 or size is None:
+                return settings.WORKING_MAX_PIXELS
+            planned = size[0] * size[1]
+            return min(settings.WORKING_MAX_PIXELS, planned) if settings.WORKING_MAX_PIXELS > 0 else planned
+        
+        try:
+            user_target = target_pixels(plan.user_size if plan else None)
+            if garment_image_path is None:
+                user_img = await asyncio.to_thread(decode_image, user_image_path, user_target)
+                garment_img = None
+            else:
+                garment_target = target_pixels(plan.garment_size if plan else None)
+                user_img, garment_img = await asyncio.gather(
+                    asyncio.to_thread(decode_image, user_image_path, user_target),
+                    asyncio.to_thread(decode_image, garment_image_path, garment_target, cv2.IMREAD_UNCHANGED),
+                )
                 if garment_img is None:
                     raise ValueError(f"Failed to load garment image: {garment_image_path}")
-                    
-                logger.info(f"User image shape: {user_img.shape}")
+                if plan is not None and plan.scale < 1.0 and plan.garment_size:
+                    garment_img = self._fit_pixels(garment_img, plan.garment_size[0] * plan.garment_size[1])
                 logger.info(f"Garment image shape: {garment_img.shape}")
                 
-            except Exception as img_error:
-                error_msg = f"Error loading images: {str(img_error)}"
-                logger.error(error_msg, exc_info=True)
+            if user_img is None:
+                raise ValueError(f"Failed to load user image: {user_image_path}")
+            if plan is not None and plan.scale < 1.0:
+                user_img = self._fit_pixels(user_img, plan.user_size[0] * plan.user_size[1])
+                
+            logger.info(f"User image shape: {user_img.shape}")
+            return user_img, garment_img
+            
+        except Exception as img_error:
+            error_msg = f"Error loading images: {str(img_error)}"
+            logger.error(error_msg, exc_info=True)
+            raise HTTPException(status_code=400, detail=error_msg)
+    
+    def _catalogue_stages(self, garment_id: str) -> Dict[str, Any]:
+        """Garment stage results taken from the catalogue, so no garment preprocessing runs."""
+        found = garment_catalogue.lookup(garment_id)
+        if found is None:
+            raise ValueError(f"Garment {garment_id} is not in the catalogue")
+        entry, cutout = found
+        return {
+            "garment_key": None,
+            "garment_type": entry.garment_type,
+            "garment_match": None,
+            "garment_mask": None,
+            "garment_cutout": cutout,
+            "garment_anchors": self._catalogue_anchors(entry),
+        }
+    
+    @staticmethod
+    def _catalogue_anchors(entry: CatalogueEntry) -> Optional[Dict[str, Tuple[float, float]]]:
+        if not settings.GARMENT_WARP_ENABLED or not entry.anchors:
+            return None
+        src_w, src_h = entry.source_size
+        return {name: (x / src_w, y / src_h) for name, (x, y) in entry.anchors.items()}
+    
+    async def _render_tryon(
+        self,
+        user_image_path: str,
+        garment_image_path: str,
+        output_path: str,
+        timings: Optional[Dict[str, float]],
+        pose_backend: Optional[str],
+        progress: Optional[Callable[[str, float], None]] = None,
+        garment_id: Optional[str] = None,
+        trace: bool = False
+    ) -> str:
+        """
+        Decode the images, run the overlay graph and write the result to
+        output_path, within the request's memory budget and reservation.
+        A traced request's artifacts are named after the result file.
+        """
+        try:
+            precomputed = None
+            if garment_id:
+                precomputed = await asyncio.to_thread(self._catalogue_stages, garment_id)
+            plan = await self._plan_memory(user_image_path, garment_image_path)
+            async with memory_governor.reserve(plan.footprint):
+                user_img, garment_img = await self._load_images(user_image_path, garment_image_path, plan)
+                
+                try:
+                    # Process the virtual try-on; garment type detection runs as a
+                    # stage of the overlay graph alongside pose estimation
+                    logger.info("Processing garment overlay...")
+                    tracer = trace_recorder.start(Path(output_path).stem, trace)
+                    intermediates: Optional[Dict[str, Any]] = {} if tracer else None
+                    result = await asyncio.to_thread(
+                        self._overlay_garment, user_img, garment_img, timings=timings, pose_backend=pose_backend,
+                        progress=progress, precomputed=precomputed, intermediates=intermediates
+                    )
+                    if tracer and intermediates:
+                        self._capture_trace(tracer, intermediates, timings)
+                    
+                    if result is None or not isinstance(result, np.ndarray):
+                        error_msg = "Failed to process virtual try-on: Invalid result from overlay_garment"
+                        logger.error(error_msg)
+                        raise ValueError(error_msg)
+                    
+                    # Ensure the output directory exists
+                    await make_dirs(os.path.dirname(output_path))
+                    
+                    # Save result
+                    logger.info(f"Saving result to: {output_path}")
+                    await write_image(output_path, result)
+                    
+                    logger.info("Virtual try-on completed successfully")
+                    return output_path
+                    
+                except Exception as proc_error:
+                    error_msg = f"Error during virtual try-on processing: {str(proc_error)}"
+                    logger.error(error_msg, exc_info=True)
+                    raise HTTPException(status_code=500, detail=error_msg)
+            
+        except HTTPException:
+            # Re-raise HTTP exceptions as-is
+            raise
+            
+        except Exception as e:
+            # Catch any other exceptions and return a 500 error
+            error_msg = f"Unexpected error in virtual try-on: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise HTTPException(status_code=500, detail=error_msg)
+    
+    async def process_progressive_tryon(
+        self,
+        user_image_path: str,
+        garment_image_path: str,
+        on_preview: Callable[[str], None],
+        timings: Optional[Dict[str, float]] = None,
+        pose_backend: Optional[str] = None,
+        progress: Optional[Callable[[str, float], None]] = None,
+        trace: bool = False
+    ) -> str:
+        """
+        Produce a quick low-resolution preview, then the full-quality result.
+        
+        The preview runs the overlay graph on inputs downscaled to
+        PREVIEW_MAX_SIDE. Its garment type, pose (scaled back up) and garment
+        mask (as the coarse mask, refined only along the contour) seed the
+        full-resolution pass, which then only has to refine the mask and
+        composite.
+        
+        Args:
+            user_image_path: Path to the user's image file
+            garment_image_path: Path to the garment image file
+            on_preview: Called with the preview path as soon as it is written;
+                the preview is deleted PREVIEW_RETENTION_S after the result is ready
+            timings: Optional dict that receives per-stage timings in milliseconds;
+                preview stages are prefixed with "preview_"
+            pose_backend: Optional pose backend name overriding the default
+            progress: Optional callback receiving (stage name, ms) as stages finish
+            trace: Ask for trace artifacts of both passes (honoured when
+                TRACE_ON_REQUEST is set)
+            
+        Returns:
+            Path to the full-resolution result image
+            
+        Raises:
+            HTTPException: If there's an error processing the images
+        """
+        preview_path = None
+        try:
+            if not garment_image_path:
+                error_msg = "Progressive try-on needs a garment image"
+                logger.error(error_msg)
+                raise HTTPException(status_code=400, detail=error_msg)
+            if not await path_exists(user_image_path) or not await path_exists(garment_image_path):
+                error_msg = f"Image not found: {user_image_path}, {garment_image_path}"
+                logger.error(error_msg)
                 raise HTTPException(status_code=400, detail=error_msg)
             
-            try:
-                # Detect garment type
-                logger.info("Detecting garment type...")
-                garment_type = self._detect_garment_type(garment_img)
-                logger.info(f"Detected garment type: {garment_type}")
+            output_path = os.path.join(self.result_folder, f"result_{uuid.uuid4()}.png")
+            tracer = trace_recorder.start(Path(output_path).stem, trace)
+            plan = await self._plan_memory(user_image_path, garment_image_path, preview=True)
+            async with memory_governor.reserve(plan.footprint):
+                user_img, garment_img = await self._load_images(user_image_path, garment_image_path, plan)
+                small_user = self._resize_to_max_side(user_img, settings.PREVIEW_MAX_SIDE)
+                small_garment = self._resize_to_max_side(garment_img, settings.PREVIEW_MAX_SIDE)
                 
-                # Process the virtual try-on with the pose estimator
-                logger.info("Processing garment overlay...")
-                result = self._overlay_garment(user_img, garment_img, garment_type)
+                def preview_progress(stage: str, ms: float) -> None:
+                    if progress is not None:
+                        progress(f"preview_{stage}", ms)
                 
-                if result is None or not isinstance(result, np.ndarray):
-                    error_msg = "Failed to process virtual try-on: Invalid result from overlay_garment"
-                    logger.error(error_msg)
-                    raise ValueError(error_msg)
+                preview_timings: Dict[str, float] = {}
+                preview_results: Dict[str, Any] = {}
+                preview = await asyncio.to_thread(
+                    self._overlay_garment, small_user, small_garment, timings=preview_timings,
+                    pose_backend=pose_backend, progress=preview_progress, intermediates=preview_results,
+                    # A thumbnail-sized cutout must not enter the near-duplicate index
+                    precomputed={"garment_match": None}
+                )
+                if timings is not None:
+                    timings.update({f"preview_{k}": v for k, v in preview_timings.items()})
+                if tracer and preview_results:
+                    self._capture_trace(tracer, preview_results, preview_timings, prefix="preview_")
                 
-                # Ensure the output directory exists
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                await make_dirs(self.result_folder)
+                ok, buffer = await asyncio.to_thread(
+                    cv2.imencode, ".jpg", preview, [cv2.IMWRITE_JPEG_QUALITY, settings.PREVIEW_JPEG_QUALITY]
+                )
+                if ok:
+                    preview_path = os.path.join(self.result_folder, f"preview_{uuid.uuid4()}.jpg")
+                    await write_bytes(preview_path, memoryview(buffer))
+                    on_preview(preview_path)
                 
-                # Save result
-                logger.info(f"Saving result to: {output_path}")
-                if not cv2.imwrite(output_path, result):
-                    error_msg = f"Failed to save result image to: {output_path}"
-                    logger.error(error_msg)
-                    raise IOError(error_msg)
+                # Reuse what the preview computed; anything missing is recomputed
+                precomputed: Dict[str, Any] = {}
+                if "garment_type" in preview_results:
+                    precomputed["garment_type"] = preview_results["garment_type"]
+                if preview_results.get("garment_mask") is not None:
+                    precomputed["coarse_mask"] = preview_results["garment_mask"]
+                pose = preview_results.get("pose")
+                if pose:
+                    precomputed["pose"] = pose.scaled(user_img.shape[1] / small_user.shape[1],
+                                                      user_img.shape[0] / small_user.shape[0])
                 
-                logger.info("Virtual try-on completed successfully")
+                intermediates: Optional[Dict[str, Any]] = {} if tracer else None
+                result = await asyncio.to_thread(
+                    self._overlay_garment, user_img, garment_img, timings=timings, pose_backend=pose_backend,
+                    progress=progress, precomputed=precomputed, intermediates=intermediates
+                )
+                if tracer and intermediates:
+                    self._capture_trace(tracer, intermediates, timings)
+                await write_image(output_path, result)
+                logger.info(f"Progressive try-on completed: preview {preview_path}, result {output_path}")
                 return output_path
-                
-            except Exception as proc_error:
-                error_msg = f"Error during virtual try-on processing: {str(proc_error)}"
-                logger.error(error_msg, exc_info=True)
-                raise HTTPException(status_code=500, detail=error_msg)
             
         except HTTPException:
-            # Re-raise HTTP exceptions as-is
             raise
             
         except Exception as e:
-            # Catch any other exceptions and return a 500 error
-            error_msg = f"Unexpected error in virtual try-on: {str(e)}"
+            error_msg = f"Unexpected error in progressive virtual try-on: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise HTTPException(status_code=500, detail=error_msg)
+        
+        finally:
+            if preview_path:
+                self._expire_preview(preview_path)
+    
+    def _expire_preview(self, preview_path: str) -> None:
+        """Delete a preview PREVIEW_RETENTION_S after the full result (or an error) superseded it."""
+        async def expire() -> None:
+            await asyncio.sleep(settings.PREVIEW_RETENTION_S)
+            await remove_file(preview_path)
+        
+        task = asyncio.ensure_future(expire())
+        self._preview_expiry.add(task)
+        task.add_done_callback(self._preview_expiry.discard)
+    
+    @staticmethod
+    def _resize_to_max_side(image: np.ndarray, max_side: int) -> np.ndarray:
+        """Downscale so the longest side is at most max_side; smaller images are returned as is."""
+        h, w = image.shape[:2]
+        scale = max_side / max(h, w)
+        if scale >= 1.0:
+            return image
+        return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
     
     async def process_video_stream(self, video_path: str) -> str:
         """Process a video stream for real-time virtual try-on."""
@@ -660,6 +1141,51 @@ class VirtualTryOnService:
 # Create a singleton instance
 virtual_tryon_service = VirtualTryOnService()
 
-# Helper function for API routes
-async def process_virtual_tryon(user_image_path: str, garment_image_path: str) -> str:
-    return await virtual_tryon_service.process_virtual_tryon(user_image_path, garment_image_path)
+# Helper functions for API routes
+async def process_progressive_tryon(
+    user_image_path: str,
+    garment_image_path: str,
+    on_preview: Callable[[str], None],
+    pose_backend: Optional[str] = None,
+    progress: Optional[Callable[[str, float], None]] = None,
+    trace: bool = False,
+    timings: Optional[Dict[str, float]] = None
+) -> str:
+    if settings.COMPUTE_MODE == "queue":
+        # Compute workers return only the final result, so there is no preview to send
+        error_msg = "Progressive try-on is not available when try-ons run on compute workers"
+        logger.error(error_msg)
+        raise HTTPException(status_code=400, detail=error_msg)
+    return await virtual_tryon_service.process_progressive_tryon(
+        user_image_path, garment_image_path, on_preview, timings=timings, pose_backend=pose_backend,
+        progress=progress, trace=trace
+    )
+
+async def process_virtual_tryon(
+    user_image_path: str,
+    garment_image_path: str,
+    pose_backend: Optional[str] = None,
+    progress: Optional[Callable[[str, float], None]] = None,
+    garment_id: Optional[str] = None,
+    trace: bool = False,
+    timings: Optional[Dict[str, float]] = None,
+    cleanup: Sequence[str] = ()
+) -> str:
+    if settings.COMPUTE_MODE == "queue":
+        # Runs on a compute worker; progress events are not forwarded, stage timings are.
+        # The task owns the uploads: it may still run after this request is cancelled
+        value = await run_task({
+            "kind": "try_on",
+            "user_image": user_image_path,
+            "garment_image": garment_image_path,
+            "pose_backend": pose_backend,
+            "garment_id": garment_id,
+            "trace": trace,
+        }, cleanup=cleanup)
+        if timings is not None:
+            timings.update(value.get("timings") or {})
+        return value["result_path"]
+    return await virtual_tryon_service.process_virtual_tryon(
+        user_image_path, garment_image_path, timings=timings, pose_backend=pose_backend, progress=progress,
+        garment_id=garment_id, trace=trace, cleanup=cleanup
+    )
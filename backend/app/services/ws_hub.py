@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, Any]
+
+
+class Connection:
+    """
+    One accepted WebSocket with its bounded outbound queue.
+
+    Queue entries are (coalesce_key, message, enqueued_at). Entries with a
+    coalesce key hold no message themselves; the latest message for the key is
+    kept in `latest`, so repeated updates (e.g. progress) occupy one slot.
+    """
+
+    __slots__ = ("client_id", "websocket", "topics", "queue", "latest", "writer", "closed", "sent", "dropped")
+
+    def __init__(self, client_id: str, websocket: WebSocket):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.topics: Set[str] = set()
+        self.queue: Deque[Tuple[Optional[str], Optional[Message], float]] = deque()
+        self.latest: Dict[str, Message] = {}
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+
+
+class ConnectionHub:
+    """
+    Registry of WebSocket connections indexed by client id and topic.
+
+    Sending never awaits the socket: messages are appended to the
+    connection's bounded queue and a writer task drains it. The writer only
+    exists while the queue is non-empty, so idle sockets cost no task. When a
+    queue is full the oldest message is dropped, or the connection is closed
+    if the slow-consumer policy is "disconnect". Publishing to a topic touches
+    only its subscribers.
+    """
+
+    def __init__(self, max_queue: int = 64, slow_consumer_policy: str = "drop_oldest", send_timeout: float = 10.0):
+        self.max_queue = max(1, max_queue)
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        self._clients: Dict[str, Set[Connection]] = {}
+        self._topics: Dict[str, Set[Connection]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._connections = 0
+        self._queued = 0
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self._lag_ewma = 0.0
+        self._lag_max = 0.0
+
+    async def connect(self, websocket: WebSocket, client_id: str, topics: Iterable[str] = ()) -> Connection:
+        """Accept the socket and register it under its client id and topics."""
+        await websocket.accept()
+        self._loop = asyncio.get_running_loop()
+        connection = Connection(client_id, websocket)
+        self._clients.setdefault(client_id, set()).add(connection)
+        self._connections += 1
+        for topic in topics:
+            self.subscribe(connection, topic)
+        logger.info(f"WebSocket connected: {client_id} ({self._connections} open)")
+        return connection
+
+    async def disconnect(self, connection: Connection, code: int = 1000) -> None:
+        """Unregister the connection and close the socket if it is still open."""
+        if connection.closed:
+            return
+        connection.closed = True
+        self._connections -= 1
+        self._queued -= len(connection.queue)
+        connection.queue.clear()
+        connection.latest.clear()
+
+        peers = self._clients.get(connection.client_id)
+        if peers is not None:
+            peers.discard(connection)
+            if not peers:
+                del self._clients[connection.client_id]
+        for topic in list(connection.topics):
+            self.unsubscribe(connection, topic)
+
+        writer = connection.writer
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            pass  # Already closed by the peer
+        logger.info(f"WebSocket disconnected: {connection.client_id} ({self._connections} open)")
+
+    def subscribe(self, connection: Connection, topic: str) -> None:
+        if connection.closed:
+            return
+        connection.topics.add(topic)
+        self._topics.setdefault(topic, set()).add(connection)
+
+    def unsubscribe(self, connection: Connection, topic: str) -> None:
+        connection.topics.discard(topic)
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self._topics[topic]
+
+    def push(self, connection: Connection, message: Message, coalesce_key: Optional[str] = None) -> bool:
+        """
+        Queue a message for one connection without waiting for the socket.
+
+        Args:
+            connection: Target connection
+            message: JSON-serialisable message
+            coalesce_key: If given, replaces any still-queued message with the same key
+
+        Returns:
+            False if the connection is closed or the message was rejected
+        """
+        if connection.closed:
+            return False
+        if coalesce_key is not None and coalesce_key in connection.latest:
+            connection.latest[coalesce_key] = message
+            self.coalesced += 1
+            return True
+
+        if len(connection.queue) >= self.max_queue:
+            if self.slow_consumer_policy == "disconnect":
+                self.slow_disconnects += 1
+                logger.warning(f"Disconnecting slow WebSocket consumer {connection.client_id}")
+                asyncio.ensure_future(self.disconnect(connection, code=1013))
+                return False
+            old_key, _, _ = connection.queue.popleft()
+            if old_key is not None:
+                connection.latest.pop(old_key, None)
+            self._queued -= 1
+            connection.dropped += 1
+            self.dropped += 1
+
+        if coalesce_key is not None:
+            connection.latest[coalesce_key] = message
+            message = None
+        connection.queue.append((coalesce_key, message, time.monotonic()))
+        self._queued += 1
+        if connection.writer is None:
+            connection.writer = asyncio.ensure_future(self._drain(connection))
+        return True
+
+    def send(self, client_id: str, message: Message, coalesce_key: Optional[str] = None) -> int:
+        """Queue a message for every connection of a client; returns the number queued."""
+        return sum(self.push(c, message, coalesce_key) for c in list(self._clients.get(client_id, ())))
+
+    def publish(self, topic: str, message: Message, coalesce_key: Optional[str] = None) -> int:
+        """Queue a message for every subscriber of a topic; returns the number queued."""
+        return sum(self.push(c, message, coalesce_key) for c in list(self._topics.get(topic, ())))
+
+    def send_threadsafe(self, client_id: str, message: Message, coalesce_key: Optional[str] = None) -> None:
+        """send() for pipeline worker threads; the message is queued on the hub's event loop."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.send, client_id, message, coalesce_key)
+
+    def publish_threadsafe(self, topic: str, message: Message, coalesce_key: Optional[str] = None) -> None:
+        """publish() for pipeline worker threads."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.publish, topic, message, coalesce_key)
+
+    async def _drain(self, connection: Connection) -> None:
+        try:
+            while connection.queue:
+                key, message, enqueued_at = connection.queue.popleft()
+                self._queued -= 1
+                if key is not None:
+                    message = connection.latest.pop(key)
+                await asyncio.wait_for(connection.websocket.send_json(message), self.send_timeout)
+                lag = time.monotonic() - enqueued_at
+                self._lag_ewma = 0.9 * self._lag_ewma + 0.1 * lag
+                self._lag_max = max(self._lag_max, lag)
+                connection.sent += 1
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"WebSocket send to {connection.client_id} failed: {e}")
+            await self.disconnect(connection, code=1011)
+        finally:
+            connection.writer = None
+
+    async def close_all(self, code: int = 1001) -> None:
+        """Close every connection, e.g. on shutdown."""
+        connections: List[Connection] = [c for peers in self._clients.values() for c in peers]
+        await asyncio.gather(*(self.disconnect(c, code) for c in connections), return_exceptions=True)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "connections": self._connections,
+            "clients": len(self._clients),
+            "topics": len(self._topics),
+            "queued": self._queued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "send_lag_ms": 1000.0 * self._lag_ewma,
+            "send_lag_max_ms": 1000.0 * self._lag_max,
+        }
+
+
+# Process-wide hub shared by all WebSocket endpoints
+ws_hub = ConnectionHub(
+    max_queue=settings.WS_SEND_QUEUE_SIZE,
+    slow_consumer_policy=settings.WS_SLOW_CONSUMER_POLICY,
+    send_timeout=settings.WS_SEND_TIMEOUT_S,
+)
@@ -1,8 +1,9 @@
+import json
 import logging
 import os
 import sys
 from pathlib import Path
-from typing import List, Optional
+from typing import Optional
 import uuid
 from datetime import datetime
 
@@ -10,11 +11,13 @@ from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect, R
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
-import uvicorn
 
 from app.api.routes import router as api_router
 from app.core.config import settings
-from app.services.virtual_tryon import process_virtual_tryon
+from app.services.shm_transport import shutdown_frame_executor, start_frame_executor
+from app.services.trace_artifacts import trace_recorder
+from app.services.virtual_tryon import process_virtual_tryon, virtual_tryon_service
+from app.services.ws_hub import ws_hub
 
 # Configure logging
 from log_config import get_logger
@@ -37,8 +40,12 @@ os.makedirs("logs", exist_ok=True)
 app = FastAPI(
     title="Virtual Try-On API",
     version="1.0.0",
-    on_startup=[lambda: logger.info("Starting Virtual Try-On API")],
-    on_shutdown=[lambda: logger.info("Shutting down Virtual Try-On API")]
+    # Run in each production worker after the fork (see app.core.server); the
+    # mask processes are forked first, while the worker has a single thread
+    on_startup=[lambda: logger.info("Starting Virtual Try-On API"), start_frame_executor,
+                virtual_tryon_service.warm_up],
+    on_shutdown=[lambda: logger.info("Shutting down Virtual Try-On API"), ws_hub.close_all,
+                 shutdown_frame_executor, trace_recorder.close]
 )
 
 # Global exception handler
@@ -77,31 +84,38 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
-# WebSocket endpoint for real-time updates
-active_connections: List[WebSocket] = []
-
+# WebSocket endpoint for real-time updates; connections are tracked by the hub
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await websocket.accept()
-    active_connections.append(websocket)
+    connection = await ws_hub.connect(websocket, client_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            # Handle incoming WebSocket messages if needed
+            text = await websocket.receive_text()
+            # Clients may send anything (e.g. "ping" keep-alives); only JSON
+            # objects are messages, other frames are ignored
+            try:
+                data = json.loads(text)
+            except ValueError:
+                continue
+            if not isinstance(data, dict) or not isinstance(data.get("topic"), str):
+                continue
+            # Topic subscriptions for events published through ws_hub
+            if data.get("type") == "subscribe":
+                ws_hub.subscribe(connection, data["topic"])
+            elif data.get("type") == "unsubscribe":
+                ws_hub.unsubscribe(connection, data["topic"])
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        pass
+    finally:
+        await ws_hub.disconnect(connection)
 
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to Virtual Try-On API"}
 
 if __name__ == "__main__":
-    logger.info("Starting Uvicorn server...")
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="debug",
-        access_log=True,
-    )
+    # SERVER_MODE=production pre-forks workers sharing the already loaded app;
+    # the default development mode runs a single reloading process
+    from app.core.server import run
+    logger.info(f"Starting server in {settings.SERVER_MODE} mode...")
+    run("main:app", app)
@@ -0,0 +1,83 @@
+"""
+Benchmark coarse-to-fine background removal against the full-resolution mask.
+
+Usage (from the backend directory):
+    python -m scripts.bench_background path/to/garments [--thumbnail 512] [--band 2] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, List
+
+import cv2
+import numpy as np
+
+from app.services.background import garment_mask, garment_mask_coarse_to_fine, mask_iou
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def _collect(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def _time_ms(fn: Callable[[], np.ndarray], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Garment images or directories of images")
+    parser.add_argument("--thumbnail", type=int, default=512, help="Longest side of the coarse thumbnail")
+    parser.add_argument("--band", type=int, default=2, help="Refinement margin in full-resolution pixels")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per image (median is reported)")
+    args = parser.parse_args()
+
+    files = _collect(args.paths)
+    if not files:
+        print("No images found", file=sys.stderr)
+        return 1
+
+    print(f"{'image':<40} {'size':>11} {'full ms':>9} {'c2f ms':>9} {'speedup':>8} {'IoU':>7}")
+    ious, speedups = [], []
+    for path in files:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"{os.path.basename(path):<40} unreadable")
+            continue
+        reference = garment_mask(image)
+        candidate = garment_mask_coarse_to_fine(image, args.thumbnail, args.band)
+        full_ms = _time_ms(lambda: garment_mask(image), args.repeat)
+        c2f_ms = _time_ms(lambda: garment_mask_coarse_to_fine(image, args.thumbnail, args.band), args.repeat)
+        iou = mask_iou(reference, candidate)
+        speedup = full_ms / c2f_ms if c2f_ms > 0 else float("inf")
+        ious.append(iou)
+        speedups.append(speedup)
+        h, w = image.shape[:2]
+        print(f"{os.path.basename(path)[:40]:<40} {f'{w}x{h}':>11} {full_ms:>9.1f} {c2f_ms:>9.1f} "
+              f"{speedup:>7.2f}x {iou:>7.4f}")
+
+    if ious:
+        print(f"\n{len(ious)} images: mean IoU {statistics.mean(ious):.4f}, min IoU {min(ious):.4f}, "
+              f"median speedup {statistics.median(speedups):.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Inspect, rebuild or compact the packed garment store of the catalogue.
+
+`repack` writes the current catalogue version into a fresh pack as a new
+version (converting format 1 .npy catalogues), leaving out any --drop ids, and
+makes it current. `info` lists the arrays of a pack.
+
+Usage (from the backend directory):
+    python -m scripts.garment_pack info [--root catalogue]
+    python -m scripts.garment_pack repack [--root catalogue] [--drop ID ...] [--keep 3]
+"""
+import argparse
+import os
+import sys
+
+from app.core.config import settings
+from app.services.catalogue import PACK_FILE, VERSIONS_DIR, read_current, repack
+from app.services.garment_store import PackReader
+
+
+def _info(root: str) -> int:
+    version = read_current(root)
+    if version is None:
+        print(f"No current catalogue version in {root}", file=sys.stderr)
+        return 1
+    path = os.path.join(root, VERSIONS_DIR, version, PACK_FILE)
+    if not os.path.exists(path):
+        print(f"Version {version} has no pack; run repack to build one", file=sys.stderr)
+        return 1
+    reader = PackReader(path)
+    size = os.path.getsize(path)
+    print(f"{path}: {len(reader.names())} arrays, {size / 1e6:.1f} MB "
+          f"({reader.data_bytes / max(size, 1):.1%} array data)")
+    for name in sorted(reader.names()):
+        array = reader.get(name)
+        print(f"  {name:<40} {'x'.join(map(str, array.shape)):>14} {array.nbytes / 1e3:>10.1f} kB")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("info", "repack"))
+    parser.add_argument("--root", default=settings.CATALOGUE_DIR, help="Catalogue root directory")
+    parser.add_argument("--drop", nargs="*", default=[], help="Garment ids to remove when repacking")
+    parser.add_argument("--keep", type=int, default=settings.CATALOGUE_KEEP_VERSIONS,
+                        help="Catalogue versions to keep, including the new one")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        return _info(args.root)
+
+    version, before, after = repack(args.root, args.drop, args.keep)
+    print(f"Catalogue version {version}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
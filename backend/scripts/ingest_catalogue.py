@@ -0,0 +1,54 @@
+"""
+Ingest a directory of garment images into the versioned garment catalogue.
+
+Every garment gets its type, premultiplied cutout, bounding box, anchor points
+and pre-scaled sizes precomputed; the new version becomes current once it is
+fully written. Try-on requests then refer to garments by garment_id.
+
+Usage (from the backend directory):
+    python -m scripts.ingest_catalogue path/to/garments [--root catalogue] [--widths 256,512] [--keep 3]
+"""
+import argparse
+import functools
+import sys
+
+from app.core.config import settings
+from app.services.background import remove_background
+from app.services.catalogue import GarmentCatalogue, ingest_directory
+from app.services.garment_type import detect_garment_type
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory of garment images")
+    parser.add_argument("--root", default=settings.CATALOGUE_DIR, help="Catalogue root directory")
+    parser.add_argument("--widths", default=settings.CATALOGUE_PRESCALED_WIDTHS,
+                        help="Frame widths of pre-scaled cutouts, comma separated")
+    parser.add_argument("--keep", type=int, default=settings.CATALOGUE_KEEP_VERSIONS,
+                        help="Catalogue versions to keep, including the new one")
+    args = parser.parse_args()
+
+    # The request path's garment type detection and background removal, without loading its models
+    remove = functools.partial(
+        remove_background,
+        coarse_to_fine=settings.BG_REMOVAL_COARSE_TO_FINE,
+        thumbnail_size=settings.BG_REMOVAL_THUMBNAIL_SIZE,
+        band=settings.BG_REMOVAL_REFINE_BAND,
+    )
+    widths = [int(w) for w in args.widths.split(",") if w.strip()]
+    version = ingest_directory(args.source, args.root, detect_garment_type, remove, widths, args.keep)
+
+    catalogue = GarmentCatalogue(args.root)
+    catalogue.refresh(force=True)
+    print(f"Catalogue version {version}: {len(catalogue.ids())} garments")
+    print(f"{'garment_id':<32} {'type':<6} {'size':>11} {'bbox':>22}  anchors")
+    for garment_id in catalogue.ids():
+        entry = catalogue.entry(garment_id)
+        size = f"{entry.source_size[0]}x{entry.source_size[1]}"
+        print(f"{garment_id:<32} {entry.garment_type:<6} {size:>11} {str(entry.bbox):>22}  "
+              f"{', '.join(entry.anchors)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""
+Load generator for the try-on API.
+
+Virtual users send a weighted mix of image uploads (/api/upload/image), HTTP
+try-ons (/api/try-on with file uploads) and WebSocket try-ons
+(/api/ws/try-on/{client_id}, one connection per user) built from synthetic
+images. Each user sends its next request as soon as the previous one
+finishes. The report gives throughput, p50/p95/p99 latency, error rates by
+status and the server-side stage timings for each scenario.
+
+Without --url the app is started in this process on a free local port. The
+client then competes with the server for CPU, so use --url against a
+separately started server for capacity numbers.
+
+Usage (from the backend directory):
+    python -m scripts.loadgen [--url http://localhost:8000] [--concurrency 8] [--duration 60]
+                              [--mix upload=1,try-on=4,ws=2] [--json report.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import cv2
+import httpx
+import numpy as np
+import websockets
+
+SCENARIOS = ("upload", "try-on", "ws")
+
+# Status recorded for transport failures and timeouts, which have no HTTP status
+NO_STATUS = 0
+
+
+@dataclass
+class Sample:
+    scenario: str
+    status: int
+    latency_s: float
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse "upload=1,try-on=4,ws=2" into scenario weights."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}; expected one of {', '.join(SCENARIOS)}")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight for {name}: {weight!r}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("At least one scenario needs a positive weight")
+    return mix
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    width, _, height = text.lower().partition("x")
+    try:
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got {text!r}")
+
+
+def synthetic_person(size: Tuple[int, int], rng: random.Random) -> np.ndarray:
+    """A standing figure on a plain background; enough structure for pose estimation to run."""
+    width, height = size
+    image = np.full((height, width, 3), [rng.randint(150, 230) for _ in range(3)], dtype=np.uint8)
+    skin = (rng.randint(90, 140), rng.randint(130, 180), rng.randint(180, 230))
+    cloth = tuple(rng.randint(30, 200) for _ in range(3))
+    cx = width // 2 + rng.randint(-width // 20, width // 20)
+    unit = height / 8
+    cv2.circle(image, (cx, int(unit * 1.2)), int(unit * 0.5), skin, -1)
+    cv2.rectangle(image, (cx - int(unit * 0.15), int(unit * 1.6)), (cx + int(unit * 0.15), int(unit * 2.0)), skin, -1)
+    cv2.rectangle(image, (int(cx - unit * 0.9), int(unit * 2.0)), (int(cx + unit * 0.9), int(unit * 4.6)), cloth, -1)
+    for side in (-1, 1):
+        shoulder = cx + side * int(unit * 0.9)
+        cv2.line(image, (shoulder, int(unit * 2.1)), (shoulder + side * int(unit * 0.5), int(unit * 4.4)), skin,
+                 int(unit * 0.3))
+        inner, outer = sorted((cx + side * int(unit * 0.1), cx + side * int(unit * 0.7)))
+        cv2.rectangle(image, (inner, int(unit * 4.6)), (outer, int(unit * 7.6)), (60, 50, 40), -1)
+    noise = np.random.default_rng(rng.getrandbits(32)).integers(0, 8, image.shape, dtype=np.uint8)
+    return cv2.add(image, noise)
+
+
+def synthetic_garment(size: Tuple[int, int], rng: random.Random) -> np.ndarray:
+    """A T-shirt silhouette on white, the kind of product shot background removal expects."""
+    width, height = size
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    w, h = width / 10, height / 10
+    shirt = np.array([
+        (3, 1), (4, 1.5), (6, 1.5), (7, 1), (9.5, 3), (8.5, 4.5), (7.5, 3.8),
+        (7.5, 9), (2.5, 9), (2.5, 3.8), (1.5, 4.5), (0.5, 3),
+    ]) * (w, h)
+    color = tuple(rng.randint(0, 220) for _ in range(3))
+    cv2.fillPoly(image, [shirt.astype(np.int32)], color)
+    return image
+
+
+def encode_jpeg(image: np.ndarray, quality: int = 90) -> bytes:
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Could not encode a synthetic image")
+    return buffer.tobytes()
+
+
+def make_images(count: int, size: Tuple[int, int], seed: int) -> List[Tuple[bytes, bytes]]:
+    """Encoded (user, garment) pairs; requests cycle through them."""
+    rng = random.Random(seed)
+    garment_size = (size[0] * 3 // 4, size[0] * 3 // 4)
+    return [
+        (encode_jpeg(synthetic_person(size, rng)), encode_jpeg(synthetic_garment(garment_size, rng)))
+        for _ in range(count)
+    ]
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Linearly interpolated percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        base_url: str,
+        images: List[Tuple[bytes, bytes]],
+        concurrency: int,
+        timeout: float,
+        upload_folder: str,
+        progressive: bool = False
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):]
+        self.images = images
+        self.timeout = timeout
+        self.upload_folder = upload_folder
+        self.progressive = progressive
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        # Server-side paths of the uploaded images, for WebSocket try-ons
+        self.server_paths: List[Tuple[str, str]] = []
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def _upload(self, name: str, data: bytes) -> httpx.Response:
+        return await self.client.post("/api/upload/image", files={"file": (name, data, "image/jpeg")})
+
+    async def prepare_ws(self) -> None:
+        """Upload every image pair once; WebSocket try-ons refer to images by server path."""
+        for index, (user, garment) in enumerate(self.images):
+            paths = []
+            for name, data in ((f"user_{index}.jpg", user), (f"garment_{index}.jpg", garment)):
+                response = await self._upload(name, data)
+                response.raise_for_status()
+                paths.append(os.path.join(self.upload_folder, response.json()["filename"]))
+            self.server_paths.append((paths[0], paths[1]))
+
+    async def upload(self, index: int) -> Sample:
+        started = time.perf_counter()
+        try:
+            response = await self._upload("user.jpg", self.images[index % len(self.images)][0])
+            status = response.status_code
+        except httpx.HTTPError:
+            status = NO_STATUS
+        return Sample("upload", status, time.perf_counter() - started)
+
+    async def try_on(self, index: int, client_id: str) -> Sample:
+        user, garment = self.images[index % len(self.images)]
+        started = time.perf_counter()
+        timings = {}
+        try:
+            response = await self.client.post(
+                "/api/try-on",
+                params={"client_id": client_id},
+                files={
+                    "user_image_file": ("user.jpg", user, "image/jpeg"),
+                    "garment_image_file": ("garment.jpg", garment, "image/jpeg"),
+                },
+            )
+            status = response.status_code
+            if response.is_success:
+                timings = response.json().get("timings") or {}
+        except httpx.HTTPError:
+            status = NO_STATUS
+        return Sample("try-on", status, time.perf_counter() - started, timings)
+
+    async def ws_try_on(self, index: int, connection: Any) -> Sample:
+        user, garment = self.server_paths[index % len(self.server_paths)]
+        started = time.perf_counter()
+        await connection.send(json.dumps({
+            "type": "try_on", "user_image": user, "garment_image": garment, "progressive": self.progressive
+        }))
+        while True:
+            remaining = self.timeout - (time.perf_counter() - started)
+            message = json.loads(await asyncio.wait_for(connection.recv(), max(remaining, 0.001)))
+            if message["type"] == "result":
+                return Sample("ws", 200, time.perf_counter() - started, message.get("timings") or {})
+            if message["type"] == "error":
+                return Sample("ws", int(message.get("status") or 500), time.perf_counter() - started)
+
+    async def run_user(
+        self,
+        user_id: int,
+        mix: Dict[str, float],
+        samples: List[Sample],
+        budget: Dict[str, float],
+        seed: int
+    ) -> None:
+        """
+        Send requests back to back until the deadline passes or the shared
+        request budget runs out.
+        """
+        rng = random.Random(seed + user_id)
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        client_id = f"loadgen-{user_id}"
+        connection = None
+        try:
+            while time.monotonic() < budget["deadline"] and budget["remaining"] != 0:
+                budget["remaining"] -= 1
+                scenario = rng.choices(names, weights)[0]
+                index = rng.randrange(len(self.images))
+                if scenario == "upload":
+                    samples.append(await self.upload(index))
+                elif scenario == "try-on":
+                    samples.append(await self.try_on(index, client_id))
+                else:
+                    started = time.perf_counter()
+                    try:
+                        if connection is None:
+                            connection = await websockets.connect(
+                                f"{self.ws_url}/api/ws/try-on/{client_id}", max_size=None
+                            )
+                        samples.append(await self.ws_try_on(index, connection))
+                    except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                        samples.append(Sample("ws", NO_STATUS, time.perf_counter() - started))
+                        if connection is not None:
+                            await connection.close()
+                        connection = None
+        finally:
+            if connection is not None:
+                await connection.close()
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+    """Per-scenario (and overall) latency, throughput, error and stage timing statistics."""
+    groups: Dict[str, List[Sample]] = defaultdict(list)
+    for sample in samples:
+        groups[sample.scenario].append(sample)
+        groups["all"].append(sample)
+    report = {}
+    for name in [*SCENARIOS, "all"]:
+        group = groups.get(name)
+        if not group:
+            continue
+        latencies = sorted(sample.latency_s * 1000.0 for sample in group if sample.ok)
+        errors = sum(1 for sample in group if not sample.ok)
+        stages: Dict[str, List[float]] = defaultdict(list)
+        for sample in group:
+            for stage, ms in sample.timings.items():
+                stages[stage].append(ms)
+        report[name] = {
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": errors / len(group),
+            "statuses": dict(sorted(Counter(sample.status for sample in group).items())),
+            "throughput_per_s": (len(group) - errors) / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "mean": statistics.mean(latencies) if latencies else 0.0,
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1] if latencies else 0.0,
+            },
+            "server_stage_ms": {
+                stage: {"p50": percentile(sorted(values), 0.50), "p95": percentile(sorted(values), 0.95)}
+                for stage, values in sorted(stages.items())
+            },
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any], elapsed: float, concurrency: int) -> None:
+    print(f"\n{concurrency} users for {elapsed:.1f}s")
+    print(f"{'scenario':<10} {'requests':>9} {'ok/s':>8} {'err %':>8} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}  statuses")
+    for name, row in report.items():
+        latency = row["latency_ms"]
+        statuses = " ".join(f"{status or 'none'}:{count}" for status, count in row["statuses"].items())
+        print(f"{name:<10} {row['requests']:>9} {row['throughput_per_s']:>8.2f} {row['error_rate']:>7.1%} "
+              f"{latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f} {latency['max']:>9.1f}  "
+              f"{statuses}")
+    for name, row in report.items():
+        if name == "all" or not row["server_stage_ms"]:
+            continue
+        print(f"\nServer stage timings, {name} (p50 / p95 ms)")
+        for stage, values in row["server_stage_ms"].items():
+            print(f"  {stage:<28} {values['p50']:>9.1f} {values['p95']:>9.1f}")
+
+
+@contextmanager
+def serve_in_process() -> Iterator[str]:
+    """Run the app on a free local port in a background thread; yields its base URL."""
+    import uvicorn
+    from main import app
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, name="loadgen-server", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The in-process server failed to start")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+        sock.close()
+
+
+async def run(args: argparse.Namespace, base_url: str) -> Dict[str, Any]:
+    images = make_images(args.variants, args.size, args.seed)
+    generator = LoadGenerator(base_url, images, args.concurrency, args.timeout, args.upload_folder,
+                              args.progressive)
+    try:
+        if args.mix.get("ws", 0) > 0:
+            await generator.prepare_ws()
+        if args.warmup:
+            warmup_budget = {"deadline": math.inf, "remaining": args.warmup}
+            await generator.run_user(-1, args.mix, [], warmup_budget, args.seed)
+        samples: List[Sample] = []
+        # A negative remaining count never reaches zero, i.e. only the deadline applies
+        budget = {
+            "deadline": time.monotonic() + (args.duration if not args.requests else math.inf),
+            "remaining": args.requests or -1,
+        }
+        started = time.monotonic()
+        await asyncio.gather(*(
+            generator.run_user(user_id, args.mix, samples, budget, args.seed) for user_id in range(args.concurrency)
+        ))
+        elapsed = time.monotonic() - started
+    finally:
+        await generator.close()
+    report = summarize(samples, elapsed)
+    print_report(report, elapsed, args.concurrency)
+    return {"url": base_url, "concurrency": args.concurrency, "elapsed_s": elapsed, "scenarios": report}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running server; default: start the app in this process")
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users sending requests back to back")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run (ignored with --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests in total")
+    parser.add_argument("--warmup", type=int, default=0, help="Unrecorded requests sent first, e.g. to load models")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("upload=1,try-on=4,ws=2"),
+                        help="Scenario weights, e.g. upload=1,try-on=4,ws=2")
+    parser.add_argument("--size", type=parse_size, default=(768, 1024), help="User image size as WIDTHxHEIGHT")
+    parser.add_argument("--variants", type=int, default=16,
+                        help="Distinct image pairs; fewer means more coalesced and near-duplicate requests")
+    parser.add_argument("--progressive", action="store_true", help="Ask for a preview in WebSocket try-ons")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--upload-folder", default=None,
+                        help="Server's UPLOAD_FOLDER, for WebSocket image paths (default: this process's setting)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for images and scenario choices")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+    if args.concurrency < 1 or args.variants < 1:
+        parser.error("--concurrency and --variants must be at least 1")
+    if args.upload_folder is None:
+        from app.core.config import settings
+        args.upload_folder = settings.UPLOAD_FOLDER
+
+    if args.url:
+        report = asyncio.run(run(args, args.url))
+    else:
+        with serve_in_process() as base_url:
+            report = asyncio.run(run(args, base_url))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    # Fail only when nothing got through, e.g. a wrong --url
+    overall = report["scenarios"].get("all")
+    return 0 if overall and overall["errors"] < overall["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import cv2
+import numpy as np
+
+from app.services.background import garment_mask, garment_mask_coarse_to_fine, mask_iou
+
+
+def garment_with_white_logo(h: int = 1800, w: int = 1200) -> np.ndarray:
+    image = np.full((h, w, 3), 245, np.uint8)
+    cv2.rectangle(image, (200, 200), (w - 200, h - 200), (40, 60, 160), -1)
+    # White logo separated from the garment edge by a dark border narrower
+    # than the refinement band
+    cv2.rectangle(image, (w - 400, 700), (w - 224, 900), (250, 250, 250), -1)
+    return image
+
+
+def test_coarse_to_fine_matches_full_mask():
+    image = garment_with_white_logo()
+    assert mask_iou(garment_mask(image), garment_mask_coarse_to_fine(image, thumbnail_size=300, band=30)) > 0.99
+
+
+def test_coarse_to_fine_keeps_white_areas_inside_the_contour():
+    image = garment_with_white_logo()
+    mask = garment_mask_coarse_to_fine(image, thumbnail_size=300, band=30)
+    logo = mask[700:901, 1200 - 400:1200 - 223]
+    assert np.all(logo == 255)
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app.services.task_queue import DONE, FAILED, InMemoryBroker, SQLiteBroker  # noqa: E402
+
+# Short enough that tests can wait it out
+VISIBILITY_TIMEOUT_S = 0.05
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def broker(request, tmp_path):
+    kwargs = {"visibility_timeout": VISIBILITY_TIMEOUT_S, "max_attempts": 2}
+    if request.param == "memory":
+        return InMemoryBroker(**kwargs)
+    return SQLiteBroker(str(tmp_path / "tasks.db"), **kwargs)
+
+
+def expire(broker) -> int:
+    time.sleep(VISIBILITY_TIMEOUT_S * 2)
+    return broker.requeue_expired()
+
+
+def test_ack_stores_result(broker):
+    task_id = broker.enqueue({"kind": "try_on", "n": 1})
+    task = broker.reserve("w1", wait=0)
+    assert task.task_id == task_id
+    assert task.payload == {"kind": "try_on", "n": 1}
+    assert task.attempts == 1
+
+    assert broker.ack(task.task_id, task.receipt, {"result_path": "r.jpg"})
+    result = broker.wait_result(task_id, timeout=1)
+    assert result.status == DONE
+    assert result.value == {"result_path": "r.jpg"}
+    assert broker.reserve("w1", wait=0) is None
+
+
+def test_nack_retries_then_fails(broker):
+    task_id = broker.enqueue({"kind": "try_on"})
+    first = broker.reserve("w1", wait=0)
+    assert broker.nack(first.task_id, first.receipt, "boom")
+
+    second = broker.reserve("w2", wait=0)
+    assert second.task_id == task_id
+    assert second.attempts == 2
+    assert broker.nack(second.task_id, second.receipt, "boom again")
+
+    result = broker.wait_result(task_id, timeout=1)
+    assert result.status == FAILED
+    assert result.error == "boom again"
+    assert broker.reserve("w1", wait=0) is None
+
+
+def test_visibility_timeout_requeues(broker):
+    task_id = broker.enqueue({"kind": "try_on"})
+    broker.reserve("w1", wait=0)
+    assert broker.reserve("w2", wait=0) is None
+
+    assert expire(broker) == 1
+    task = broker.reserve("w2", wait=0)
+    assert task.task_id == task_id
+    assert task.attempts == 2
+
+
+def test_max_attempts_fails_expired_task(broker):
+    task_id = broker.enqueue({"kind": "try_on"})
+    broker.reserve("w1", wait=0)
+    expire(broker)
+    broker.reserve("w2", wait=0)
+    expire(broker)
+
+    result = broker.wait_result(task_id, timeout=1)
+    assert result.status == FAILED
+    assert result.error == "Visibility timeout exceeded"
+    assert broker.reserve("w3", wait=0) is None
+
+
+def test_late_ack_after_requeue_is_ignored(broker):
+    task_id = broker.enqueue({"kind": "try_on"})
+    stale = broker.reserve("w1", wait=0)
+    expire(broker)
+
+    # The task is queued again; the first worker's ack must not complete it
+    assert not broker.ack(stale.task_id, stale.receipt, {"result_path": "stale.jpg"})
+    assert not broker.nack(stale.task_id, stale.receipt, "stale")
+    task = broker.reserve("w2", wait=0)
+    assert task.task_id == task_id
+
+    # Nor once another worker holds it
+    assert not broker.ack(stale.task_id, stale.receipt, {"result_path": "stale.jpg"})
+    assert broker.ack(task.task_id, task.receipt, {"result_path": "fresh.jpg"})
+    assert broker.wait_result(task_id, timeout=1).value == {"result_path": "fresh.jpg"}
+
+
+def test_reserve_after_late_ack_takes_next_task(broker):
+    first_id = broker.enqueue({"n": 1})
+    second_id = broker.enqueue({"n": 2})
+    stale = broker.reserve("w1", wait=0)
+    assert stale.task_id == first_id
+    expire(broker)
+    broker.ack(stale.task_id, stale.receipt, {})
+
+    taken = {broker.reserve("w2", wait=0).task_id, broker.reserve("w2", wait=0).task_id}
+    assert taken == {first_id, second_id}
+    assert broker.reserve("w2", wait=0) is None
+
+
+def test_wait_result_times_out_while_task_runs(broker):
+    task_id = broker.enqueue({"kind": "try_on"})
+    task = broker.reserve("w1", wait=0)
+    assert broker.wait_result(task_id, timeout=0.05) is None
+
+    assert broker.ack(task.task_id, task.receipt, {"result_path": "r.jpg"})
+    assert broker.wait_result(task_id, timeout=1).status == DONE
+    # Each result is returned once
+    assert broker.wait_result(task_id, timeout=0.05) is None
@@ -0,0 +1,172 @@
+"""
+Compute worker: runs try-on tasks that API nodes (COMPUTE_MODE=queue) put on
+the broker at TASK_BROKER_URL.
+
+Each worker process runs COMPUTE_WORKER_CONCURRENCY tasks at a time. Workers
+need the same uploads, static and catalogue directories as the API nodes
+(e.g. shared volumes), since tasks carry file paths rather than pixels.
+
+Usage (from the backend directory):
+    python worker.py
+"""
+import asyncio
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.services.file_io import remove_files
+from app.services.shm_transport import shutdown_frame_executor, start_frame_executor
+from app.services.task_queue import Broker, Task, get_broker
+from app.services.trace_artifacts import trace_recorder
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+# Seconds a slot waits on the broker before checking for shutdown
+RESERVE_WAIT_S = 1.0
+# Longest pause between reserve attempts while the broker is unreachable
+RESERVE_MAX_BACKOFF_S = 30.0
+# Interval between sweeps for tasks whose worker died
+REAPER_INTERVAL_S = 5.0
+
+
+async def handle(task: Task) -> Dict[str, Any]:
+    """Run one task and return its result value."""
+    from app.services.virtual_tryon import virtual_tryon_service
+
+    payload = task.payload
+    if payload.get("kind") != "try_on":
+        raise ValueError(f"Unknown task kind: {payload.get('kind')}")
+    timings: Dict[str, float] = {}
+    result_path = await virtual_tryon_service.process_virtual_tryon(
+        payload["user_image"],
+        payload.get("garment_image"),
+        timings=timings,
+        pose_backend=payload.get("pose_backend"),
+        garment_id=payload.get("garment_id"),
+        trace=payload.get("trace", False),
+    )
+    return {"result_path": result_path, "timings": timings}
+
+
+async def settle(loop: asyncio.AbstractEventLoop, executor: ThreadPoolExecutor, call, task: Task, *args) -> bool:
+    """
+    Ack or nack a task; if the broker is unreachable the task is redelivered after its visibility timeout.
+
+    Returns:
+        True if this worker still held the reservation
+    """
+    try:
+        if await loop.run_in_executor(executor, call, task.task_id, task.receipt, *args):
+            return True
+        logger.warning(f"Task {task.task_id} was handed to another worker before it finished; result dropped")
+    except Exception as e:
+        logger.error(f"Error settling task {task.task_id}: {str(e)}", exc_info=True)
+    return False
+
+
+async def slot(broker: Broker, worker_id: str, executor: ThreadPoolExecutor, stop: asyncio.Event) -> None:
+    """Take tasks one at a time until stopped; one slot per concurrent task."""
+    loop = asyncio.get_running_loop()
+    backoff = 0.0
+    while not stop.is_set():
+        try:
+            task = await loop.run_in_executor(executor, broker.reserve, worker_id, RESERVE_WAIT_S)
+        except Exception as e:
+            # Broker unreachable; back off instead of ending the slot
+            backoff = min(RESERVE_MAX_BACKOFF_S, backoff * 2 or RESERVE_WAIT_S)
+            logger.error(f"{worker_id} could not reserve a task, retrying in {backoff:.0f}s: {str(e)}")
+            try:
+                await asyncio.wait_for(stop.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        backoff = 0.0
+        if task is None:
+            continue
+        logger.info(f"{worker_id} took task {task.task_id} (attempt {task.attempts})")
+        last_attempt = task.attempts >= broker.max_attempts
+        try:
+            value = await handle(task)
+        except HTTPException as e:
+            if e.status_code < 500:
+                # Bad input fails the same way on every attempt
+                finished = await settle(loop, executor, broker.ack, task,
+                                        {"status_code": e.status_code, "detail": e.detail})
+            else:
+                finished = await settle(loop, executor, broker.nack, task, str(e.detail)) and last_attempt
+        except Exception as e:
+            logger.error(f"Task {task.task_id} failed: {str(e)}", exc_info=True)
+            finished = await settle(loop, executor, broker.nack, task, str(e)) and last_attempt
+        else:
+            finished = await settle(loop, executor, broker.ack, task, value)
+        if finished:
+            # The task owns its uploads; the API node may have stopped waiting for it
+            await remove_files(task.payload.get("cleanup") or ())
+
+
+async def reaper(broker: Broker, executor: ThreadPoolExecutor, stop: asyncio.Event) -> None:
+    """Return tasks of crashed or stalled workers to the queue."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            expired = await loop.run_in_executor(executor, broker.requeue_expired)
+            if expired:
+                logger.warning(f"Requeued {expired} tasks past their visibility timeout")
+        except Exception as e:
+            logger.error(f"Error requeueing expired tasks: {str(e)}", exc_info=True)
+        try:
+            await asyncio.wait_for(stop.wait(), REAPER_INTERVAL_S)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_worker(broker: Broker, concurrency: int, stop: asyncio.Event) -> None:
+    """
+    Run `concurrency` task slots plus the reaper until stop is set; tasks in
+    progress are finished before returning.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    # Broker calls block; keep them off the default executor the pipeline uses
+    executor = ThreadPoolExecutor(max_workers=concurrency + 1, thread_name_prefix="broker")
+    logger.info(f"Worker {worker_id} consuming {settings.TASK_BROKER_URL} with {concurrency} slots")
+    try:
+        await asyncio.gather(
+            reaper(broker, executor, stop),
+            *(slot(broker, f"{worker_id}/{i}", executor, stop) for i in range(concurrency)),
+        )
+    finally:
+        executor.shutdown(wait=False)
+    logger.info(f"Worker {worker_id} stopped")
+
+
+async def main() -> None:
+    # Load the models and calibrate before taking tasks; mask processes are
+    # forked first, while this process has a single thread
+    from app.services.virtual_tryon import virtual_tryon_service
+    start_frame_executor()
+    virtual_tryon_service.warm_up()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    concurrency = settings.COMPUTE_WORKER_CONCURRENCY or os.cpu_count() or 1
+    await run_worker(get_broker(), concurrency, stop)
+    shutdown_frame_executor()
+    trace_recorder.close()
+
+
+if __name__ == "__main__":
+    if settings.TASK_BROKER_URL.startswith("memory://"):
+        sys.exit("memory:// brokers only work within one process; use sqlite:/// or redis://")
+    # Workers run the try-ons themselves (and load the models for them), even
+    # with an environment shared with queue-mode API nodes
+    settings.COMPUTE_MODE = "local"
+    asyncio.run(main())